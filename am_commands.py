@@ -1,10 +1,10 @@
 import re
-import subprocess
 import collections
 import errno
+import threading
+import time
 from os import makedirs
 from os.path import join, isfile, split
-import xml.etree.ElementTree as ET
 
 import sublime
 import sublime_plugin
@@ -17,13 +17,113 @@ command_panel_view_id = None
 last_typed_command = ""
 last_highlighted_index = -1
 
+# incremental readers per history path and index of all commands,
+# see extract_matlab_history()
+history_readers = {}
+history_index = None
+history_lock = threading.Lock()
+
+# persistent matlab session and its output,
+# see RunMatlabCommandCommand.get_session()
+matlab_session = None
+matlab_session_output = None
+
 
 def plugin_loaded():
     """Do imports that need to wait for Sublime API initilization
     """
-    global config, abspath
+    global config, abspath, mhistory, mtransport
     import AutoMatlab.lib.config as config
     from AutoMatlab.lib.abspath import abspath
+    import AutoMatlab.lib.mhistory as mhistory
+    import AutoMatlab.lib.mtransport as mtransport
+
+    # read matlab history in advance, such that the command panel opens
+    # without delay
+    sublime.set_timeout_async(extract_matlab_history, 0)
+
+
+def plugin_unloaded():
+    """Stop persistent matlab session
+    """
+    if matlab_session:
+        matlab_session.close()
+
+
+class MatlabSessionOutput:
+
+    """Stream output of the persistent matlab session into an output panel.
+    Output is collected and appended in batches, such that sessions that
+    print a lot of output do not block the user interface.
+    """
+
+    def __init__(self, window):
+        self.window = window
+        self.lock = threading.Lock()
+        self.pending = [] # text to append
+        self.scheduled = False # whether an append is scheduled
+        self.commands = {} # id -> [command, start time]
+
+    def get_panel(self):
+        """Get output panel, which is created if it does not exist
+        """
+        panel = self.window.find_output_panel(
+            config.MATLAB_SESSION_OUTPUT_PANEL)
+        if not panel:
+            panel = self.window.create_output_panel(
+                config.MATLAB_SESSION_OUTPUT_PANEL)
+            panel.settings().set('word_wrap', False)
+            panel.settings().set('scroll_past_end', False)
+        return panel
+
+    def show(self):
+        """Show output panel
+        """
+        self.get_panel()
+        self.window.run_command('show_panel', {
+            'panel': 'output.' + config.MATLAB_SESSION_OUTPUT_PANEL})
+
+    def sent(self, id, command):
+        """Register command sent to the session
+        """
+        with self.lock:
+            self.commands[id] = [command, time.time()]
+        self.append('>> {}\n'.format(command))
+
+    def output(self, stream, text):
+        """Append output of the session
+        """
+        self.append(text)
+
+    def done(self, id):
+        """Append end-of-command marker
+        """
+        with self.lock:
+            [command, start] = self.commands.pop(id, ['', time.time()])
+        self.append('[Finished in {:.1f}s: {}]\n'.format(
+            time.time() - start, command.splitlines()[0] if command else ''))
+
+    def append(self, text):
+        """Queue text to be appended to the output panel
+        """
+        with self.lock:
+            self.pending.append(text)
+            if self.scheduled:
+                return
+            self.scheduled = True
+        sublime.set_timeout(self.flush,
+                            config.MATLAB_SESSION_OUTPUT_DELAY)
+
+    def flush(self):
+        """Append queued text to the output panel
+        """
+        with self.lock:
+            text = ''.join(self.pending)
+            self.pending = []
+            self.scheduled = False
+        if text:
+            self.get_panel().run_command('append', {
+                'characters': text, 'force': True, 'scroll_to_end': True})
 
 
 def get_view_content(view_id):
@@ -38,37 +138,68 @@ def extract_matlab_history():
     """
     settings = sublime.load_settings('AutoMatlab.sublime-settings')
     history_length = settings.get('matlab_history_length', 100)
+    history_order = settings.get('matlab_history_order', 'frecency')
     history_path = settings.get('matlab_history_path', 'default')
     if history_path == 'default':
-        history_path = config.DEFAULT_MATLAB_HISTORY_PATH
+        history_path = config.default_matlab_history_path()
     else:
         history_path = abspath(history_path)
 
     if not isfile(history_path):
         return None
 
-    # try reading history_path
-    # (might yield error when simultaneously being writting by matlab?)
-    try:
-        root = ET.parse(history_path).getroot()
-    except:
-        return []
-
-    history = []
-    # get sessions from history and parse in reversed order
-    for session in root.findall('session')[::-1]:
-        # parse commands per sessions (in reversed order)
-        for command in session[::-1]:
-            # select commands (not timestamps)
-            if command.get('execution_time'):
-                history.append(command.text)
-            if len(history) == history_length:
-                break
-        if len(history) == history_length:
-            break
+    with history_lock:
+        # read history_path, only parsing the sessions that were added since
+        # the last read
+        if history_path not in history_readers:
+            history_readers[history_path] = \
+                mhistory.HistoryReader(history_path)
+        commands = history_readers[history_path].read()
+        if commands is None:
+            return []
+
+        # add new commands to the index of all commands
+        index = get_matlab_history_index()
+        if index.update(history_path, commands):
+            sublime.set_timeout_async(save_matlab_history_index, 0)
+
+        if history_order == 'frecency':
+            # get all commands ever run, by descending frecency
+            return index.ranked(history_length or None)
+
+    # get last commands in reversed order
+    if history_length:
+        history = commands[:-history_length - 1:-1]
+    else:
+        history = commands[::-1]
 
     return list(collections.OrderedDict.fromkeys(history))
 
+
+def get_matlab_history_index():
+    """Get index of all commands in the matlab history, which is loaded on
+    first use
+    """
+    global history_index
+    if history_index is None:
+        history_index = mhistory.HistoryIndex.load(
+            join(sublime.cache_path(), config.MATLAB_HISTORY_INDEX_PATH))
+    return history_index
+
+
+def save_matlab_history_index():
+    """Store index of all commands in the matlab history
+    """
+    with history_lock:
+        try:
+            history_index.dump(join(sublime.cache_path(),
+                                    config.MATLAB_HISTORY_INDEX_PATH))
+        except Exception as e:
+            print('[WARNING] AutoMatlab - Cannot store Matlab history '
+                  'index: {}'.format(e))
+
+
+
 class OpenAutoMatlabCommandPanelCommand(sublime_plugin.TextCommand):
 
     """Open the AutoMatlab command panel, for running commands in Matlab
@@ -235,12 +366,14 @@ class AutoMatlabCommandPanelListener(sublime_plugin.EventListener):
 
 class RunMatlabCommandCommand(sublime_plugin.WindowCommand):
 
-    """Run a command in Matlab, via AutoHotkey
+    """Run a command in Matlab, via AutoHotkey or in a persistent Matlab
+    session
     """
 
     def run(self, command, type='text'):
-        """Run the provided command in Matlab, using AutoHotkey.
-        Any sublime variable in the command will be replaced by its value.
+        """Run the provided command in Matlab, using the transport specified
+        in the settings. Any sublime variable in the command will be replaced
+        by its value.
         """
         # get sublime variables and extend for matlab
         vars = self.window.extract_variables()
@@ -269,20 +402,35 @@ class RunMatlabCommandCommand(sublime_plugin.WindowCommand):
         # substitute sublime variables in command
         command = sublime.expand_variables(command, vars)
 
+        # get transport
+        settings = sublime.load_settings('AutoMatlab.sublime-settings')
+        if settings.get('matlab_transport', 'auto_hotkey') == 'session':
+            transport = self.get_session()
+        else:
+            transport = self.get_auto_hotkey()
+
+        # run command
+        try:
+            transport.send(command, type)
+        except Exception as e:
+            msg = '[ERROR] AutoMatlab - {}'.format(e)
+            self.window.status_message(msg)
+            raise e
+
+        if transport is matlab_session:
+            matlab_session_output.show()
+
+    def get_auto_hotkey(self):
+        """Get AutoHotkey transport
+        """
         # read ahk settings
         settings = sublime.load_settings('AutoMatlab.sublime-settings')
         ahk_return_focus = settings.get('auto_hotkey_return_focus', True)
         ahk_sleep_multiplier = settings.get('auto_hotkey_sleep_multiplier', 1)
+        ahk_paste_commands = settings.get('auto_hotkey_paste_commands', True)
         ahk_path = settings.get('auto_hotkey_path', 'default')
         if ahk_path == 'default':
             ahk_path = config.DEFAULT_AUTO_HOTKEY_PATH
-        if type == 'key':
-            command_type = type
-        else:
-            if settings.get('auto_hotkey_paste_commands', True):
-                command_type = 'paste'
-            else:
-                command_type = 'insert'
 
         # check ahk path
         if not isfile(ahk_path):
@@ -315,13 +463,89 @@ class RunMatlabCommandCommand(sublime_plugin.WindowCommand):
                 fh.write(sublime.load_resource(ahk_script_resource).replace(
                     '\r\n', '\n'))
 
-        # run command
-        subprocess.Popen([ahk_path,
-                          ahk_script_path,
-                          command,
-                          command_type,
-                          '1' if ahk_return_focus else '0',
-                          str(ahk_sleep_multiplier)])
+        return mtransport.AutoHotkeyTransport(
+            ahk_path, ahk_script_path, ahk_return_focus, ahk_sleep_multiplier,
+            ahk_paste_commands)
+
+    def get_session(self):
+        """Get persistent matlab session, which is started if it is not
+        running yet
+        """
+        global matlab_session, matlab_session_output
+        if matlab_session and matlab_session.is_alive():
+            return matlab_session
+
+        # read session settings
+        settings = sublime.load_settings('AutoMatlab.sublime-settings')
+        session_cmd = settings.get('matlab_session_command',
+                                   ['matlab', '-nodesktop', '-nosplash'])
+        session_cmd = [sublime.expand_variables(
+            part, self.window.extract_variables()) for part in session_cmd]
+        marker_command = settings.get('matlab_session_marker_command',
+                                      "disp('{marker}')")
+
+        # start session, streaming its output into an output panel
+        output = MatlabSessionOutput(self.window)
+        try:
+            matlab_session = mtransport.SessionTransport(
+                session_cmd, cwd=self.window.extract_variables().get('folder'),
+                on_send=output.sent, on_output=output.output,
+                on_done=output.done,
+                marker_command=marker_command)
+        except OSError as e:
+            msg = '[ERROR] AutoMatlab - Cannot start Matlab session: ' \
+                '{}'.format(e)
+            self.window.status_message(msg)
+            raise e
+
+        matlab_session_output = output
+        msg = '[INFO] AutoMatlab - Started Matlab session'
+        self.window.status_message(msg)
+        return matlab_session
+
+
+class SearchMatlabHistoryCommand(sublime_plugin.WindowCommand):
+
+    """Search all commands ever run in Matlab, and run the selected command
+    """
+
+    def run(self, query=None):
+        """Search Matlab history for the query, or ask for a query first
+        """
+        if query is None:
+            self.window.show_input_panel('Search Matlab history:',
+                                         '', self.search, None, None)
+        else:
+            self.search(query)
+
+    def search(self, query):
+        """Show commands matching the query in a quick panel
+        """
+        if extract_matlab_history() == None:
+            msg = '[WARNING] AutoMatlab - Specified History.xml is invalid'
+            self.window.status_message(msg)
+            return
+
+        with history_lock:
+            self.results = get_matlab_history_index().search(query)
+
+        if not self.results:
+            msg = '[INFO] AutoMatlab - No Matlab commands found for: ' \
+                '{}'.format(query)
+            self.window.status_message(msg)
+            return
+
+        self.window.show_quick_panel(self.results, self.selected,
+                                     sublime.MONOSPACE_FONT)
+
+    def selected(self, index):
+        """Run selected Matlab command
+        """
+        if index == -1:
+            # case: cancelled
+            return
+        self.window.run_command('run_matlab_command',
+                                {'command': self.results[index]})
 
 
 class ToggleAutoHotkeyFocusCommand(sublime_plugin.WindowCommand):
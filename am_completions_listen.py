@@ -3,7 +3,7 @@ import pickle
 import collections
 import re
 import threading
-from os import walk
+import time
 from os.path import isfile, splitext, getmtime, join, split
 
 import sublime
@@ -13,10 +13,65 @@ import sublime_plugin
 def plugin_loaded():
     """Do imports that need to wait for Sublime API initilization
     """
-    global config, abspath, mfun
+    global config, abspath, mfun, mindex, mtrace
     import AutoMatlab.lib.config as config
     from AutoMatlab.lib.abspath import abspath
     from AutoMatlab.lib.mfun import mfun
+    import AutoMatlab.lib.mindex as mindex
+    import AutoMatlab.lib.mtrace as mtrace
+
+    # enable verifying completions in the background
+    global verifier_active
+    verifier_active = True
+
+
+def plugin_unloaded():
+    """Stop verifying completions in the background
+    """
+    global verifier_active
+    verifier_active = False
+
+
+# whether completions are verified in the background, see
+# AutoMatlabCompletionsListener.verify_stale_entries()
+verifier_active = False
+
+
+def get_matlab_completions_resource():
+    """Get sublime resource of the default matlab completions
+    """
+    completions_name = split(config.MATLAB_COMPLETIONS_PATH)[-1]
+    return [res for res in sublime.find_resources(completions_name)
+            if res.endswith(config.MATLAB_COMPLETIONS_PATH)][-1]
+
+
+def get_matlab_completions_path(matlabroot=None):
+    """Get path of the stored matlab completions for the Matlab release
+    installed at matlabroot. Without completions for that release, fall back
+    to the default matlab completions.
+    """
+    if matlabroot:
+        release_path = abspath(mindex.release_path(
+            config.MATLAB_COMPLETIONS_PATH, matlabroot),
+            sublime.packages_path())
+        if isfile(release_path):
+            return release_path
+    return abspath(get_matlab_completions_resource(),
+                   join(sublime.packages_path(), ".."))
+
+
+def get_matlabroot(window=None):
+    """Get matlabroot from the settings, optionally overridden by the
+    settings of the project in window
+    """
+    settings = sublime.load_settings('AutoMatlab.sublime-settings')
+    matlabroot = settings.get('matlabroot', 'default')
+    if window and window.project_data():
+        matlabroot = window.project_data().get('auto_matlab', {}).get(
+            'matlabroot', matlabroot)
+    if matlabroot == 'default':
+        return config.default_matlabroot()
+    return abspath(matlabroot)
 
 
 class AutoMatlabCompletionsListener(sublime_plugin.EventListener):
@@ -24,20 +79,49 @@ class AutoMatlabCompletionsListener(sublime_plugin.EventListener):
     """Sublime event lister for completions
     """
 
-    def __init__(self):
+    def __init__(self, verifier_enabled=True):
+        """Initialize completion data
+
+        Args:
+            verifier_enabled (bool, optional): Verify the completions in the
+                background. Only the listener registered with Sublime does
+                this, not the readers of the documentation commands.
+        """
         # containters for completion data
         self.matlab_completions = collections.OrderedDict({})
+        self.matlab_completions_path = None
+        self.loaded_matlab_indexes = collections.OrderedDict({})
         self.project_completions = collections.OrderedDict({})
         self.file_completions = collections.OrderedDict({})
         self.loaded_project_completions = collections.OrderedDict({})
+        # "see also" references between matlab completions
+        self.matlab_references = {}
+        # locations of help pages for matlab completions
+        self.matlab_help = None
+        # namespace indexes of package and class members
+        self.matlab_namespace = {}
+        self.project_namespace = {}
+        self.loaded_project_namespaces = {}
         # last modification time for completion data
         self.matlab_completions_mtime = 0
-        self.loaded_project_completions_mtime = {}
+        # signature (size, mtime, header hash) per mfile path per project
+        self.loaded_project_signatures = {}
         # threading
         self.load_file_thread = threading.Thread()
         self.file_completions_lock = threading.Lock()
         self.load_project_thread = threading.Thread()
         self.project_completions_lock = threading.Lock()
+        # background verification of stale completions
+        self.verifier_enabled = verifier_enabled
+        self.verifier_lock = threading.Lock()
+        self.verifier_running = False
+        self.verify_queue = [] # (project or None, key, path) to verify
+        self.verify_matlab_path = None # matlab completions being verified
+        self.verify_matlabroot = None # matlabroot of these completions
+        self.reparsed_mtimes = {} # mtime of reparsed matlab mfiles
+        # recording of completion queries
+        self.query_recorder = None
+        self.query_result_count = 0
         # flags
         self.warned = False
         self.reset_mtimes = True
@@ -46,6 +130,10 @@ class AutoMatlabCompletionsListener(sublime_plugin.EventListener):
         self.locfun_regex = \
             re.compile(r'^\s*function\s+(?:(?:\w+\s*=\s*|'
                        r'\[[\w\s\.,]+\]\s*=\s*)?(\w+)\([^\)]*(\)|\.\.\.))')
+        self.see_regex = re.compile(
+            r'<p>(?:&nbsp;)*see&nbsp;also:?(?:&nbsp;)*(.*?)\.?<\/p>', re.I)
+        self.ref_regex = re.compile(r'(<[^>]*>|&\w+;)|([\w\.]+)')
+        self.qualifier_regex = re.compile(r'([A-Za-z]\w*(?:\.[A-Za-z]\w*)*)\.$')
 
     def get_mfun_data(self, window, fun, init=True):
         """Obtain mfun_data for the specified function
@@ -61,7 +149,7 @@ class AutoMatlabCompletionsListener(sublime_plugin.EventListener):
                 self.load_file_completions(window.extract_variables().get('file'))
 
             if fun_low in self.file_completions.keys():
-                return mfun(window.extract_variables().get('file'),
+                return mfun.cached(window.extract_variables().get('file'),
                     'Local function', local=fun_low)
 
         # load project/folder completions
@@ -83,6 +171,15 @@ class AutoMatlabCompletionsListener(sublime_plugin.EventListener):
                 self.project_completions = self.loaded_project_completions.get(
                     window.extract_variables().get('project_base_name'), {})
 
+        # find unqualified project class method
+        if not fun_low in self.project_completions:
+            entry = self.find_unique_method(
+                self.loaded_project_namespaces.get(
+                    window.extract_variables().get('project_base_name')),
+                fun_low)
+            if entry:
+                fun_low = entry[0].lower()
+
         if fun_low in self.project_completions.keys():
             if window.project_data():
                 project_settings = window.project_data().get(
@@ -95,32 +192,62 @@ class AutoMatlabCompletionsListener(sublime_plugin.EventListener):
                 free_format = settings.get('free_documentation_format', True)
             # read mfun from mfile to extract all data
             if free_format:
-                return mfun(self.project_completions[fun_low][2],
+                return mfun.cached(self.project_completions[fun_low][2],
                     'Project function', deep=init)
             else:
-                return mfun(self.project_completions[fun_low][2], 
+                return mfun.cached(self.project_completions[fun_low][2], 
                     deep=init)
 
         # load matlab completions
         if (not self.matlab_completions) \
                 and settings.get('matlab_completions', True):
-            self.load_matlab_completions()
+            self.load_matlab_completions(window)
 
         # read matlabroot
-        matlabroot = settings.get('matlabroot', 'default')
-        if matlabroot == 'default':
-            matlabroot = config.DEFAULT_MATLABROOT
-        else:
-            matlabroot = abspath(matlabroot)
-        
-        if fun_low in self.matlab_completions.keys():
-            return mfun(abspath(self.matlab_completions[fun_low][2],
+        matlabroot = get_matlabroot(window)
+
+        # find unqualified matlab class method
+        if not fun_low in self.matlab_completions:
+            entry = self.find_unique_method(self.matlab_namespace, fun_low)
+            if entry:
+                fun_low = entry[0].lower()
+
+        if fun_low in self.matlab_completions:
+            return mfun.cached(abspath(self.matlab_completions[fun_low][2],
                 matlabroot), deep=init)
 
         return None
 
 
     def on_query_completions(self, view, prefix, locations):
+        """Construct AutoMatlab completion list, and record the query if
+        enabled (see mtrace)
+        """
+        settings = sublime.load_settings('AutoMatlab.sublime-settings')
+        if not settings.get('record_completion_queries', False):
+            return self.query_completions(view, prefix, locations)
+        if not view.match_selector(locations[0], 'source.matlab'):
+            return []
+
+        # record every Matlab query, also the ones without results
+        exact = self.check_exact_match
+        start = time.perf_counter()
+        cl = self.query_completions(view, prefix, locations)
+        latency = time.perf_counter() - start
+
+        if not self.query_recorder:
+            self.query_recorder = mtrace.QueryRecorder(
+                join(sublime.cache_path(), config.COMPLETION_TRACE_PATH))
+        self.query_recorder.record(
+            prefix, self.get_qualifier(view, prefix, locations[0]), exact,
+            {'matlab': len(self.matlab_completions),
+             'project': len(self.project_completions),
+             'file': len(self.file_completions)},
+            self.query_result_count, latency)
+        return cl
+
+
+    def query_completions(self, view, prefix, locations):
         """Construct AutoMatlab completion list.
 
         Two cases are distinguised:
@@ -136,43 +263,47 @@ class AutoMatlabCompletionsListener(sublime_plugin.EventListener):
         settings = sublime.load_settings('AutoMatlab.sublime-settings')
 
         # read matlabroot
-        matlabroot = settings.get('matlabroot', 'default')
-        if matlabroot == 'default':
-            matlabroot = config.DEFAULT_MATLABROOT
-        else:
-            matlabroot = abspath(matlabroot)
+        matlabroot = get_matlabroot(view.window())
 
         # load matlab completions
         if settings.get('matlab_completions', True):
             self.load_matlab_completions(view.window())
         else:
             self.matlab_completions_mtime = 0
+            self.matlab_completions_path = None
             self.matlab_completions = collections.OrderedDict({})        
 
         # load project/folder completions
         self.project_completions_lock.acquire()
+        project = None
         if settings.get('project_completions', True):
             # load project completions
+            project = view.window().extract_variables().get(
+                'project_base_name')
             self.project_completions = self.loaded_project_completions.get(
-                view.window().extract_variables().get('project_base_name'), {})
+                project, {})
         else:
             self.project_completions = collections.OrderedDict({})
         if not self.project_completions:
             if settings.get('current_folder_completions', True):
                 # load current folder completions
                 if len(view.window().folders()) == 1:
-                    self.project_completions = \
-                        self.loaded_project_completions.get(
-                            view.window().folders()[0], {})
+                    project = view.window().folders()[0]
                 else:
-                    self.project_completions = \
-                        self.loaded_project_completions.get(
-                            view.window().extract_variables().get(
-                                'file_path'), {})
+                    project = view.window().extract_variables().get(
+                        'file_path')
+                self.project_completions = \
+                    self.loaded_project_completions.get(project, {})
             else:
+                project = None
                 self.project_completions = collections.OrderedDict({})
+        self.project_namespace = self.loaded_project_namespaces.get(
+            project, {})
         self.project_completions_lock.release()
 
+        # check for package or class qualifier in front of prefix
+        qualifier = self.get_qualifier(view, prefix, locations[0])
+
         # load file completions
         file_completions = {}
         if settings.get('current_file_completions', True):
@@ -180,14 +311,35 @@ class AutoMatlabCompletionsListener(sublime_plugin.EventListener):
             file_completions = self.file_completions
             self.file_completions_lock.release()
 
+        # look up (qualified) prefix in completions
+        prefix_low = prefix.lower()
+        if qualifier:
+            project_node = mindex.find_namespace(
+                self.project_namespace, qualifier)
+            matlab_node = mindex.find_namespace(
+                self.matlab_namespace, qualifier)
+            if not (project_node or matlab_node):
+                # not a package or class (e.g. an object or struct)
+                qualifier = ''
+        if qualifier:
+            project_entry = project_node and \
+                project_node['children'].get(prefix_low, {}).get('entry')
+            matlab_entry = matlab_node and \
+                matlab_node['children'].get(prefix_low, {}).get('entry')
+            file_completions = {}
+        else:
+            [entry, is_project] = self.find_entry(prefix_low)
+            project_entry = entry if is_project else None
+            matlab_entry = None if is_project else entry
+
         # check for exact match
         mfun_data = None
-        prefix_low = prefix.lower()
         links = ''
         if self.check_exact_match:
             self.check_exact_match = False
             if prefix_low in file_completions.keys():
-                mfun_data = mfun(view.window().extract_variables().get('file'),
+                mfun_data = mfun.cached(
+                    view.window().extract_variables().get('file'),
                     'Local function', local=prefix_low)
                 links = \
                     "<a href=\'subl:goto_line {{\"line\":\"{}\"}}\'>Goto</a>".format(
@@ -195,7 +347,7 @@ class AutoMatlabCompletionsListener(sublime_plugin.EventListener):
                     + " " + \
                     "<a href=\'subl:show_auto_matlab_documentation_panel {{\"fun\":\"{}\"}}\'>Panel</a>".format(
                         prefix_low)
-            elif prefix_low in self.project_completions.keys():
+            elif project_entry:
                 # read project documentation format from settings
                 if view.window().project_data():
                     project_settings = view.window().project_data().get(
@@ -208,27 +360,27 @@ class AutoMatlabCompletionsListener(sublime_plugin.EventListener):
                     free_format = settings.get('free_documentation_format', True)
                 # read mfun from mfile to extract all data
                 if free_format:
-                    mfun_data = mfun(self.project_completions[prefix_low][2],
+                    mfun_data = mfun.cached(project_entry[2],
                         'Project function', True)
                 else:
-                    mfun_data = mfun(self.project_completions[prefix_low][2], 
-                        deep=True)
+                    mfun_data = mfun.cached(project_entry[2], deep=True)
                 links = \
                     "<a href=\'subl:open_file {{\"file\":\"{}\"}}\'>Goto</a>".format(
                     abspath(mfun_data.path).replace('\\','\\\\')) \
                     + " " + \
                     "<a href=\'subl:show_auto_matlab_documentation_panel {{\"fun\":\"{}\"}}\'>Panel</a>".format(
-                        prefix_low)
-            elif prefix_low in self.matlab_completions.keys():
+                        project_entry[0].lower())
+            elif matlab_entry:
                 # read mfun from mfile to extract all data
-                mfun_data = mfun(abspath(self.matlab_completions[prefix_low][2],
-                    matlabroot), deep=True)
+                mfun_data = mfun.cached(abspath(matlab_entry[2], matlabroot),
+                    deep=True)
                 links = \
                     "<a href=\'subl:open_file {{\"file\":\"{}\"}}\'>Goto</a>".format(
                     abspath(mfun_data.path, matlabroot).replace('\\','\\\\')) \
                     + " " + \
                     "<a href=\'subl:show_auto_matlab_documentation_panel {{\"fun\":\"{}\"}}\'>Panel</a>".format(
-                        prefix_low)
+                        matlab_entry[0].lower())
+                mfun_data.find_help(self.matlab_help)
                 if mfun_data.help_browser:
                     links += " " + \
                     "<a href=\'subl:open_url {{\"url\":\"{}\"}}\'>Browser</a>".format(
@@ -271,12 +423,30 @@ class AutoMatlabCompletionsListener(sublime_plugin.EventListener):
             # load settings to see if documentation popup should be shown
             documentation_popup = settings.get('documentation_popup', False)
             if documentation_popup:
-                view.show_popup(self.create_hrefs(mfun_data.html),
+                view.show_popup(self.create_hrefs(mfun_data.html,
+                                    mfun_data.key),
                                 sublime.COOPERATE_WITH_AUTO_COMPLETE,
                                 max_width=750, max_height=400,
                                 on_navigate=self.update_documentation_popup)
                 self.popup_view = view
 
+        elif qualifier:
+
+            # check for partial prefix_low match of package or class members
+            compl = [
+                self.compose_namespace_completion(node, 'p', 'Project')
+                for name, node in sorted(project_node['children'].items()
+                                         if project_node else [])
+                if name.startswith(prefix_low)
+                ] + [
+                self.compose_namespace_completion(node, 'b', 'Built-in')
+                for name, node in sorted(matlab_node['children'].items()
+                                         if matlab_node else [])
+                if name.startswith(prefix_low)]
+
+            cl = sublime.CompletionList(compl,
+                flags=sublime.INHIBIT_WORD_COMPLETIONS)
+
         else:
 
             # check for partial prefix_low match
@@ -295,24 +465,120 @@ class AutoMatlabCompletionsListener(sublime_plugin.EventListener):
                     completion=data[0],
                     kind=(sublime.KIND_ID_FUNCTION, 'p', 'Project function'))
                 for fun, data in self.project_completions.items()
-                if fun.startswith(prefix_low)
+                if fun.startswith(prefix_low) and not '.' in fun
                 ] + [
                 sublime.CompletionItem(
                     data[0],
                     annotation=data[1],
                     completion=data[0],
                     kind=(sublime.KIND_ID_FUNCTION, 'b', 'Built-in function'))
-                for fun, data in self.matlab_completions.items()
-                if fun.startswith(prefix_low)]
+                for fun, data in mindex.match_prefix(
+                    self.matlab_completions, prefix_low)
+                if not '.' in fun
+                ] + [
+                self.compose_namespace_completion(node, 'p', 'Project')
+                for name, node in sorted(
+                    self.project_namespace.get('children', {}).items())
+                if name.startswith(prefix_low) and node['children']
+                    and not name in self.project_completions
+                ] + [
+                self.compose_namespace_completion(node, 'b', 'Built-in')
+                for name, node in sorted(
+                    self.matlab_namespace.get('children', {}).items())
+                if name.startswith(prefix_low) and node['children']
+                    and not name in self.matlab_completions
+                ] + [
+                self.compose_method_completion(entry, 'p', 'Project')
+                for name, entries in sorted(
+                    self.project_namespace.get('methods', {}).items())
+                if name.startswith(prefix_low)
+                    and not name in self.project_completions
+                for entry in entries
+                ] + [
+                self.compose_method_completion(entry, 'b', 'Built-in')
+                for name, entries in sorted(
+                    self.matlab_namespace.get('methods', {}).items())
+                if name.startswith(prefix_low)
+                    and not name in self.matlab_completions
+                for entry in entries]
 
             cl = sublime.CompletionList(compl)
 
         if not compl and view.is_popup_visible():
             view.hide_popup()
 
+        self.query_result_count = len(compl)
         return cl
 
 
+    def get_qualifier(self, view, prefix, location):
+        """Get package or class qualifier typed in front of the prefix
+        """
+        mo = self.qualifier_regex.search(view.substr(sublime.Region(
+            view.line(location).begin(), location - len(prefix))))
+        return mo.group(1) if mo else ''
+
+
+    def compose_method_completion(self, entry, kind_letter, kind_name):
+        """Compose completion item for unqualified class method, detailed
+        with its qualified name
+        """
+        fun = entry[0].split('.')[-1]
+        return sublime.CompletionItem(
+            fun,
+            annotation=entry[1],
+            completion=fun,
+            kind=(sublime.KIND_ID_FUNCTION, kind_letter,
+                  kind_name + ' method'),
+            details=entry[0])
+
+
+    def find_unique_method(self, namespace, fun):
+        """Find the completion entry of an unqualified (lower case) class
+        method, if only one class defines the method
+        """
+        entries = mindex.find_methods(namespace, fun)
+        return entries[0] if len(entries) == 1 else None
+
+
+    def find_entry(self, fun):
+        """Find completion entry of (lower case) function, in the project
+        completions first. Unqualified class methods are only found if they
+        are unambiguous.
+
+        Returns:
+            list: [entry or None, whether it is a project completion]
+        """
+        entry = self.project_completions.get(fun)
+        if entry:
+            return [entry, True]
+        entry = self.matlab_completions.get(fun)
+        if entry:
+            return [entry, False]
+        entry = self.find_unique_method(self.project_namespace, fun)
+        if entry:
+            return [entry, True]
+        return [self.find_unique_method(self.matlab_namespace, fun), False]
+
+
+    def compose_namespace_completion(self, node, kind_letter, kind_name):
+        """Compose completion item for package or class member
+        """
+        if node['entry'] and not node['children']:
+            return sublime.CompletionItem(
+                node['name'],
+                annotation=node['entry'][1],
+                completion=node['name'],
+                kind=(sublime.KIND_ID_FUNCTION, kind_letter,
+                      kind_name + ' function'))
+        return sublime.CompletionItem(
+            node['name'],
+            annotation=node['entry'][1] if node['entry'] else '',
+            completion=node['name'],
+            kind=(sublime.KIND_ID_NAMESPACE, kind_letter,
+                  kind_name + ' package/class'))
+
+
     def on_text_command(self, view, command_name, args):
         """Redefine a number of sublime commands to obtain smoother
         behaviour. Mainly focused on reloading the completion list and
@@ -493,6 +759,8 @@ class AutoMatlabCompletionsListener(sublime_plugin.EventListener):
         exclude_patterns = []
         settings = sublime.load_settings('AutoMatlab.sublime-settings')
         free_format = settings.get('free_documentation_format', True)
+        header_bytes = settings.get('index_header_bytes', 65536)
+        header_lines = settings.get('index_header_lines', 0)
 
         if type(project_info) == str:
             # case: use working dir
@@ -539,102 +807,82 @@ class AutoMatlabCompletionsListener(sublime_plugin.EventListener):
                 free_format = project_settings_auto_matlab.get(
                     'free_documentation_format', True)
 
-        # reset modified time for completions, if necessary
+        # reset file signatures, if necessary, to parse all files again
         if reset_mtimes:
-            for key in self.loaded_project_completions_mtime.keys():
-                self.loaded_project_completions_mtime[key] = 0
+            self.loaded_project_signatures.clear()
 
-        # get last update time for project completions
-        if not self.loaded_project_completions_mtime.get(project):
-            self.loaded_project_completions_mtime[project] = 0
-        completions_mtime = self.loaded_project_completions_mtime[project]
-        last_mtime = completions_mtime
+        # get previous completions and file signatures per path
+        prev_completions = dict([(data[2], (key, data)) for key, data in
+            self.loaded_project_completions.get(project, {}).items()])
+        prev_signatures = self.loaded_project_signatures.get(project, {})
+        signatures = {}
 
         # parse project include dirs
-        for include in include_dirs:
-            # check wildcard
-            if not include:
+        for path in mindex.walk_include_dirs(include_dirs, exclude_dirs,
+                                             exclude_patterns):
+            # check if file changed since last time: only hash the header
+            # window if size or mtime changed, and only parse the file if
+            # the header changed
+            path = abspath(path)
+            prev_signature = prev_signatures.get(path)
+            try:
+                signature = mindex.file_signature(path, header_bytes,
+                                                  prev_signature)
+            except OSError:
                 continue
-            wildcard = include[-1]
-            if wildcard in ['+', '*']:
-                include = include[:-1]
-            for root, dirs, files in walk(include):
-                # process file for completions
-                for f in files:
-                    # check if matlab file
-                    [fun, ext] = splitext(f)
-                    if not ext == '.m':
-                        continue
-
-                    # check if file changed since last time
-                    file_mtime = getmtime(join(root, f))
-                    if file_mtime > completions_mtime:
-                        if file_mtime > last_mtime:
-                            last_mtime = file_mtime
-                        # read mfun
-                        if free_format:
-                            mfun_data = mfun(join(root, f), 'Project function')
-                        else:
-                            mfun_data = mfun(join(root, f))
-                        if not mfun_data.valid:
-                            continue
-
-                        # add data to matlab completions
-                        completions[mfun_data.fun.lower()] = \
-                            [mfun_data.fun, mfun_data.annotation,
-                             mfun_data.path]
-                    else:
-                        # copy previous completion
-                        prev_completion = self.loaded_project_completions.get(
-                            project, {}).get(fun)
-                        if prev_completion:
-                            completions[fun] = prev_completion
-                # set which subdirs to include
-                if wildcard == '+':
-                    # only include package dirs and apply exclude dirs/patterns
-                    dirs[:] = \
-                        [d for d in dirs
-                         if d.startswith('+')
-                            and not(any([excl for excl in exclude_dirs
-                                         if abspath(d, root).startswith(excl)])
-                                    or any([excl for excl in exclude_patterns
-                                            if excl in d and not excl == "+"]))]
-                elif wildcard == '*':
-                    # apply exclude dirs/patterns
-                    dirs[:] = \
-                        [d for d in dirs
-                         if not(any([excl for excl in exclude_dirs
-                                     if abspath(d, root).startswith(excl)])
-                                or any([excl for excl in exclude_patterns
-                                        if excl in d]))]
+            signatures[path] = signature
+            if not (prev_signature and signature[2] == prev_signature[2]):
+                # read mfun
+                if free_format:
+                    mfun_data = mfun(path, 'Project function',
+                                     header_bytes=header_bytes,
+                                     header_lines=header_lines)
                 else:
-                    # exclude all
-                    dirs[:] = []
+                    mfun_data = mfun(path, header_bytes=header_bytes,
+                                     header_lines=header_lines)
+                if not mfun_data.valid:
+                    continue
+
+                # add data to matlab completions
+                completions[mfun_data.key] = \
+                    [mfun_data.name, mfun_data.annotation, mfun_data.path]
+            else:
+                # copy previous completion
+                prev_completion = prev_completions.get(path)
+                if prev_completion:
+                    completions[prev_completion[0]] = prev_completion[1]
 
         # sort the completions
         sorted_completions = collections.OrderedDict(
             sorted(completions.items()))
 
+        # build namespace index of package and class members
+        namespace = mindex.build_namespace(sorted_completions)
+
         popped_key = ''
         # update project completions dict and modified time
         self.project_completions_lock.acquire()
         self.loaded_project_completions[project] = sorted_completions
+        self.loaded_project_namespaces[project] = namespace
         # ensure loaded project completions size stays within sane limits
         if len(self.loaded_project_completions) \
                 > config.MAX_LOADED_PROJECT_COMPLETIONS:
             popped_key = self.loaded_project_completions.popitem(False)[0]
+            self.loaded_project_namespaces.pop(popped_key, None)
+        self.loaded_project_signatures[project] = signatures
+        self.loaded_project_signatures.pop(popped_key, None)
         self.project_completions_lock.release()
-        self.loaded_project_completions_mtime[project] = last_mtime
-        self.loaded_project_completions_mtime.pop(popped_key, None)
+
+        self.start_stale_entry_verifier()
 
 
     def load_matlab_completions(self, window=None):
-        """Load stored matlab completion data into completion dict
+        """Load stored matlab completion data into completion dict, for the
+        Matlab release installed at the active matlabroot
         """
-        completions_name = split(config.MATLAB_COMPLETIONS_PATH)[-1]
-        completions_path = abspath(
-            sublime.find_resources(completions_name)[-1],
-            join(sublime.packages_path(), ".."))
+        completions_path = get_matlab_completions_path(get_matlabroot(window))
+        if not completions_path == self.matlab_completions_path:
+            self.switch_matlab_completions(completions_path)
 
         if isfile(completions_path):
             # load user-generated matlab completions data
@@ -643,20 +891,51 @@ class AutoMatlabCompletionsListener(sublime_plugin.EventListener):
             if mtime > self.matlab_completions_mtime:
                 self.matlab_completions_mtime = mtime
 
-                # read matlab_completions
-                with open(completions_path, 'br') as fh:
-                    self.matlab_completions = pickle.load(fh)
+                # read matlab_completions (or their shard directory)
+                self.matlab_completions = mindex.load_completions(
+                    completions_path)
+
+                # read references between matlab completions
+                self.matlab_references = mindex.load_section(
+                    completions_path, 'references') or {}
+
+                # read locations of help pages
+                self.matlab_help = mindex.load_section(
+                    completions_path, 'help')
+
+                # read namespace index, which is stored with sharded
+                # completions (building it would load all shards)
+                self.matlab_namespace = mindex.load_section(
+                    completions_path, 'namespace')
+                if self.matlab_namespace is None:
+                    if isinstance(self.matlab_completions,
+                                  mindex.ShardedCompletions):
+                        self.matlab_namespace = {}
+                        msg = '[WARNING] AutoMatlab - Matlab completions ' \
+                            'lack a namespace index. Try generating them ' \
+                            'again through the command palette.'
+                        if window:
+                            window.status_message(msg)
+                    else:
+                        self.matlab_namespace = mindex.build_namespace(
+                            self.matlab_completions)
         else:
             # load default matlab completions data
             if not self.matlab_completions:
                 try:
                     # read binary sublime resource
-                    completions_bytes = \
-                        sublime.load_binary_resource(sublime.find_resources(
-                            completions_name)[-1])
+                    completions_bytes = sublime.load_binary_resource(
+                        get_matlab_completions_resource())
                     self.matlab_completions = pickle.loads(completions_bytes)
                 except:
                     self.matlab_completions = collections.OrderedDict({})
+                self.matlab_namespace = mindex.build_namespace(
+                    self.matlab_completions)
+
+        # free memory of shards that were not used recently
+        if isinstance(self.matlab_completions, mindex.ShardedCompletions):
+            self.matlab_completions.evict(config.MATLAB_SHARD_IDLE_TIME)
+            self.start_stale_entry_verifier()
 
         if not self.matlab_completions and not self.warned:
             self.warned = True
@@ -667,35 +946,265 @@ class AutoMatlabCompletionsListener(sublime_plugin.EventListener):
                 window.status_message(msg)
 
 
-    def create_hrefs(self, html):
+    def start_stale_entry_verifier(self):
+        """Start verifying the completions in the background, if not
+        running already
+        """
+        if not self.verifier_enabled:
+            return
+        with self.verifier_lock:
+            if self.verifier_running:
+                return
+            self.verifier_running = True
+        sublime.set_timeout_async(self.verify_stale_entries,
+                                  config.STALE_ENTRY_DELAY)
+
+    def verify_stale_entries(self):
+        """Verify a chunk of completions, and schedule the next chunk.
+        Completions of deleted mfiles are pruned and completions of modified
+        mfiles are parsed again, such that they stay correct without
+        rebuilding the completions or checking paths while querying.
+
+        Project completions are verified against their file signatures.
+        Matlab completions are only verified for the loaded shards of a
+        generated index, and are parsed again if the mfile is newer than
+        the index.
+        """
+        if not verifier_active:
+            # plugin unloaded
+            return
+        if not self.verify_queue:
+            self.verify_queue = self.collect_stale_entry_candidates()
+            if not self.verify_queue:
+                # nothing to verify, until completions are loaded again
+                with self.verifier_lock:
+                    self.verifier_running = False
+                return
+
+        chunk = self.verify_queue[-config.STALE_ENTRY_CHUNK_SIZE:]
+        del self.verify_queue[-config.STALE_ENTRY_CHUNK_SIZE:]
+        try:
+            self.verify_stale_entry_chunk(chunk)
+        finally:
+            # pause longer after a sweep
+            sublime.set_timeout_async(self.verify_stale_entries,
+                                      config.STALE_ENTRY_DELAY
+                                      if self.verify_queue
+                                      else config.STALE_ENTRY_SWEEP_DELAY)
+
+    def verify_stale_entry_chunk(self, chunk):
+        """Verify chunk of (project or None, key, path) completions
+        """
+        # read settings
+        settings = sublime.load_settings('AutoMatlab.sublime-settings')
+        header_bytes = settings.get('index_header_bytes', 65536)
+        header_lines = settings.get('index_header_lines', 0)
+
+        # verify chunk, collecting pruned and updated completions
+        pruned = {}
+        updated = {}
+        for project, key, path in chunk:
+            if project is None:
+                if not self.verify_matlab_path == self.matlab_completions_path:
+                    continue
+                path = abspath(path, self.verify_matlabroot)
+            try:
+                mtime = getmtime(path)
+            except OSError:
+                pruned.setdefault(project, set()).add(key)
+                continue
+
+            if project is None:
+                # parse modified matlab mfile again
+                if mtime <= self.matlab_completions_mtime \
+                        or self.reparsed_mtimes.get(path) == mtime:
+                    continue
+                self.reparsed_mtimes[path] = mtime
+                mfun_data = mfun(path, deep=True, header_bytes=header_bytes,
+                                 header_lines=header_lines)
+                entry = self.matlab_completions.get(key)
+                if not (mfun_data.valid and mfun_data.key == key):
+                    pruned.setdefault(project, set()).add(key)
+                elif entry:
+                    updated.setdefault(project, {})[key] = \
+                        [mfun_data.name, mfun_data.annotation] + entry[2:]
+                continue
+
+            # parse project mfile again if its header changed
+            with self.project_completions_lock:
+                signatures = self.loaded_project_signatures.get(project, {})
+                prev_signature = signatures.get(path)
+                entry = self.loaded_project_completions.get(
+                    project, {}).get(key)
+            try:
+                signature = mindex.file_signature(path, header_bytes,
+                                                  prev_signature)
+            except OSError:
+                pruned.setdefault(project, set()).add(key)
+                continue
+            with self.project_completions_lock:
+                signatures[path] = signature
+            if prev_signature and signature[2] == prev_signature[2]:
+                continue
+            if entry and entry[1] == 'Project function':
+                # free documentation format
+                mfun_data = mfun(path, 'Project function',
+                                 header_bytes=header_bytes,
+                                 header_lines=header_lines)
+            else:
+                mfun_data = mfun(path, header_bytes=header_bytes,
+                                 header_lines=header_lines)
+            if not (mfun_data.valid and mfun_data.key == key):
+                pruned.setdefault(project, set()).add(key)
+            if mfun_data.valid:
+                updated.setdefault(project, {})[mfun_data.key] = \
+                    [mfun_data.name, mfun_data.annotation, mfun_data.path]
+
+        # prune and update matlab completions
+        if self.verify_matlab_path == self.matlab_completions_path:
+            if pruned.get(None):
+                self.matlab_completions.prune(pruned[None])
+            if updated.get(None):
+                self.matlab_completions.update(updated[None])
+        pruned.pop(None, None)
+        updated.pop(None, None)
+
+        # replace modified project completions
+        for project in set(pruned.keys()) | set(updated.keys()):
+            self.project_completions_lock.acquire()
+            prev_completions = self.loaded_project_completions.get(project)
+            if prev_completions is not None:
+                completions = dict(
+                    [(key, entry) for key, entry in prev_completions.items()
+                     if not key in pruned.get(project, ())])
+                completions.update(updated.get(project, {}))
+                completions = collections.OrderedDict(
+                    sorted(completions.items()))
+                namespace = mindex.build_namespace(completions)
+                self.loaded_project_completions[project] = completions
+                self.loaded_project_namespaces[project] = namespace
+                if self.project_completions is prev_completions:
+                    self.project_completions = completions
+                    self.project_namespace = namespace
+            self.project_completions_lock.release()
+
+    def collect_stale_entry_candidates(self):
+        """Collect the completions to verify in a sweep
+
+        Returns:
+            list: (project or None for matlab completions, key, path), in
+                reverse order of verification
+        """
+        entries = []
+        self.project_completions_lock.acquire()
+        for project, completions in self.loaded_project_completions.items():
+            entries.extend([(project, key, entry[2])
+                            for key, entry in completions.items()])
+        self.project_completions_lock.release()
+
+        # only verify generated matlab completions, of the active matlabroot
+        self.verify_matlab_path = None
+        if isinstance(self.matlab_completions, mindex.ShardedCompletions):
+            matlabroot = get_matlabroot(sublime.active_window())
+            if get_matlab_completions_path(matlabroot) \
+                    == self.matlab_completions_path:
+                self.verify_matlab_path = self.matlab_completions_path
+                self.verify_matlabroot = matlabroot
+                entries.extend([(None, key, entry[2]) for key, entry
+                                in self.matlab_completions.loaded_items()])
+
+        entries.reverse()
+        return entries
+
+    def switch_matlab_completions(self, completions_path):
+        """Switch to the matlab completion data stored at completions_path.
+        The data of the previous completions is kept in memory, such that
+        switching back does not require reloading.
+        """
+        # keep current completion data
+        if self.matlab_completions_path:
+            self.loaded_matlab_indexes[self.matlab_completions_path] = [
+                self.matlab_completions, self.matlab_completions_mtime,
+                self.matlab_references, self.matlab_help,
+                self.matlab_namespace]
+            # ensure loaded matlab completions size stays within sane limits
+            if len(self.loaded_matlab_indexes) \
+                    > config.MAX_LOADED_MATLAB_COMPLETIONS:
+                self.loaded_matlab_indexes.popitem(False)
+
+        # restore (or reset) completion data
+        [self.matlab_completions, self.matlab_completions_mtime,
+            self.matlab_references, self.matlab_help,
+            self.matlab_namespace] = self.loaded_matlab_indexes.pop(
+                completions_path,
+                [collections.OrderedDict({}), 0, {}, None, {}])
+        self.matlab_completions_path = completions_path
+
+
+    def is_linkable(self, fun):
+        """Check if completions exist for the function, such that it can be
+        linked to from the documentation
+        """
+        return self.find_entry(fun.lower())[0] is not None
+
+    def get_references(self, fun, direction='references'):
+        """Get the precomputed "see also" references of a matlab function.
+        Use direction 'referenced_by' to get the functions that refer to it.
+
+        Returns:
+            list: Lower case names of referenced functions, or None if
+                no references were precomputed for the function
+        """
+        if fun.lower() in self.project_completions:
+            # project functions shadow matlab functions
+            return None
+        return self.matlab_references.get(direction, {}).get(fun.lower())
+
+    def create_hrefs(self, html, fun=''):
         """Detailed Matlab function documentation contains references to
         other function ("see also"). Extract these references and wrap them
-        in html href tags.
+        in html href tags. Functions that refer to the documented function
+        are listed in an additional "referenced by" paragraph.
         """
         # locate 'see also'
-        see_regex = re.compile(
-            r'<p>(?:&nbsp;)*see&nbsp;also:?(?:&nbsp;)*(.*?)\.?<\/p>', re.I)
-        mo_see = see_regex.search(html)
+        mo_see = self.see_regex.search(html)
 
         # extract referred functions
         if mo_see:
-            hrefs_see = mo_see.group()
-            parts = mo_see.group(1).replace('<br>',' ').replace(
-                ',',' ').replace('&nbsp;',' ').split()
-            for ref in parts:
-                if ref:
-                    # check if completions exist for referred function
-                    linkable = self.project_completions.get(ref.lower())
-                    if not linkable:
-                        linkable = self.matlab_completions.get(ref.lower())
-                    if linkable:
-                        # compose href for function
-                        href = '<a href="{}">{}</a>'.format(ref.lower(),
-                                                            ref)
-                        ref_regex = r'\b' + ref + r'\b'
-                        hrefs_see = re.sub(ref_regex, href, hrefs_see)
-            # replace referred function with href
-            html = html.replace(mo_see.group(), hrefs_see)
+            # use precomputed references, if available
+            references = self.get_references(fun)
+
+            def href(mo):
+                """Wrap referred function in href, if it can be linked
+                """
+                ref = mo.group(2)
+                if not ref:
+                    # html tag or entity
+                    return mo.group()
+                # check if completions exist for referred function
+                ref = ref.rstrip('.')
+                if references is not None:
+                    linkable = ref.lower() in references
+                else:
+                    linkable = self.is_linkable(ref)
+                if linkable:
+                    # compose href for function
+                    return '<a href="{}">{}</a>'.format(ref.lower(), ref) \
+                        + mo.group()[len(ref):]
+                return mo.group()
+
+            # replace referred functions with hrefs, in a single pass
+            hrefs_see = self.ref_regex.sub(href, mo_see.group(1))
+            html = html[:mo_see.start(1)] + hrefs_see + html[mo_see.end(1):]
+
+        # add functions that refer to this function
+        referenced_by = ['<a href="{}">{}</a>'.format(
+            ref, self.matlab_completions[ref][0])
+            for ref in self.get_references(fun, 'referenced_by') or []
+            if ref in self.matlab_completions]
+        if referenced_by:
+            html += '<p>Referenced&nbsp;by:&nbsp;{}</p>'.format(
+                ',&nbsp;'.join(referenced_by))
 
         return html
 
@@ -706,7 +1215,10 @@ class AutoMatlabCompletionsListener(sublime_plugin.EventListener):
         # load settings
         settings = sublime.load_settings('AutoMatlab.sublime-settings')
         # get mfun data from project or matlab completions
-        if fun in self.project_completions.keys():
+        [entry, is_project] = self.find_entry(fun)
+        if not entry:
+            return
+        if is_project:
             # read project documentation format from settings
             if sublime.active_window().project_data():
                 project_settings = sublime.active_window().project_data().get(
@@ -721,25 +1233,19 @@ class AutoMatlabCompletionsListener(sublime_plugin.EventListener):
 
             # read mfun
             if free_format:
-                mfun_data = mfun(self.project_completions.get(fun)[2],
-                    'Project function', True)
+                mfun_data = mfun.cached(entry[2], 'Project function', True)
             else:
-                mfun_data = mfun(self.project_completions.get(fun)[2], 
-                    deep=True)
+                mfun_data = mfun.cached(entry[2], deep=True)
         else:
             # read mfun
-            matlabroot = settings.get('matlabroot', 'default')
-            if matlabroot == 'default':
-                matlabroot = config.DEFAULT_MATLABROOT
-            else:
-                matlabroot = abspath(matlabroot)
+            matlabroot = get_matlabroot(sublime.active_window())
 
-            mfun_data = mfun(abspath(self.matlab_completions.get(fun)[2],
-                matlabroot), deep=True)
+            mfun_data = mfun.cached(abspath(entry[2], matlabroot), deep=True)
 
         # update popup contents
         if mfun_data.valid:
-            self.popup_view.update_popup(self.create_hrefs(mfun_data.html))
+            self.popup_view.update_popup(
+                self.create_hrefs(mfun_data.html, entry[0].lower()))
 
 
 class ShowAutoMatlabDocumentationPanelCommand(sublime_plugin.TextCommand):
@@ -762,12 +1268,12 @@ class ShowAutoMatlabDocumentationPanelCommand(sublime_plugin.TextCommand):
         panel = window.create_output_panel('auto_matlab')
 
         # reader to for function documentation
-        fun_reader = AutoMatlabCompletionsListener()
+        fun_reader = AutoMatlabCompletionsListener(False)
         mfun_data = fun_reader.get_mfun_data(window, fun)
 
         if mfun_data:
-            # find hrefs in text and preprocess text
-            [text, hrefs] = self.find_hrefs(mfun_data.text, window, fun_reader)
+            # cut "see also" references from text, to show them as phantoms
+            [text, refs] = self.cut_references(mfun_data.text)
 
             # make documentation title phantom
             title = '<p><b>{} - {}</b></p>'.format(mfun_data.fun, 
@@ -775,11 +1281,9 @@ class ShowAutoMatlabDocumentationPanelCommand(sublime_plugin.TextCommand):
             phantoms = [sublime.Phantom(sublime.Region(0,0), title, 
                 sublime.LAYOUT_INLINE)]
 
-            # make href phantoms
-            for ref, loc in hrefs.items():
-                phantoms.append(sublime.Phantom(sublime.Region(loc+1,loc+1), 
-                    '<a href="{}">{}</a>'.format(ref.lower(), ref), 
-                    sublime.LAYOUT_INLINE, self.update_documentation_panel))
+            # make reference phantoms, without links until resolved
+            for ref, loc in refs:
+                phantoms.append(self.make_reference_phantom(ref, loc + 1))
 
             # fill output panel with documentation text
             panel.run_command("append", 
@@ -790,6 +1294,12 @@ class ShowAutoMatlabDocumentationPanelCommand(sublime_plugin.TextCommand):
                 'auto_matlab_documentation')
             self.phantom_set.update(phantoms)
             window.run_command('show_panel', {'panel':'output.auto_matlab'})
+
+            # resolve the references in worker thread, as checking whether
+            # they can be linked may load completions
+            threading.Thread(target=self.resolve_references,
+                             args=(window, panel, self.phantom_set, phantoms,
+                                   refs, mfun_data.key, fun_reader)).start()
         else:
             msg = '[WARNING] AutoMatlab - No documentation found' \
                 + ' for function: {}.'.format(fun)
@@ -797,41 +1307,201 @@ class ShowAutoMatlabDocumentationPanelCommand(sublime_plugin.TextCommand):
                 window.status_message(msg)
 
 
-    def find_hrefs(self, text, window, fun_reader):
+    def cut_references(self, text):
         """Detailed Matlab function documentation contains references to
-        other function ("see also"). Extract these references wrap them
-        in html href tags. Also provide their location and cut them from the
-        text.
+        other function ("see also"). Provide their location and cut them from
+        the text.
+
+        Returns:
+            list: [text, list of (reference, location)]
         """
         # locate 'see also'
         see_regex = re.compile(r'\n\s*see also:?\s*([\s\S]*?)\.?\n\n', re.I)
         mo_see = see_regex.search(text + '\n')
+        if not mo_see:
+            return [text, []]
+
+        # cut referred functions from 'see also', in a single pass
+        see = mo_see.group(1)
+        start_see = mo_see.start(1)
+        refs = []
+        parts = []
+        pos = 0
+        cut = 0
+        for mo_ref in re.finditer(r'[\w\.]+', see):
+            ref = mo_ref.group().rstrip('.')
+            if not ref:
+                continue
+            parts.append(see[pos:mo_ref.start()])
+            refs.append((ref, start_see + mo_ref.start() - cut))
+            pos = mo_ref.start() + len(ref)
+            cut += len(ref)
+        parts.append(see[pos:])
+
+        text = text[:start_see] + ''.join(parts) + text[mo_see.end(1):]
+        return [text, refs]
+
+    def make_reference_phantom(self, ref, point, linkable=False):
+        """Make phantom for a referred function, with an href if it can be
+        linked
+        """
+        if linkable:
+            content = '<a href="{}">{}</a>'.format(ref.lower(), ref)
+        else:
+            content = '<span>{}</span>'.format(ref)
+        return sublime.Phantom(sublime.Region(point, point), content,
+            sublime.LAYOUT_INLINE, self.update_documentation_panel)
+
+    def resolve_references(self, window, panel, phantom_set, phantoms, refs,
+                           fun, fun_reader):
+        """Resolve which referred functions can be linked, and add the links
+        to the panel as they are resolved. Functions that refer to the
+        documented function are appended as "referenced by" links.
+        """
+        # make sure matlab completions are available for linking
+        if not fun_reader.matlab_completions and sublime.load_settings(
+                'AutoMatlab.sublime-settings').get(
+                'matlab_completions', True):
+            fun_reader.load_matlab_completions(window)
+
+        # use precomputed references, if available
+        references = fun_reader.get_references(fun)
+
+        # link referred functions
+        for ii, [ref, loc] in enumerate(refs):
+            if references is not None:
+                linkable = ref.lower() in references
+            else:
+                linkable = fun_reader.is_linkable(ref)
+            if linkable:
+                phantoms[ii + 1] = self.make_reference_phantom(
+                    ref, loc + 1, True)
+                sublime.set_timeout(lambda phantoms=list(phantoms):
+                    self.update_panel_phantoms(panel, phantom_set, phantoms),
+                    0)
+
+        # append functions that refer to this function
+        referenced_by = [fun_reader.matlab_completions[ref][0] for ref in
+                         fun_reader.get_references(fun, 'referenced_by') or []
+                         if ref in fun_reader.matlab_completions]
+        if referenced_by:
+            sublime.set_timeout(lambda: self.append_referenced_by(
+                panel, phantom_set, list(phantoms), referenced_by), 0)
+
+    def update_panel_phantoms(self, panel, phantom_set, phantoms):
+        """Update phantoms of the documentation panel, unless it was
+        replaced in the meantime
+        """
+        if panel.is_valid() and phantom_set is self.phantom_set:
+            phantom_set.update(phantoms)
 
-        # extract referred functions
-        hrefs = {}
-        if mo_see:
-            start_see = mo_see.start()
-            hrefs_see = mo_see.group()
-            parts = mo_see.group(1).replace(',',' ').split()
-            for ref in parts:
-                if ref:
-                    # check if completions exist for referred function
-                    mfun_data = fun_reader.get_mfun_data(window, ref, False)
-                    if mfun_data and mfun_data.valid:
-                        # locate ref within hrefs_see and cut it out
-                        ref_regex = r'\b' + ref + r'\b'
-                        mo_ref = re.search(ref_regex, hrefs_see)
-                        start = mo_ref.start()
-                        end = start + len(ref)
-                        hrefs_see = hrefs_see[:start] + hrefs_see[end:]
-                        hrefs[ref] = start_see + start
-
-            # replace referred function with href
-            text = text.replace(mo_see.group().rstrip(), hrefs_see.rstrip())
-
-        return text, hrefs
+    def append_referenced_by(self, panel, phantom_set, phantoms,
+                             referenced_by):
+        """Append "referenced by" links to the documentation panel
+        """
+        if not (panel.is_valid() and phantom_set is self.phantom_set):
+            return
+        text = '\n\nReferenced by: '
+        start = panel.size()
+        for ii, ref in enumerate(referenced_by):
+            if ii:
+                text += ', '
+            phantoms.append(self.make_reference_phantom(
+                ref, start + len(text), True))
+        panel.run_command("append", {"characters": text + ' '})
+        phantom_set.update(phantoms)
 
     def update_documentation_panel(self, fun):
         sublime.active_window().run_command(
             'show_auto_matlab_documentation_panel', {'fun':fun})
 
+
+
+class SearchAutoMatlabDocumentationCommand(sublime_plugin.WindowCommand):
+
+    """Full-text search over the indexed Matlab function documentation
+    """
+
+    def __init__(self, window):
+        super().__init__(window)
+        self.search_index = None
+        self.search_index_path = None
+        self.search_index_mtime = 0
+        self.search_labels = None # [name, annotation] per function
+        self.results = []
+        # reader of function names and annotations, for search indexes
+        # that do not store them
+        self.fun_reader = None
+
+    def run(self, query=None):
+        """Search documentation for the query, or ask for a query first
+        """
+        if query is None:
+            self.window.show_input_panel('Search Matlab documentation:',
+                                         '', self.search, None, None)
+        else:
+            self.search(query)
+
+    def load_search_index(self):
+        """Load the inverted index stored with the matlab completions,
+        if it was updated since the last time
+        """
+        completions_path = get_matlab_completions_path(
+            get_matlabroot(self.window))
+        path = mindex.section_path(completions_path, 'search')
+        if not isfile(path):
+            self.search_index = None
+            return
+        mtime = getmtime(path)
+        if not path == self.search_index_path \
+                or mtime > self.search_index_mtime:
+            self.search_index = mindex.load_section(
+                completions_path, 'search')
+            self.search_index_path = path
+            self.search_index_mtime = mtime
+            self.search_labels = None
+            if self.search_index and self.search_index.get('labels'):
+                self.search_labels = dict(zip(self.search_index['keys'],
+                                              self.search_index['labels']))
+
+    def search(self, query):
+        """Show functions matching the query in a quick panel
+        """
+        self.load_search_index()
+        if not self.search_index:
+            msg = '[WARNING] AutoMatlab - No documentation search index ' \
+                'found. Try indexing the Matlab completions through the ' \
+                'command palette.'
+            self.window.status_message(msg)
+            return
+
+        # get function names and annotations from the search index, or
+        # else from the (reused) matlab completions
+        labels = self.search_labels
+        if labels is None:
+            if not self.fun_reader:
+                self.fun_reader = AutoMatlabCompletionsListener(False)
+            self.fun_reader.load_matlab_completions(self.window)
+            labels = self.fun_reader.matlab_completions
+        self.results = [fun for fun in mindex.search(self.search_index, query)
+                        if fun in labels]
+
+        if not self.results:
+            msg = '[INFO] AutoMatlab - No documentation found for: ' \
+                '{}'.format(query)
+            self.window.status_message(msg)
+            return
+
+        # show results in quick panel
+        self.window.show_quick_panel(
+            [[labels[fun][0], labels[fun][1]] for fun in self.results],
+            self.selected)
+
+    def selected(self, index):
+        """Show documentation panel for selected function
+        """
+        if index == -1:
+            # case: cancelled
+            return
+        self.window.run_command('show_auto_matlab_documentation_panel',
+                                {'fun': self.results[index]})
@@ -1,15 +1,129 @@
 import re
-from os.path import join, isfile
+import difflib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from os.path import join, isfile, getmtime, dirname
 
 import sublime
 import sublime_plugin
 
+# compiled documentation snippets per snippet setting,
+# see get_documentation_snippet()
+documentation_snippets = {}
+
 
 def plugin_loaded():
     """Do imports that need to wait for Sublime API initilization
     """
-    global abspath
+    global config, abspath, mindex, msnippet
+    import AutoMatlab.lib.config as config
     from AutoMatlab.lib.abspath import abspath
+    import AutoMatlab.lib.mindex as mindex
+    import AutoMatlab.lib.msnippet as msnippet
+
+    # recompile documentation snippets when settings change
+    settings = sublime.load_settings('AutoMatlab.sublime-settings')
+    settings.clear_on_change('auto_matlab_documentation')
+    settings.add_on_change('auto_matlab_documentation',
+                           documentation_snippets.clear)
+
+
+def plugin_unloaded():
+    """Remove settings listener
+    """
+    settings = sublime.load_settings('AutoMatlab.sublime-settings')
+    settings.clear_on_change('auto_matlab_documentation')
+
+
+def get_documentation_snippet(snip_path):
+    """Get compiled documentation snippet. The snippet is only loaded and
+    compiled again when the snippet file was modified.
+
+    Raises:
+        ValueError: Invalid documentation snippet
+    """
+    if snip_path in documentation_snippets:
+        [resource, path, mtime, snippet] = documentation_snippets[snip_path]
+        if not path or (isfile(path) and getmtime(path) == mtime):
+            return snippet
+
+    # read matlab documentation snippet
+    snip_resources = sublime.find_resources(snip_path)
+    if not snip_resources:
+        raise ValueError('Documentation snippet could not be found.')
+    resource = snip_resources[-1]
+    snippet = msnippet.DocumentationSnippet(sublime.load_resource(resource))
+
+    # keep track of modifications, if the snippet is not in a package file
+    path = join(dirname(sublime.packages_path()), resource)
+    if isfile(path):
+        mtime = getmtime(path)
+    else:
+        [path, mtime] = [None, None]
+
+    documentation_snippets[snip_path] = [resource, path, mtime, snippet]
+    return snippet
+
+
+def parse_function_signature(line1, upper=False):
+    """Extract function definition components from the first line of an
+    mfile (with line continuations joined)
+
+    Returns:
+        list: [signature, function name, inargs, outargs], or None
+    """
+    pattern = r'^\s*function\s+((?:\[(.*)\]\s*=|(\w+)\s*=|)' \
+        r'\s*(\w+)\((.*)\))'
+    mo = re.search(pattern, line1)
+    if not mo:
+        return None
+
+    # get signature, outargs, function name, inargs
+    signature = mo.group(1)
+    outargs = []
+    if mo.group(2):
+        outargs = [arg.strip() for arg in mo.group(2).split(',')]
+    if mo.group(3):
+        outargs = [arg.strip() for arg in mo.group(3).split(',')]
+    fun = mo.group(4)
+    inargs = []
+    if mo.group(5):
+        inargs = [arg.strip() for arg in mo.group(5).split(',')]
+    if upper:
+        signature = signature.upper()
+        fun = fun.upper()
+        inargs = [arg.upper() for arg in inargs]
+        outargs = [arg.upper() for arg in outargs]
+    return [signature, fun, inargs, outargs]
+
+
+def is_documented(line2, fun):
+    """Check if function is documented, based on the line after the
+    function definition
+    """
+    return bool(re.search(r'\s*%+[\s%]*' + fun, line2))
+
+
+def get_documentation_settings(project_data):
+    """Get documentation settings, where project settings take precedence
+
+    Returns:
+        list: [snippet name or path, upper case signature]
+    """
+    settings = sublime.load_settings('AutoMatlab.sublime-settings')
+    if project_data:
+        project_settings = project_data.get('auto_matlab', {})
+    else:
+        project_settings = {}
+
+    snip_path = project_settings.get('documentation_snippet')
+    if not snip_path:
+        snip_path = settings.get('documentation_snippet', '')
+    upper = project_settings.get('documentation_upper_case_signature')
+    if upper == None:
+        upper = settings.get('documentation_upper_case_signature', False)
+    return [snip_path, upper]
+
 
 class GenerateAutoMatlabDocumentationCommand(sublime_plugin.TextCommand):
 
@@ -19,13 +133,8 @@ class GenerateAutoMatlabDocumentationCommand(sublime_plugin.TextCommand):
     def run(self, edit):
         """Insert snippet for Matlab function
         """
-        settings = sublime.load_settings('AutoMatlab.sublime-settings')
-        project_data = self.view.window().project_data()
-
-        if project_data:
-            project_settings = project_data.get('auto_matlab', {})
-        else:
-            project_settings = {}
+        [snip_path, upper] = get_documentation_settings(
+            self.view.window().project_data())
 
         # read first line
         region1 = self.view.line(0)
@@ -38,81 +147,20 @@ class GenerateAutoMatlabDocumentationCommand(sublime_plugin.TextCommand):
             line1 = line1[:-3] + self.view.substr(region_expand).strip()
 
         # extract function definition components
-        pattern = r'^\s*function\s+((?:\[(.*)\]\s*=|(\w+)\s*=|)' \
-            r'\s*(\w+)\((.*)\))'
-        mo = re.search(pattern, line1)
-        if not mo:
+        definition = parse_function_signature(line1, upper)
+        if not definition:
             msg = '[WARNING] AutoMatlab - Could not find Matlab ' \
                 'function signature.'
             # print(msg)
             self.view.window().status_message(msg)
             return
-
-        # get signature, outargs, function name, inargs
-        signature = mo.group(1)
-        outargs = []
-        if mo.group(2):
-            outargs = [arg.strip() for arg in mo.group(2).split(',')]
-        if mo.group(3):
-            outargs = [arg.strip() for arg in mo.group(3).split(',')]
-        fun = mo.group(4)
-        inargs = []
-        if mo.group(5):
-            inargs = [arg.strip() for arg in mo.group(5).split(',')]
-        upper = project_settings.get('documentation_upper_case_signature')
-        if upper == None:
-            upper = settings.get('documentation_upper_case_signature', False)
-        if upper:
-            signature = signature.upper()
-            fun = fun.upper()
-            inargs = [arg.upper() for arg in inargs]
-            outargs = [arg.upper() for arg in outargs]
+        [signature, fun, inargs, outargs] = definition
 
         # read matlab documentation snippet
-        snip_path = project_settings.get('documentation_snippet')
-        if not snip_path:
-            snip_path = settings.get('documentation_snippet', '')
-        snip_resources = sublime.find_resources(snip_path)
-        if not snip_resources:
-            msg = '[ERROR] AutoMatlab - Documentation snippet could not ' \
-                'be found.'
-            self.view.window().status_message(msg)
-            raise Exception(msg)
-            return
-        snip_all = sublime.load_resource(snip_resources[-1]).replace(
-            '\r\n', '\n')
-
-        # extract documentation snippet content
-        pattern = r'<!\[CDATA\[([\s\S]*)\]]>'
-        mo = re.search(pattern, snip_all)
-        if not mo:
-            msg = '[ERROR] AutoMatlab - Invalid documentation snippet'
-            self.view.window().status_message(msg)
-            raise Exception(msg)
-            return
-        snip = mo.group(1).strip()
-
-        # some validity checks on the documentation snippet
-        mo = re.findall(r'^[^\n]*\${MDOC_NAME_MARKER}', snip)
-        if not mo:
-            msg = '[ERROR] AutoMatlab - ${MDOC_NAME_MARKER} is compulsory in ' \
-                'first line of documentation snippet.'
-            self.view.window().status_message(msg)
-            raise Exception(msg)
-            return
-
-        mo = re.findall(r'^\W*\${MDOC_NAME}', snip)
-        if not mo:
-            msg = '[ERROR] AutoMatlab - ${MDOC_NAME} is compulsory as ' \
-                'first word of documentation snippet.'
-            self.view.window().status_message(msg)
-            raise Exception(msg)
-            return
-
-        mo = re.search(r'^[^\n]*(\${MDOC_\w*_MARKER}).+', snip, re.M)
-        if mo:
-            msg = '[ERROR] AutoMatlab - ' + mo.group(1) + ' should be at end ' \
-                'of line in documentation snippet.'
+        try:
+            snippet = get_documentation_snippet(snip_path)
+        except ValueError as e:
+            msg = '[ERROR] AutoMatlab - {}'.format(e)
             self.view.window().status_message(msg)
             raise Exception(msg)
             return
@@ -120,10 +168,15 @@ class GenerateAutoMatlabDocumentationCommand(sublime_plugin.TextCommand):
         # check if function is already documented
         region2 = self.view.line(region1.end() + 1)
         line2 = self.view.substr(region2)
-        if not re.search(r'\s*%+[\s%]*' + fun, line2):
+        if not is_documented(line2, fun):
             # compose documentation snippet
-            snip = self.compose_documentation_snippet(snip, signature,
-                                                      fun, inargs, outargs)
+            try:
+                snip = snippet.render(signature, fun, inargs, outargs)
+            except ValueError as e:
+                msg = '[ERROR] AutoMatlab - {}'.format(e)
+                self.view.window().status_message(msg)
+                raise Exception(msg)
+                return
 
             # insert snippet
             self.view.sel().clear()
@@ -140,86 +193,167 @@ class GenerateAutoMatlabDocumentationCommand(sublime_plugin.TextCommand):
             self.view.window().status_message(msg)
             return
 
-    def compose_documentation_snippet(self, snip, signature,
-                                      fun, inargs, outargs):
-        """Compose new documentation snippet based on function signature
+
+class GenerateAutoMatlabProjectDocumentationCommand(
+        sublime_plugin.WindowCommand):
+
+    """Generate documentation for all undocumented functions in the project
+    """
+
+    def run(self, dry_run=True):
+        """Document all undocumented functions in the project include dirs.
+        For a dry run, only show the changes as a diff.
+        """
+        [snip_path, upper] = get_documentation_settings(
+            self.window.project_data())
+        try:
+            snippet = get_documentation_snippet(snip_path)
+        except ValueError as e:
+            msg = '[ERROR] AutoMatlab - {}'.format(e)
+            self.window.status_message(msg)
+            raise Exception(msg)
+            return
+
+        [include_dirs, exclude_dirs, exclude_patterns] = \
+            self.get_project_dirs()
+        if not include_dirs:
+            msg = '[WARNING] AutoMatlab - No project dirs found.'
+            self.window.status_message(msg)
+            return
+        if not dry_run and not sublime.ok_cancel_dialog(
+                'AutoMatlab will add documentation to all undocumented '
+                'functions in the project. Continue?', 'Document'):
+            return
+
+        # document files in worker thread
+        threading.Thread(target=self.document_project,
+                         args=(snippet, upper, include_dirs, exclude_dirs,
+                               exclude_patterns, dry_run)).start()
+
+    def get_project_dirs(self):
+        """Get project include dirs, exclude dirs and exclude patterns
         """
-        # insert function name and signature
-        snip = re.sub(r'\${MDOC_NAME}', fun, snip)
-        snip = re.sub(r'\${MDOC_SIGNATURE}', signature, snip)
-
-        # process input argument block
-        snip = self.compose_arg_snip_lines(snip, inargs,
-                                           'MDOC_INARG_BLOCK_MARKER',
-                                           'MDOC_INARG_MARKER', 'MDOC_INARG')
-        snip = self.compose_arg_snip_lines(snip, outargs,
-                                           'MDOC_OUTARG_BLOCK_MARKER',
-                                           'MDOC_OUTARG_MARKER', 'MDOC_OUTARG')
-        snip = self.compose_arg_snip_lines(snip, inargs + outargs,
-                                           'MDOC_ARG_BLOCK_MARKER',
-                                           'MDOC_ARG_MARKER', 'MDOC_ARG')
-
-        # remove lines with just MARKERS
-        snip = re.sub(r'^[%\s]+\${\w+MARKER}', '%', snip, flags=re.M)
-        # remove sequential empty lines
-        snip = re.sub(r'^[%\s]+\n^[%\s]+$', '%', snip, flags=re.M)
-
-        return snip
-
-    def compose_arg_snip_lines(self, snip, args, mdoc_block_marker,
-                               mdoc_arg_marker, mdoc_arg):
-        """Compose function argument part of snippet, line by line
+        project_info = self.window.extract_variables()
+        project_data = self.window.project_data() or {}
+        folder = project_info.get('folder')
+        include_dirs = None
+        exclude_dirs = []
+        exclude_patterns = []
+
+        # read project dirs from project settings
+        project_settings = project_data.get('auto_matlab', {})
+        if project_settings and folder:
+            include_dirs = abspath(project_settings.get(
+                'include_dirs', None), folder, project_info)
+            exclude_dirs = abspath(project_settings.get(
+                'exclude_dirs', []), folder, project_info)
+            exclude_patterns = project_settings.get('exclude_patterns', [])
+        if include_dirs == None:
+            # set default project dirs if unspecified
+            # (and also apply the exclude dirs)
+            include_dirs = [abspath('*', d)
+                            for d in self.window.folders()
+                            if not any([excl for excl in exclude_dirs
+                                        if abspath(d).startswith(excl)])]
+        return [include_dirs, exclude_dirs, exclude_patterns]
+
+    def document_project(self, snippet, upper, include_dirs, exclude_dirs,
+                         exclude_patterns, dry_run):
+        """Document mfiles on a worker pool, and report the changes
         """
-        # check if argument block is specified in documentation snippet
-        mo = re.search(r'^.*\${' + mdoc_block_marker + '}', snip, re.M)
-        if mo:
-            if args:
-                mo = re.search(
-                    r'^.*\${' + mdoc_arg_marker + '}.*$', snip, re.M)
-                if not (mo and re.search(r'\${' + mdoc_arg + '}', mo.group())):
-                    msg = '[ERROR] AutoMatlab - Argument (marker) field' \
-                        'is missing for ${' + mdoc_block_marker + '}' \
-                        ' of documentation snippet.'
-                    self.view.window().status_message(msg)
-                    raise Exception(msg)
-                    return
-
-                # create argument line template and extract tab index
-                template = mo.group()
-                mo = re.search(r'\${(\d+):', template)
-                index = int(mo.group(1)) if mo else 0
-                shift = 0
-                # initialize with first argument snippet
-                args_snip = re.sub(r'\${' + mdoc_arg + '}', args[0], template)
-                for arg in args[1:]:
-                    # shift tab indexes in arg snippet template
-                    shift += 1
-                    template = self.shift_tab_indexes(template)
-                    # add arg to arg snip
-                    args_snip += '\n' + \
-                        re.sub(r'\${' + mdoc_arg + '}', arg, template)
-                # shift tab indexes in snippet
-                if index:
-                    snip = self.shift_tab_indexes(snip, index, shift)
-                # insert args_snip in snippet and return
-                return re.sub(r'^.*\${' + mdoc_arg_marker + '}.*$', args_snip,
-                              snip, flags=re.M)
-            else:
-                # clear argument related lines
-                snip = re.sub(r'^.*\${' + mdoc_arg_marker + '}.*$', '', snip,
-                              flags=re.M)
-                snip = re.sub(r'^.*\${' + mdoc_block_marker + '}.*$', '', snip,
-                              flags=re.M)
-        return snip
-
-    def shift_tab_indexes(self, snip, num=0, shift=1):
-        """Shift all tab indexes higher than num by shift
+        paths = list(mindex.walk_include_dirs(include_dirs, exclude_dirs,
+                                              exclude_patterns))
+        self.window.status_message(
+            '[INFO] AutoMatlab - Documenting {} files ...'.format(len(paths)))
+
+        with ThreadPoolExecutor(config.MAX_DOCUMENTATION_WORKERS) as pool:
+            results = list(pool.map(
+                lambda path: self.document_file(path, snippet, upper,
+                                                dry_run), paths))
+
+        # report results
+        diffs = [diff for diff in results if diff]
+        errors = [path for path, diff in zip(paths, results)
+                  if diff is None]
+        if dry_run:
+            sublime.set_timeout(lambda: self.show_report(diffs, errors), 0)
+            msg = '[INFO] AutoMatlab - Dry run: {} of {} files would be ' \
+                'documented.'.format(len(diffs), len(paths))
+        else:
+            msg = '[INFO] AutoMatlab - Documented {} of {} files.'.format(
+                len(diffs), len(paths))
+        if errors:
+            msg += ' {} files could not be processed.'.format(len(errors))
+            print('[WARNING] AutoMatlab - Could not document:\n'
+                  + '\n'.join(errors))
+        self.window.status_message(msg)
+
+    @staticmethod
+    def document_file(path, snippet, upper, dry_run):
+        """Document mfile, if it is undocumented
+
+        Returns:
+            str: Diff of the changes, '' if unchanged or None on error
+        """
+        try:
+            with open(path, encoding='cp1252') as fh:
+                text = fh.read()
+                newline = fh.newlines if type(fh.newlines) == str else '\n'
+        except (OSError, UnicodeError):
+            return None
+        lines = text.split('\n')
+
+        # read first line, processed for multiline function definitions
+        nr_lines = 1
+        line1 = lines[0].strip()
+        while line1.endswith('...') and nr_lines < len(lines):
+            line1 = line1[:-3] + lines[nr_lines].strip()
+            nr_lines += 1
+
+        # check if function is already documented
+        definition = parse_function_signature(line1, upper)
+        if not definition:
+            return ''
+        [signature, fun, inargs, outargs] = definition
+        line2 = lines[nr_lines] if nr_lines < len(lines) else ''
+        if is_documented(line2, fun):
+            return ''
+
+        # compose documentation
+        try:
+            doc = msnippet.plain_text(
+                snippet.render(signature, fun, inargs, outargs))
+        except ValueError:
+            return None
+        new_lines = lines[:nr_lines] + (doc + '\n').split('\n') \
+            + lines[nr_lines:]
+        new_text = '\n'.join(new_lines)
+
+        # write file
+        if not dry_run:
+            try:
+                with open(path, 'w', encoding='cp1252',
+                          newline=newline) as fh:
+                    fh.write(new_text)
+            except (OSError, UnicodeError):
+                return None
+
+        return ''.join(difflib.unified_diff(
+            text.splitlines(True), new_text.splitlines(True), path, path,
+            n=1))
+
+    def show_report(self, diffs, errors):
+        """Show diff report of a dry run in a new view
         """
-        # get all tab indexes
-        mo = re.findall(r'\${(\d+):', snip)
-        if mo:
-            # shift tab indexes by shift
-            for i in range(max([int(i) for i in mo]), num, -1):
-                snip = re.sub(r'\${' + str(i) + r':',
-                              '${' + str(i + shift) + ':', snip)
-        return snip
+        view = self.window.new_file()
+        view.set_name('AutoMatlab documentation (dry run)')
+        view.set_scratch(True)
+        view.assign_syntax('Packages/Diff/Diff.sublime-syntax')
+        header = '# {} files would be documented. Run the command without ' \
+            'dry run to apply the changes.\n'.format(len(diffs))
+        if errors:
+            header += '# {} files could not be processed:\n'.format(
+                len(errors)) + ''.join(
+                ['#   {}\n'.format(path) for path in errors])
+        view.run_command('append', {
+            'characters': header + '\n' + '\n'.join(diffs)})
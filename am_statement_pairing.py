@@ -1,90 +1,137 @@
 import re
+import threading
 
 import sublime
 import sublime_plugin
 
-class PairMatlabStatementsCommand(sublime_plugin.TextCommand):
+# cached block trees per buffer id, see get_block_tree()
+block_trees = {}
+block_trees_lock = threading.Lock()
 
-    """Find opening statement that is paired with the current 'end'
+keyword_selector = 'keyword.control, keyword.other'
+scoped_selector = 'comment, string'
+
+# inserted text that can open or close comments and strings
+scope_boundary_regex = re.compile(r'[%\'"{}]')
+
+
+def plugin_loaded():
+    """Do imports that need to wait for Sublime API initilization
     """
+    global config, mblocks
+    import AutoMatlab.lib.config as config
+    import AutoMatlab.lib.mblocks as mblocks
 
-    general_keywords = 'if|for|while|switch|try|function|classdef'
-    class_keywords = 'properties|methods|events|enumeration'
 
-    def iskeyword(self, point):
-        """Does the code contain a Matlab keyword at the point?
-        """
-        # check if it has a keyword scope
-        all_scopes = self.view.scope_name(point)
-        if not any([scope.startswith('keyword.other') 
-                    or scope.startswith('keyword.control')
-                for scope in all_scopes.split()]):
-            return False
+def extract_keywords(view, region=None):
+    """Extract Matlab keywords from view (or from a region in the view), as a
+    sorted list of (begin, end, word) tuples
+    """
+    if region is None:
+        regions = view.find_by_selector(keyword_selector)
+    else:
+        regions = [reg for reg, scope in view.extract_tokens_with_scopes(region)
+                   if sublime.score_selector(scope, keyword_selector)]
+
+    keywords = []
+    for reg in regions:
+        for mo in re.finditer(r'\w+', view.substr(reg)):
+            begin = reg.begin() + mo.start()
+            # check if not preceded by a '.'
+            # (bug in default Sublime matlab syntax definition)
+            if begin and view.substr(begin - 1) == '.':
+                continue
+            keywords.append((begin, reg.begin() + mo.end(), mo.group()))
+    return keywords
+
+
+def get_block_tree(view):
+    """Get block tree of view. The tree is kept up to date with the edits
+    in the view (see MatlabBlockChangeListener) by rescanning the edited
+    lines only. It is rebuilt if it got out of sync, or if an edit changed
+    the comments and strings.
+    """
+    with block_trees_lock:
+        change_count = view.change_count()
+        tree = block_trees.get(view.buffer_id())
+        if tree is not None and tree.change_count == change_count:
+            # rescan edited lines, unless they contain a line continuation
+            lines = [view.full_line(sublime.Region(begin, end))
+                     for begin, end in tree.dirty]
+            if not any('...' in view.substr(reg) for reg in lines):
+                for reg in lines:
+                    tree.rescan(reg.begin(), reg.end(),
+                                extract_keywords(view, reg))
+                tree.dirty = []
+                tree.pair()
+
+                # discard tree if the view was edited while reading it
+                if view.change_count() != change_count:
+                    block_trees.pop(view.buffer_id(), None)
+                return tree
+            block_trees.pop(view.buffer_id(), None)
+
+    # build tree outside the lock, as it reads the whole view
+    tree = mblocks.BlockTree(extract_keywords(view), change_count,
+                             [(reg.begin(), reg.end()) for reg
+                              in view.find_by_selector(scoped_selector)])
+
+    # only keep tree if the view was not edited while reading it
+    with block_trees_lock:
+        if view.change_count() == change_count:
+            block_trees[view.buffer_id()] = tree
+    return tree
 
-        # check if not preceded by a '.' 
-        # (bug in default Sublime matlab syntax definition)
-        reg_prev_char = sublime.Region(self.view.word(point).begin() - 1, 
-            self.view.word(point).begin())
-        if self.view.substr(reg_prev_char) == '.':
-            return False
 
-        return True
+class PairMatlabStatementsCommand(sublime_plugin.TextCommand):
 
+    """Find opening statement that is paired with the current 'end'
+    """
 
     def run(self, edit, action='popup'):
         """Find opening statement that is paired with the current 'end'
         """
-        # determine valid keywords
-        keywords = self.general_keywords
-        all_code = self.view.substr(sublime.Region(0, self.view.size()))
-        if all_code.lstrip().startswith('classdef'):
-            keywords += '|' + self.class_keywords
-
         # get current selection
         sel = self.view.sel()
         if not len(sel):
             return
-        reg_key = self.view.word(sel[0])
-        text_key = self.view.substr(reg_key).strip()
 
-        # check if the current selection equals a valid keyword
-        if not self.iskeyword(reg_key.begin()) \
-                or not text_key in keywords + '|end':
+        # check if the current selection is in a valid keyword
+        tree = get_block_tree(self.view)
+        ii_key = tree.keyword_at(sel[0].begin())
+        if ii_key is None:
             if not(action == 'jump' or action == 'select'):
                 msg = '[WARNING] AutoMatlab - Cursor not in open/end keyword.'
                 self.view.window().status_message(msg)
             return
 
-        if text_key == 'end':
-            # look for matching open statement
-            reg_paired = self.pair_with_open_statement(reg_key, keywords)
-            if reg_paired:
-                # the below disregards edge-cases with partial one-line 
-                # statements or with , or ; in strings or comments
-                if self.view.line(reg_key) == self.view.line(reg_paired):
-                    sel_lines = [reg_key.begin(), reg_paired.end()]
-                else:
-                    sel_lines = [self.view.full_line(reg_key.begin()).begin(), 
-                        self.view.full_line(reg_paired.end()).end()]
-        else:
-            # look for matching end statement
-            reg_paired = self.pair_with_end_statement(reg_key, keywords)
-            if reg_paired:
-                # the below disregards edge-cases with partial one-line 
-                # statements or with , or ; in strings or comments
-                if self.view.line(reg_key) == self.view.line(reg_paired):
-                    sel_lines = [reg_key.end(), reg_paired.begin()]
-                else:
-                    sel_lines = [self.view.full_line(reg_key.end()).end(), 
-                        self.view.full_line(reg_paired.begin()).begin()]
-
-        # check if matching statement was found
-        if reg_paired == None:
+        # look for matching statement
+        ii_paired = tree.paired(ii_key)
+        if ii_paired is None:
             if not(action == 'jump' or action == 'select'):
                 msg = '[WARNING] AutoMatlab - Cannot pair statement: ' \
                     'invalid syntax.'
                 self.view.window().status_message(msg)
             return
+        reg_key = sublime.Region(*tree.region(ii_key))
+        reg_paired = sublime.Region(*tree.region(ii_paired))
+
+        # the below disregards edge-cases with partial one-line
+        # statements or with , or ; in strings or comments
+        if ii_paired < ii_key:
+            # paired with open statement
+            if self.view.line(reg_key) == self.view.line(reg_paired):
+                sel_lines = [reg_key.begin(), reg_paired.end()]
+            else:
+                sel_lines = [self.view.full_line(reg_key.begin()).begin(),
+                    self.view.full_line(reg_paired.end()).end()]
+        else:
+            # paired with end statement
+            if self.view.line(reg_key) == self.view.line(reg_paired):
+                sel_lines = [reg_key.end(), reg_paired.begin()]
+            else:
+                sel_lines = [self.view.full_line(reg_key.end()).end(),
+                    self.view.full_line(reg_paired.begin()).begin()]
 
         if action == 'jump':
             self.view.show(reg_paired)
@@ -138,88 +185,6 @@ class PairMatlabStatementsCommand(sublime_plugin.TextCommand):
                 on_navigate=self.select)
 
 
-    def pair_with_open_statement(self, reg, keywords):
-        """Find the open statement paired with the end statement
-        in region reg.
-        """
-        # read all code until current end statement
-        code = self.view.substr(sublime.Region(0, reg.end()))
-
-        # look for end statements
-        pattern = r'(?:\W|^)(end)(?:\W|$)'
-        mo_end = re.finditer(pattern, code, re.M)
-
-        # look for opening statements to pair
-        pattern = r'(?:\W|^)(' + keywords + r')(?:\W|$)'
-        mo_open = re.finditer(pattern, code, re.M)
-
-        # strip non-keywords
-        end_statements = sorted([mo.start(1)
-            for mo in mo_end
-            if self.iskeyword(mo.start(1))], reverse=True)
-        open_statements = sorted([mo.start(1) 
-            for mo in mo_open
-            if self.iskeyword(mo.start(1))], reverse=True)
-
-        # check validity of open/end combinations
-        no = len(open_statements)
-        ne = len(end_statements)
-        if ne > no:
-            return None
-
-        for ii in range(no):
-            # check how many end statements come after each open statement,
-            # starting from the last open statement
-            end_after = sum([open_statements[ii] < estat 
-                for estat in end_statements])
-            # the paired open statement is found when end_after matches
-            # the current counter
-            if end_after == ii+1:
-                reg_paired = self.view.word(open_statements[ii])
-                break
-        return reg_paired
-
-    def pair_with_end_statement(self, reg, keywords):
-        """Find the end statement paired with the open statement
-        in region reg.
-        """
-        # read all code from current open statement
-        code = self.view.substr(sublime.Region(reg.begin(), self.view.size()))
-
-        # look for end statements
-        pattern = r'(?:\W|^)(end)(?:\W|$)'
-        mo_end = re.finditer(pattern, code, re.M)
-
-        # look for opening statements to pair
-        pattern = r'(?:\W|^)(' + keywords + r')(?:\W|$)'
-        mo_open = re.finditer(pattern, code, re.M)
-
-        # strip non-keywords
-        end_statements = sorted([reg.begin() + mo.start(1)
-            for mo in mo_end
-            if self.iskeyword(reg.begin() + mo.start(1))])
-        open_statements = sorted([reg.begin() + mo.start(1) 
-            for mo in mo_open
-            if self.iskeyword(reg.begin() + mo.start(1))])
-
-        # check validity of open/end combinations
-        no = len(open_statements)
-        ne = len(end_statements)
-        if no > ne:
-            return None
-
-        for ii in range(ne):
-            # check how many open statements come before each end statement,
-            # starting from the first end statement
-            open_before = sum([end_statements[ii] > ostat 
-                for ostat in open_statements])
-            # the paired end statement is found when open_before matches
-            # the current counter
-            if open_before == ii+1:
-                reg_paired = self.view.word(end_statements[ii])
-                break
-        return reg_paired
-
     def select(self, reg):
         """Select the lines between the paired open/end statements
         """
@@ -231,4 +196,115 @@ class PairMatlabStatementsCommand(sublime_plugin.TextCommand):
         # select region
         self.view.show(reg[1])
         self.view.sel().clear()
-        self.view.sel().add(sublime.Region(reg[0], reg[1]))
\ No newline at end of file
+        self.view.sel().add(sublime.Region(reg[0], reg[1]))
+
+class MatlabBlockTreeListener(sublime_plugin.EventListener):
+
+    """Clean up the cached block trees
+    """
+
+    def on_close(self, view):
+        """Remove the block tree of the closed view
+        """
+        with block_trees_lock:
+            block_trees.pop(view.buffer_id(), None)
+
+
+class MatlabBlockChangeListener(sublime_plugin.TextChangeListener):
+
+    """Keep the cached block trees in sync with edits
+    """
+
+    @classmethod
+    def is_applicable(cls, buffer):
+        """Only track edits in Matlab files
+        """
+        view = buffer.primary_view()
+        return view is not None \
+            and 'matlab' in view.settings().get('syntax', '').lower()
+
+    def on_text_changed(self, changes):
+        """Update keyword positions in the block tree of the buffer, or
+        discard the tree if an edit changed the comments and strings
+        """
+        with block_trees_lock:
+            tree = block_trees.get(self.buffer.id())
+            if not tree:
+                return
+            for change in changes:
+                if tree.replace(change.a.pt, change.b.pt, len(change.str)) \
+                        or scope_boundary_regex.search(change.str):
+                    block_trees.pop(self.buffer.id(), None)
+                    return
+            tree.change_count = self.buffer.primary_view().change_count()
+
+
+class MatlabBlockHighlightListener(sublime_plugin.ViewEventListener):
+
+    """Highlight the statement paired with the open/end keyword at the cursor
+    """
+
+    @classmethod
+    def is_applicable(cls, settings):
+        """Only highlight paired statements in Matlab files
+        """
+        return 'matlab' in settings.get('syntax', '').lower()
+
+    def __init__(self, view):
+        super().__init__(view)
+        self.pending = 0 # number of pending highlight requests
+        self.highlighted = [] # currently highlighted regions
+
+    def on_modified_async(self):
+        """Update highlight after edit
+        """
+        self.request_highlight()
+
+    def on_selection_modified_async(self):
+        """Update highlight after cursor movement
+        """
+        self.request_highlight()
+
+    def request_highlight(self):
+        """Request highlight, which is only drawn after the cursor has been
+        at rest for a while
+        """
+        self.pending += 1
+        sublime.set_timeout_async(self.highlight_pending,
+                                  config.PAIRED_STATEMENTS_HIGHLIGHT_DELAY)
+
+    def highlight_pending(self):
+        """Draw highlight for the last request
+        """
+        self.pending -= 1
+        if self.pending:
+            return
+        self.highlight()
+
+    def highlight(self):
+        """Highlight the keyword at the cursor and its paired keyword
+        """
+        regions = []
+        settings = sublime.load_settings('AutoMatlab.sublime-settings')
+        sel = self.view.sel()
+        if settings.get('highlight_paired_statements', True) \
+                and len(sel) == 1 and sel[0].empty():
+            tree = get_block_tree(self.view)
+            ii_key = tree.keyword_at(sel[0].b)
+            if ii_key is not None:
+                ii_paired = tree.paired(ii_key)
+                if ii_paired is not None:
+                    regions = [sublime.Region(*tree.region(ii_key)),
+                               sublime.Region(*tree.region(ii_paired))]
+
+        # only redraw if changed
+        if regions == self.highlighted:
+            return
+        self.highlighted = regions
+        if regions:
+            self.view.add_regions(
+                'auto_matlab_paired_statements', regions, 'region.bluish',
+                flags=sublime.DRAW_NO_FILL | sublime.DRAW_NO_OUTLINE
+                | sublime.DRAW_SOLID_UNDERLINE)
+        else:
+            self.view.erase_regions('auto_matlab_paired_statements')
@@ -1,4 +1,9 @@
 """Functions for converting relative path(s) into absolute path(s).
+
+Regex paths are memoized. A memoized path is reused as long as the
+modification times of all directories that were listed to find it are
+unchanged. Directory listings and compiled pattern parts are shared
+between lookups.
 """
 
 import os
@@ -11,9 +16,14 @@ except:
         @staticmethod
         def expand_variables(path, vars={}):
             for k, v in vars.items():
-                path = path.subs(k, v)
+                path = path.replace('${' + k + '}', v).replace('$' + k, v)
             return path
 
+# memoized regex paths, directory listings and compiled pattern parts
+_regexpaths = {}
+_listings = {}
+_patterns = {}
+
 
 def abspath(path, base=None, vars={}, regex=False):
     """Convert relative path(s) into absolute path(s) wrt base.
@@ -101,11 +111,22 @@ def _regexpath(path_pattern, base="", vars={}):
     if not parts:
         return None
 
-    return _findpath(parts)
+    # reuse memoized path if the listed directories did not change
+    key = tuple(parts)
+    if key in _regexpaths:
+        path, listed = _regexpaths[key]
+        if all(_mtime(d) == mtime for d, mtime in listed):
+            return path
+
+    listed = []
+    path = _findpath(parts, listed)
+    _regexpaths[key] = (path, listed)
+    return path
 
 
-def _findpath(parts):
-    """Recursive construct path from pattern parts
+def _findpath(parts, listed=None):
+    """Recursive construct path from pattern parts, keeping track of the
+    listed directories and their modification times
     """
 
     # check if finished
@@ -120,12 +141,15 @@ def _findpath(parts):
     if not os.path.isdir(parts[0]):
         return None
 
-    for f in os.listdir(parts[0]) + ['.', '..']:
+    if listed is None:
+        listed = []
+    pattern = _pattern(parts[1])
+    for f in _listdir(parts[0], listed) + ['.', '..']:
         # look for pattern match
-        mo = re.search(r'^' + parts[1] + r'$', f, re.I)
+        mo = pattern.search(f)
         if mo:
             # recursively parse pattern parts
-            path = _findpath([os.path.join(parts[0], f)] + parts[2:])
+            path = _findpath([os.path.join(parts[0], f)] + parts[2:], listed)
 
             if path:
                 # match found
@@ -135,6 +159,40 @@ def _findpath(parts):
     return None
 
 
+def _pattern(part):
+    """Get compiled pattern for path part
+    """
+    if part not in _patterns:
+        _patterns[part] = re.compile(r'^' + part + r'$', re.I)
+    return _patterns[part]
+
+
+def _mtime(path):
+    """Get modification time of path, or None if it does not exist
+    """
+    try:
+        return os.stat(path).st_mtime
+    except OSError:
+        return None
+
+
+def _listdir(path, listed):
+    """List directory, reusing the previous listing if the directory was not
+    modified since
+    """
+    mtime = _mtime(path)
+    listed.append((path, mtime))
+    if path in _listings and _listings[path][0] == mtime:
+        return _listings[path][1]
+
+    try:
+        files = os.listdir(path)
+    except OSError:
+        files = []
+    _listings[path] = (mtime, files)
+    return files
+
+
 if __name__ == '__main__':
     # tests
     sublimeroot_pattern = r'C:/(Program Files|\.)/Sublime Text \d'
@@ -1,26 +1,72 @@
 """Configuration of globals, constants and defaults across AutoMatlab
 
+Functions:
+    default_matlabroot(): Default Matlab installation path
+    default_matlab_history_path(): Default path to Matlab history file
+
 Attributes:
-    DEFAULT_MATLABROOT (str): Default Matlab installation path
-    DEFAULT_MATLAB_HISTORY_PATH (str): Default path to Matlab history file
     DEFAULT_MATLAB_PATHDEF_PATH (str): Default path to Matlab pathdef file
     DEFAULT_AUTO_HOTKEY_PATH (str): Default path to AutoHotkey executable
     CONTENTS_NAME (str): Name of Matlab contents file
     SIGNATURES_NAME (str): Name of Matlab signatures file
     AUTO_HOTKEY_SCRIPT (str): Name of AutoHotkey script to run matlab commands
-    MATLAB_COMPLETIONS_PATH (str): Path to AutoMatlab completions, generated 
-        from Matlab installation
+    MATLAB_SESSION_OUTPUT_PANEL (str): Name of output panel for the output of
+        the persistent Matlab session
+    MATLAB_SESSION_OUTPUT_DELAY (int): Interval (ms) at which output of the
+        persistent Matlab session is appended to the output panel
+    MAX_DOCUMENTATION_WORKERS (int): Number of worker threads that document
+        the files of a project
+    PAIRED_STATEMENTS_HIGHLIGHT_DELAY (int): Delay (ms) before highlighting
+        the statement paired with the keyword at the cursor
+    DEFAULT_PATHS_STATE_PATH (str): Path (relative to the Sublime cache) to
+        the resolved default paths
+    MATLAB_HISTORY_INDEX_PATH (str): Path (relative to the Sublime cache) to
+        the index of all commands in the Matlab history
+    MATLAB_COMPLETIONS_PATH (str): Path to default AutoMatlab completions.
+        Completions generated from a Matlab installation are stored in a
+        subdir per Matlab release.
     MAX_LOADED_PROJECT_COMPLETIONS (int): Maximum number of projects for which
         completion information is kept stored in memory.
+    MAX_LOADED_MATLAB_COMPLETIONS (int): Maximum number of Matlab releases
+        for which completion information is kept stored in memory.
+    MATLAB_SHARD_IDLE_TIME (int): Time (s) after which Matlab completions of
+        a toolbox are removed from memory, if they were not used.
+    STALE_ENTRY_CHUNK_SIZE (int): Number of completions that is verified at
+        once for deleted or modified mfiles
+    STALE_ENTRY_DELAY (int): Delay (ms) between verifying chunks of
+        completions
+    STALE_ENTRY_SWEEP_DELAY (int): Delay (ms) between verifying all
+        completions and starting over
+    COMPLETION_TRACE_PATH (str): Path (relative to the Sublime cache) to
+        the trace of recorded completion queries
+    MAX_CACHED_DOCUMENTATION (int): Maximum number of parsed and rendered
+        function documentations that is kept stored in memory.
     EASTER (list): A list of Matlab easter eggs.
 
 Note: 
     Some of variables depend on Sublime API functions. They require the
     Sublime plugin to be loaded before this module is imported:
     - MATLAB_COMPLETIONS_PATH
+
+    Outside of Sublime, the default paths are searched for on every first
+    request, as there is no Sublime cache to store them in.
+
+    The default paths that have to be searched for (default_matlabroot,
+    default_matlab_history_path) are only resolved when first requested.
+    They are stored in a state file, such that later Sublime sessions only
+    need to check whether the stored paths still exist.
 """
 
-import sublime
+import json
+import threading
+from os import makedirs
+from os.path import exists, join, split
+
+try:
+    import sublime
+except ImportError:
+    # running outside of Sublime, e.g. indexing from the command line
+    sublime = None
 
 from AutoMatlab.lib.abspath import abspath
 
@@ -30,8 +76,6 @@ matlabroot_pattern = \
 matlab_history_pattern = \
     r'~/AppData/Roaming/MathWorks/MATLAB/R\d{4}[a,b]/History.xml'
 
-DEFAULT_MATLABROOT = abspath(matlabroot_pattern, regex=True)
-DEFAULT_MATLAB_HISTORY_PATH = abspath(matlab_history_pattern, regex=True)
 DEFAULT_MATLAB_PATHDEF_PATH = 'toolbox/local/pathdef.m'
 DEFAULT_AUTO_HOTKEY_PATH = abspath(
     'C:/Program Files/AutoHotkey/AutoHotkey.exe')
@@ -42,10 +86,29 @@ SIGNATURES_NAME = 'functionSignatures.json'
 
 # AutoMatlab commands
 AUTO_HOTKEY_SCRIPT = 'run_in_matlab.ahk'
+MATLAB_SESSION_OUTPUT_PANEL = 'auto_matlab_session'
+MATLAB_SESSION_OUTPUT_DELAY = 50
+
+# AutoMatlab documentation
+MAX_DOCUMENTATION_WORKERS = 8
+
+# AutoMatlab statement pairing
+PAIRED_STATEMENTS_HIGHLIGHT_DELAY = 100
+
+# AutoMatlab state
+DEFAULT_PATHS_STATE_PATH = 'AutoMatlab/default_paths.json'
+MATLAB_HISTORY_INDEX_PATH = 'AutoMatlab/matlab_history_index'
 
 # AutoMatlab completions
 MATLAB_COMPLETIONS_PATH = "AutoMatlab/data/matlab_completions"
 MAX_LOADED_PROJECT_COMPLETIONS = 7
+MAX_LOADED_MATLAB_COMPLETIONS = 3
+MATLAB_SHARD_IDLE_TIME = 600
+STALE_ENTRY_CHUNK_SIZE = 100
+STALE_ENTRY_DELAY = 1000
+STALE_ENTRY_SWEEP_DELAY = 60000
+COMPLETION_TRACE_PATH = 'AutoMatlab/completion_queries.jsonl'
+MAX_CACHED_DOCUMENTATION = 64
 EASTER = ['spy', 'life', 'why', 'image', 'penny', 'shower',
           'xpsound', 'xpquad', 'xpbombs', 'wrldtrv', 'vibes', 'truss',
           'makevase', 'lorenz', 'knot', 'imageext', 'earthmap',
@@ -53,3 +116,74 @@ EASTER = ['spy', 'life', 'why', 'image', 'penny', 'shower',
           'imagesAndVideo', 'fifteen']
 # toolbox easter eggs: 'rlc_gui', 'sf_tictacflow', 'eml_fire', 'eml_asteroids'
 # failing easter eggs: 'toilet', 'lala', 'shower', 'viper', 'eigshow', 'census'
+
+
+# resolved default paths
+_default_paths = {}
+_default_paths_lock = threading.Lock()
+
+
+def default_matlabroot():
+    """Get default Matlab installation path
+    """
+    return _default_path('matlabroot', matlabroot_pattern)
+
+
+def default_matlab_history_path():
+    """Get default path to Matlab history file
+    """
+    return _default_path('matlab_history_path', matlab_history_pattern)
+
+
+def _default_path(name, pattern):
+    """Resolve default path from regex pattern, reusing the path resolved
+    earlier (in this or a previous session) if it still exists
+    """
+    with _default_paths_lock:
+        if name in _default_paths:
+            return _default_paths[name]
+
+        if not sublime:
+            _default_paths[name] = abspath(pattern, regex=True)
+            return _default_paths[name]
+
+        # validate stored path
+        state_path = join(sublime.cache_path(), DEFAULT_PATHS_STATE_PATH)
+        state = _read_state(state_path)
+        stored = state.get(name)
+        if stored and stored.get('pattern') == pattern \
+                and stored.get('path') and exists(stored.get('path')):
+            path = stored.get('path')
+        else:
+            # search path and store it
+            path = abspath(pattern, regex=True)
+            state[name] = {'pattern': pattern, 'path': path}
+            _write_state(state_path, state)
+
+        _default_paths[name] = path
+        return path
+
+
+def _read_state(state_path):
+    """Read state file, ignoring missing or corrupt files
+    """
+    try:
+        with open(state_path) as fh:
+            state = json.load(fh)
+        if type(state) == dict:
+            return state
+    except:
+        pass
+    return {}
+
+
+def _write_state(state_path, state):
+    """Write state file, ignoring failures (it is only a cache)
+    """
+    try:
+        if not exists(split(state_path)[0]):
+            makedirs(split(state_path)[0])
+        with open(state_path, 'w') as fh:
+            json.dump(state, fh)
+    except:
+        pass
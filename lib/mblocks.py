@@ -0,0 +1,155 @@
+"""Block structure of Matlab code.
+
+The block structure is derived from the Matlab keywords in the code, given
+as a sorted list of (begin, end, word) tuples. Every opening keyword (if, for,
+function, ...) is paired with its 'end' keyword using a stack, such that
+pairing statements only requires a lookup.
+
+The tree can be maintained incrementally while the code is edited: replace()
+updates the keyword positions for an edit and marks the edited code as dirty,
+after which rescan() replaces the keywords in the dirty code and pair()
+rebuilds the pairing. This only holds as long as the edit does not change
+the comments and strings, which can hide keywords beyond the edited code.
+Therefore, the tree also keeps the (begin, end) ranges of the comments and
+strings, and replace() reports if the edit removed one of their boundaries.
+"""
+
+import bisect
+
+# keywords that open a block
+general_keywords = ['if', 'for', 'while', 'switch', 'try', 'function',
+                    'classdef']
+# keywords that only open a block in a classdef file
+class_keywords = ['properties', 'methods', 'events', 'enumeration']
+
+
+class BlockTree:
+
+    """Tree of Matlab blocks, each spanning from an opening keyword to
+    the paired 'end' keyword.
+    """
+
+    def __init__(self, keywords, change_count=None, scoped=()):
+        self.all_keywords = list(keywords) # all keywords in the code
+        self.change_count = change_count # version of the code
+        self.scoped = list(scoped) # (begin, end) ranges of comments/strings
+        self.dirty = [] # edited (begin, end) ranges, to be rescanned
+        self.pair()
+
+    def pair(self):
+        """Pair the block keywords
+        """
+        # keep block keywords only
+        keywords = self.all_keywords
+        classdef = bool(keywords) and keywords[0][2] == 'classdef'
+        valid = set(general_keywords + ['end']
+                    + (class_keywords if classdef else []))
+        self.keywords = [kw for kw in keywords if kw[2] in valid]
+        self.begins = [kw[0] for kw in self.keywords]
+
+        # blocks [open index, end index, parent block], in order of opening
+        self.blocks = []
+        # map keyword index onto index of its block
+        self.keyword_blocks = {}
+
+        # pair keywords, leaving unterminated blocks (e.g. functions without
+        # 'end') and superfluous ends unpaired
+        stack = []
+        for ii, kw in enumerate(self.keywords):
+            if kw[2] == 'end':
+                if stack:
+                    block = stack.pop()
+                    self.blocks[block][1] = ii
+                    self.keyword_blocks[ii] = block
+            else:
+                self.keyword_blocks[ii] = len(self.blocks)
+                self.blocks.append([ii, None, stack[-1] if stack else None])
+                stack.append(len(self.blocks) - 1)
+
+    def replace(self, begin, end, size):
+        """Update keyword positions for replacing the code [begin, end) by
+        code of the given size. Keywords touching the replaced code are
+        dropped, and the new code is marked as dirty.
+
+        Returns:
+            bool: whether the replaced code contained the boundary of a
+                comment or string, such that the tree must be rebuilt
+        """
+        delta = size - (end - begin)
+
+        # shift comments and strings, and check if a boundary was removed
+        scoped = []
+        for s0, s1 in self.scoped:
+            if begin <= s0 < end or begin < s1 <= end:
+                return True
+            if s1 < begin:
+                scoped.append((s0, s1))
+            elif s0 >= end:
+                scoped.append((s0 + delta, s1 + delta))
+            else:
+                scoped.append((s0, s1 + delta))
+        self.scoped = scoped
+
+        self.all_keywords = \
+            [kw if kw[1] < begin else (kw[0] + delta, kw[1] + delta, kw[2])
+             for kw in self.all_keywords if kw[1] < begin or kw[0] > end]
+
+        # shift dirty ranges and merge the ones touching the new code
+        dirty = [[begin, begin + size]]
+        for d0, d1 in self.dirty:
+            if d1 < begin:
+                dirty.append([d0, d1])
+            elif d0 > end:
+                dirty.append([d0 + delta, d1 + delta])
+            else:
+                dirty[0][0] = min(dirty[0][0], d0)
+                dirty[0][1] = max(dirty[0][1], d1 + delta)
+        self.dirty = sorted(dirty)
+        return False
+
+    def rescan(self, begin, end, keywords):
+        """Replace the keywords in [begin, end) by the given keywords
+        """
+        begins = [kw[0] for kw in self.all_keywords]
+        lo = bisect.bisect_left(begins, begin)
+        hi = bisect.bisect_left(begins, end)
+        self.all_keywords[lo:hi] = keywords
+
+    def keyword_at(self, point):
+        """Get index of the keyword containing point, or None
+        """
+        ii = bisect.bisect_right(self.begins, point) - 1
+        if ii >= 0 and point <= self.keywords[ii][1]:
+            return ii
+        return None
+
+    def paired(self, ii):
+        """Get index of the keyword paired with keyword ii, or None
+        """
+        block = self.keyword_blocks.get(ii)
+        if block is None:
+            return None
+        [open_ii, end_ii, parent] = self.blocks[block]
+        return end_ii if ii == open_ii else open_ii
+
+    def block_at(self, point):
+        """Get innermost terminated block [open index, end index, parent]
+        that contains point, or None
+        """
+        # start at the last keyword before point and walk up the tree
+        ii = bisect.bisect_right(self.begins, point) - 1
+        block = None
+        while ii >= 0 and block is None:
+            block = self.keyword_blocks.get(ii)
+            ii -= 1
+        while block is not None:
+            [open_ii, end_ii, parent] = self.blocks[block]
+            if end_ii is not None and point <= self.keywords[end_ii][1]:
+                return self.blocks[block]
+            block = parent
+        return None
+
+    def region(self, ii):
+        """Get (begin, end) of keyword ii
+        """
+        return self.keywords[ii][0], self.keywords[ii][1]
@@ -0,0 +1,625 @@
+"""Functions for indexing the Matlab completions of a Matlab installation.
+
+The indexing does not depend on the Sublime API, such that it can run both
+inside Sublime (see IndexMatlabCompletionsCommand) and as a standalone
+script. The settings are passed as a dict with the keys of the Matlab
+autocompletion sources in the AutoMatlab settings. The Sublime command only
+reads these settings and reports the progress.
+
+Usage:
+    python -m AutoMatlab.lib.mbuild [-h] [--settings SETTINGS]
+                                    [--output OUTPUT] matlabroot
+
+    Run from the dir that contains the AutoMatlab package (i.e. the Sublime
+    Packages dir). The completions are stored in the output dir, in the same
+    layout as in the Sublime Packages dir, e.g.
+    <output>/AutoMatlab/data/R2021a/matlab_completions, such that they can
+    be copied into the Packages dir of any Sublime installation.
+"""
+
+import re
+import sys
+import json
+import time
+import errno
+import heapq
+import argparse
+from os import listdir, walk, makedirs
+from os.path import isdir, isfile, join, split, getsize
+
+import AutoMatlab.lib.config as config
+from AutoMatlab.lib.abspath import abspath
+from AutoMatlab.lib.mfun import mfun
+import AutoMatlab.lib.mindex as mindex
+
+# defaults of the Matlab autocompletion sources in the AutoMatlab settings
+default_settings = {
+    'matlab_pathdef_path': 'default',
+    'include_dirs': [],
+    'exclude_dirs': [],
+    'exclude_patterns': [],
+    'use_contents_files': 'dir',
+    'use_signatures_files': 'dir',
+    'use_matlab_path': 'ignore',
+    'index_header_bytes': 65536,
+    'index_header_lines': 0,
+    'index_statistics': False}
+
+
+def process_signature(signature):
+    """Process a functionSignatures.json file to extract Matlab function names
+    from it.
+
+    Although functionSignatures.json contains the autocompletion information
+    that Matlab natively uses, only the function names are extracted from this
+    file by AutoMatlab. The reason is that the autocompletion information in
+    functionSignatures.json is very inconsistent and incomplete.
+    """
+    if not isfile(signature):
+        return []
+
+    # read as string data
+    with open(signature) as fh:
+        data = fh.read()
+
+    # remove comments, as the python json parses has issues with those
+    pattern = r'\/\/.*'
+    data = re.sub(pattern, '', data)
+
+    # remove linebreak in multiline strings, as they are not standard json
+    pattern = r'\.\.\.\s+'
+    data = re.sub(pattern, '', data)
+
+    # place comma's between sequences of strings, as this is required for json
+    pattern = r'"\s+"'
+    data = re.sub(pattern, '","', data)
+
+    # # read json with custom decoder, to retain duplicate keys
+    # decoder = json.JSONDecoder(object_pairs_hook=lambda x: tuple(x))
+    # signatures = decoder.decode(data)
+    # read json
+    try:
+        fun_dict = json.loads(data)
+    except:
+        msg = '[WARNING] AutoMatlab - Failed to decode json file: ' + signature
+        # print(msg)
+        return []
+
+    # extract all function names
+    funs = []
+    for fun in fun_dict.keys():
+        funs.append(fun)
+
+    return funs
+
+
+def process_contents(contents):
+    """Process a Contents.m file to extract Matlab function names from it.
+
+    This function expects the default Matlab structure of Contents.m files.
+    Unfortunately, this structure is not always faithfully applied, in which
+    case AutoMatlab won't recognize the functions.
+    """
+    if not isfile(contents):
+        return []
+
+    # read data line by line
+    funs = []
+    with open(contents, encoding='cp1252') as fh:
+        try:
+            line = fh.readline()
+        except:
+            return funs
+        while line:
+            # interrupt at copyright message
+            if 'copyright' in line.lower():
+                break
+            # extract function name
+            pattern = r'^\s*%\s*(\w+)\s+-'
+            mo = re.search(pattern, line)
+            if mo:
+                funs.append(mo.group(1))
+
+            # read next line
+            try:
+                line = fh.readline()
+            except:
+                return funs
+    return funs
+
+
+def process_pathdef(matlab_pathdef_path, matlabroot):
+    """Process pathdef.m file to extract all directories in the Matlab path.
+    """
+    matlab_path_dirs = []
+    abs_dir_regex = re.compile(r"'(.+);'")
+    rel_dir_regex = re.compile(r"'[\\\/]*(.+);'")
+
+    # open pathdef file
+    with open(matlab_pathdef_path, encoding='cp1252') as fh:
+        line = fh.readline()
+        process_line = False
+
+        # read line by line
+        while line:
+            # stop processing at END ENTRIES
+            if 'END ENTRIES' in line:
+                break
+            # process lines containing directories
+            if process_line:
+                if 'matlabroot' in line:
+                    # ensure dir is extracted as relative dir
+                    mo = rel_dir_regex.search(line)
+                    if mo:
+                        matlab_path_dirs.append(
+                            abspath(mo.group(1), matlabroot))
+                else:
+                    # read dir as absolute dir
+                    mo = abs_dir_regex.search(line)
+                    if mo:
+                        matlab_path_dirs.append(abspath(mo.group(1)))
+            # start processing at BEGIN ENTRIES
+            if 'BEGIN ENTRIES' in line:
+                process_line = True
+            # read next line
+            line = fh.readline()
+
+    return matlab_path_dirs
+
+
+def is_matlabroot(matlabroot):
+    """Check if a Matlab installation exists at matlabroot
+    """
+    return isfile(join(str(matlabroot), 'bin', 'matlab.exe')) \
+        or isfile(join(str(matlabroot), 'bin', 'matlab'))
+
+
+def load_settings(settings_path):
+    """Load a Sublime settings file, which is json that may contain comments
+    and trailing commas
+
+    Returns:
+        dict: Settings
+    """
+    with open(settings_path, encoding='utf-8') as fh:
+        data = fh.read()
+
+    # remove comments and trailing commas outside of strings
+    string = r'("(?:\\.|[^"\\])*")'
+    data = re.sub(string + r'|//[^\n]*|/\*[\s\S]*?\*/',
+                  lambda mo: mo.group(1) or '', data)
+    data = re.sub(string + r'|,(\s*[}\]])',
+                  lambda mo: mo.group(1) or mo.group(2), data)
+    return json.loads(data)
+
+
+class MatlabIndexer:
+
+    """Indexer of the Matlab completions of a Matlab installation
+    """
+
+    def __init__(self, matlabroot, settings):
+        """Validate settings
+
+        Args:
+            matlabroot (str): Matlab installation dir
+            settings (dict): Matlab autocompletion sources, see
+                default_settings
+
+        Raises:
+            ValueError: Invalid settings or Matlab installation
+        """
+        self.matlabroot = matlabroot
+        for key, value in default_settings.items():
+            setattr(self, key, settings.get(key, value))
+        if self.matlab_pathdef_path == 'default':
+            self.matlab_pathdef_path = config.DEFAULT_MATLAB_PATHDEF_PATH
+
+        # validate settings
+        if not type(self.matlabroot) == str:
+            raise ValueError("Matlabroot is not of type 'str'")
+        if not type(self.matlab_pathdef_path) == str:
+            raise ValueError("Matlab_pathdef_path is not of type 'str'")
+        for key in ['include_dirs', 'exclude_dirs', 'exclude_patterns']:
+            if not type(getattr(self, key)) == list:
+                raise ValueError("{} is not of type 'list'".format(
+                    key.capitalize()))
+        for key in ['use_contents_files', 'use_signatures_files',
+                    'use_matlab_path']:
+            if not getattr(self, key) in ['dir', 'read', 'ignore']:
+                raise ValueError("Invalid value for '{}'".format(key))
+        for key in ['index_header_bytes', 'index_header_lines']:
+            if not (type(getattr(self, key)) == int
+                    and getattr(self, key) >= 0):
+                raise ValueError("Invalid value for '{}'".format(key))
+
+        # check matlabroot
+        if not is_matlabroot(self.matlabroot):
+            raise ValueError('Matlab installation could not be found at '
+                             'specified location')
+
+        # process paths
+        self.matlab_pathdef_path = abspath(self.matlab_pathdef_path,
+                                           self.matlabroot)
+        self.include_dirs = abspath(self.include_dirs, self.matlabroot)
+        self.exclude_dirs = abspath(self.exclude_dirs, self.matlabroot)
+        if self.use_matlab_path in ['dir', 'read'] \
+                and not isfile(self.matlab_pathdef_path):
+            raise ValueError('Specified pathdef.m is invalid')
+
+        self.matlab_completions = {}
+        self.matlab_see_also = {}
+        self.matlab_documents = {}
+        self.large_files = [] # mfiles that exceed the header window
+        self.stats = IndexStats() if self.index_statistics else None
+        self.report = None # index statistics report, see IndexStats
+
+    def run(self, packages_path):
+        """Index the Matlab completions and store them in packages_path
+
+        Returns:
+            int: Number of completions
+        """
+        self.index()
+
+        # get store path, for the matlab release
+        storage_path = abspath(mindex.release_path(
+            config.MATLAB_COMPLETIONS_PATH, self.matlabroot), packages_path)
+
+        try:
+            # make storage dir if non-existent
+            makedirs(split(storage_path)[0])
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise e
+
+        self.storage_path = storage_path
+        self.dump(storage_path)
+        if self.stats:
+            self.report = self.stats.dump(self, storage_path)
+        return len(self.matlab_completions)
+
+    def index(self):
+        """Parse the mfiles of the Matlab installation
+        """
+        exclude_dirs = self.exclude_dirs
+        exclude_patterns = self.exclude_patterns
+
+        # read the matlab path and parse its dirs
+        if self.use_matlab_path in ['dir', 'read']:
+            # get dirs in matlab path
+            matlab_path_dirs = process_pathdef(self.matlab_pathdef_path,
+                                               self.matlabroot)
+
+            # parse dirs in matlab path
+            for path_dir in matlab_path_dirs:
+                if isdir(path_dir):
+                    # apply exclude dirs and patterns
+                    if any([excl for excl in exclude_dirs
+                            if path_dir.startswith(excl)]) \
+                            or any([excl for excl in exclude_patterns
+                                    if excl in path_dir]):
+                        continue
+
+                    # process files in path dir
+                    for file in listdir(path_dir):
+                        self.index_file(join(path_dir, file))
+
+        # walk through files of matlab toolboxes
+        for root, dirs, files in walk(join(self.matlabroot, 'toolbox')):
+            # apply exclude dirs and patterns
+            if any([excl for excl in exclude_dirs if root.startswith(excl)]) \
+                    or any([excl for excl in exclude_patterns if excl in root]):
+                continue
+
+            # process entire dirs
+            if (self.use_signatures_files == 'dir'
+                and config.SIGNATURES_NAME in files) \
+                    or (self.use_contents_files == 'dir'
+                        and config.CONTENTS_NAME in files):
+                for file in files:
+                    self.index_file(join(root, file))
+                continue
+
+            # process signature files
+            if self.use_signatures_files == 'read' \
+                    and config.SIGNATURES_NAME in files:
+                for fun in process_signature(
+                        join(root, config.SIGNATURES_NAME)):
+                    self.index_file(join(root, fun + '.m'))
+
+            # process contents files
+            if self.use_contents_files == 'read'\
+                    and config.CONTENTS_NAME in files:
+                for fun in process_contents(
+                        join(root, config.CONTENTS_NAME)):
+                    self.index_file(join(root, fun + '.m'))
+
+        # parse custom include dirs
+        for include in self.include_dirs:
+            # check wildcard
+            if not include:
+                continue
+            wildcard = include[-1]
+            if wildcard in ['+', '*']:
+                include = include[:-1]
+            for root, dirs, files in walk(include):
+                # extract completion from file
+                for f in files:
+                    self.index_file(join(root, f))
+                # set which subdirs to include
+                if wildcard == '+':
+                    # only include package dirs and apply exclude dirs/patterns
+                    dirs[:] = \
+                        [d for d in dirs
+                         if d.startswith('+')
+                            and not(any([excl for excl in exclude_dirs
+                                         if abspath(d, root).startswith(excl)])
+                                    or any([excl for excl in exclude_patterns
+                                            if excl in d and not excl == "+"]))]
+                elif wildcard == '*':
+                    # apply exclude dirs/patterns
+                    dirs[:] = \
+                        [d for d in dirs
+                         if not(any([excl for excl in exclude_dirs
+                                     if abspath(d, root).startswith(excl)])
+                                or any([excl for excl in exclude_patterns
+                                        if excl in d]))]
+                else:
+                    # exclude all
+                    dirs[:] = []
+
+    def dump(self, storage_path):
+        """Store the completions and the derived index sections. The
+        completions are stored last, as readers reload the index when the
+        completions file changes. Data that is no longer needed is released
+        along the way, to limit the peak memory use.
+        """
+        # store "see also" references between completions
+        mindex.dump_section(storage_path, 'references',
+            mindex.resolve_references(self.matlab_see_also,
+                                      self.matlab_completions))
+        self.matlab_see_also = {}
+
+        # store locations of help pages
+        mindex.dump_section(storage_path, 'help',
+            mindex.build_help_index(self.matlabroot, mfun.help_subdirs))
+
+        # store inverted index for full-text documentation search
+        mindex.dump_section(storage_path, 'search',
+            mindex.build_search_index(self.matlab_documents,
+                                      self.matlab_completions))
+        self.matlab_documents = {}
+
+        # store results, in shards per toolbox (with their namespace index)
+        mindex.dump_completions(storage_path, self.matlab_completions)
+
+    def index_file(self, path):
+        """Parse mfile and add its completion, optionally recording the
+        parse statistics
+        """
+        if not self.stats:
+            self.compose_completion(self.parse(path))
+            return
+
+        start = time.perf_counter()
+        mfun_data = self.parse(path)
+        self.compose_completion(mfun_data)
+        duration = time.perf_counter() - start
+        if mfun_data.ext == '.m' and isfile(mfun_data.path) \
+                and not mfun_data.file == config.CONTENTS_NAME:
+            size = getsize(mfun_data.path)
+            if self.index_header_bytes:
+                size = min(size, self.index_header_bytes)
+            self.stats.add(self.relpath(mfun_data.path), mfun_data.valid,
+                           size, duration)
+
+    def parse(self, path):
+        """Parse mfile, reading its header window only
+        """
+        mfun_data = mfun(path, deep=True,
+                         header_bytes=self.index_header_bytes,
+                         header_lines=self.index_header_lines)
+        if mfun_data.too_large:
+            self.large_files.append(mfun_data.path)
+        return mfun_data
+
+    def large_files_message(self):
+        """Get message that lists the mfiles that exceed the header window
+        """
+        return '[WARNING] AutoMatlab - Only read the header of {} mfiles ' \
+            'that exceed the header window (index_header_bytes/lines):\n' \
+            .format(len(self.large_files)) + '\n'.join(self.large_files)
+
+    def relpath(self, path):
+        """Get path relative to matlabroot, for paths within matlabroot
+        """
+        if path.startswith(join(self.matlabroot, '')):
+            return path[len(join(self.matlabroot, '')):]
+        return path
+
+    def compose_completion(self, mfun_data):
+        """Compose completion and add to completions dictionary
+        """
+        if not mfun_data.valid:
+            return
+
+        # add data to matlab completions
+        self.matlab_completions[mfun_data.key] = \
+            [mfun_data.name, mfun_data.annotation,
+             self.relpath(mfun_data.path)]
+        self.matlab_see_also[mfun_data.key] = mfun_data.see_also
+        self.matlab_documents[mfun_data.key] = mindex.index_terms(
+            mfun_data.name, mfun_data.annotation, mfun_data.text)
+
+
+class IndexStats:
+
+    """Statistics on the composition and parse cost of an index, per
+    toolbox (see mindex.shard_name)
+    """
+
+    # number of slowest mfiles to report
+    n_slowest = 50
+
+    def __init__(self):
+        self.start = time.time()
+        self.toolboxes = {} # toolbox -> statistics
+        self.slowest = [] # heap of (parse time, path, bytes read)
+
+    def add(self, path, valid, size, duration):
+        """Record parsed mfile
+
+        Args:
+            path (str): Mfile path, relative to matlabroot
+            valid (bool): Whether the mfile yielded a completion
+            size (int): Number of bytes read (at most)
+            duration (float): Parse time in seconds
+        """
+        toolbox = self.toolboxes.setdefault(mindex.shard_name(path), {
+            'files': 0, 'valid': 0, 'rejected': 0, 'bytes': 0, 'time': 0})
+        toolbox['files'] += 1
+        toolbox['valid' if valid else 'rejected'] += 1
+        toolbox['bytes'] += size
+        toolbox['time'] += duration
+
+        item = (duration, path, size)
+        if len(self.slowest) < self.n_slowest:
+            heapq.heappush(self.slowest, item)
+        else:
+            heapq.heappushpop(self.slowest, item)
+
+    def report(self, indexer, storage_path):
+        """Compose report of the index statistics
+
+        Returns:
+            dict: Report
+        """
+        totals = {'completions': len(indexer.matlab_completions)}
+        for key in ['files', 'valid', 'rejected', 'bytes', 'time']:
+            totals[key] = sum([toolbox[key]
+                               for toolbox in self.toolboxes.values()])
+
+        # sizes of the stored index files
+        [root, name] = split(storage_path)
+        index_files = dict([(f, getsize(join(root, f)))
+                            for f in listdir(root) if f.startswith(name)
+                            and not f.endswith('.json')])
+        totals['index_bytes'] = sum(index_files.values())
+
+        return {
+            'matlabroot': indexer.matlabroot,
+            'release': mindex.release_name(indexer.matlabroot),
+            'date': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'duration': time.time() - self.start,
+            'settings': dict([(key, getattr(indexer, key))
+                              for key in default_settings]),
+            'totals': totals,
+            'toolboxes': self.toolboxes,
+            'slowest_files': [{'path': path, 'time': duration, 'bytes': size}
+                              for duration, path, size
+                              in sorted(self.slowest, reverse=True)],
+            'large_files': [indexer.relpath(path)
+                            for path in indexer.large_files],
+            'index_files': index_files}
+
+    def dump(self, indexer, storage_path):
+        """Store report as json next to the completions
+
+        Returns:
+            dict: Report
+        """
+        report = self.report(indexer, storage_path)
+        with open(report_path(storage_path), 'w') as fh:
+            json.dump(report, fh, indent=4, sort_keys=True)
+        return report
+
+
+def report_path(storage_path):
+    """Get path of the index statistics report
+    """
+    return storage_path + '.stats.json'
+
+
+def summarize_report(report, n_toolboxes=20, n_files=20):
+    """Summarize index statistics report as text
+    """
+    totals = report['totals']
+    lines = [
+        'Matlab index statistics for {} ({})'.format(
+            report['release'], report['matlabroot']),
+        'Generated on {} in {:.1f} s'.format(
+            report['date'], report['duration']),
+        '',
+        'Completions: {}, index size: {:.1f} MB'.format(
+            totals['completions'], totals['index_bytes'] / 1e6),
+        'Mfiles: {} parsed, {} valid, {} rejected'.format(
+            totals['files'], totals['valid'], totals['rejected']),
+        'Read: {:.1f} MB, parse time: {:.1f} s'.format(
+            totals['bytes'] / 1e6, totals['time']),
+        'Mfiles exceeding the header window: {}'.format(
+            len(report['large_files'])),
+        '',
+        'Toolboxes by parse time:',
+        '    {:<32} {:>7} {:>7} {:>8} {:>10} {:>8}'.format(
+            'toolbox', 'files', 'valid', 'rejected', 'read (kB)', 'time (s)')]
+    toolboxes = sorted(report['toolboxes'].items(),
+                       key=lambda item: item[1]['time'], reverse=True)
+    for name, toolbox in toolboxes[:n_toolboxes]:
+        lines.append('    {:<32} {:>7} {:>7} {:>8} {:>10.0f} {:>8.2f}'.format(
+            name, toolbox['files'], toolbox['valid'], toolbox['rejected'],
+            toolbox['bytes'] / 1e3, toolbox['time']))
+    if len(toolboxes) > n_toolboxes:
+        lines.append('    ... {} more'.format(len(toolboxes) - n_toolboxes))
+
+    lines += ['', 'Slowest mfiles:']
+    for item in report['slowest_files'][:n_files]:
+        lines.append('    {:>8.3f} s {:>8.0f} kB  {}'.format(
+            item['time'], item['bytes'] / 1e3, item['path']))
+    return '\n'.join(lines) + '\n'
+
+
+def main(argv=None):
+    """Index the Matlab completions from the command line
+    """
+    parser = argparse.ArgumentParser(
+        prog='python -m AutoMatlab.lib.mbuild',
+        description='Index the Matlab completions of a Matlab installation.')
+    parser.add_argument('matlabroot', help="Matlab installation dir, or "
+                        "'default' to search for it")
+    parser.add_argument('--settings', help='AutoMatlab settings file with '
+                        'the Matlab autocompletion sources')
+    parser.add_argument('--output', default='.', help='dir to store the '
+                        'completions in, laid out as the Sublime Packages '
+                        'dir (default: current dir)')
+    parser.add_argument('--stats', action='store_true', help='record index '
+                        'statistics, and store them as json next to the '
+                        'completions')
+    args = parser.parse_args(argv)
+
+    try:
+        settings = load_settings(args.settings) if args.settings else {}
+        if args.stats:
+            settings['index_statistics'] = True
+        if args.matlabroot == 'default':
+            matlabroot = config.default_matlabroot()
+        else:
+            matlabroot = abspath(args.matlabroot)
+        indexer = MatlabIndexer(matlabroot, settings)
+        n_completions = indexer.run(abspath(args.output))
+    except (OSError, ValueError) as e:
+        print('[ERROR] AutoMatlab - {}'.format(e), file=sys.stderr)
+        return 1
+
+    print('[INFO] AutoMatlab - Found {} Matlab function completions for '
+          '{}'.format(n_completions, mindex.release_name(indexer.matlabroot)))
+    if indexer.large_files:
+        print(indexer.large_files_message())
+    if indexer.report:
+        print(summarize_report(indexer.report))
+        print('Full report: ' + report_path(indexer.storage_path))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,15 +1,51 @@
+import io
 import re
-from os.path import split, splitext, isfile, abspath, sep, join
+import collections
+import threading
+from os.path import split, splitext, isfile, abspath, sep, join, getmtime
 
 import AutoMatlab.lib.config as config
 
+# cache of parsed (and rendered) mfiles, see mfun.cached()
+_cache = collections.OrderedDict()
+_cache_lock = threading.Lock()
+
 
 class mfun:
     """Class to extract function documentation from mfile.
     """
 
-    def __init__(self, path, annotation='', deep=False, local=''):
+    # translation table to replace invalid html characters in a single pass
+    html_table = str.maketrans({
+        '&': '&amp;', '<': '&lt;', '>': '&gt;', ' ': '&nbsp;'})
+
+    # subdirs of a toolbox help dir that might contain help pages
+    help_subdirs = ['', 'ref', 'ug', 'slref']
+
+    # regex patterns to extract "see also" references from documentation
+    see_regex = re.compile(r'^\s*see also:?\s*(.*)', re.I)
+    ref_regex = re.compile(r'^[A-Za-z][\w\.]*$')
+
+    def __init__(self, path, annotation='', deep=False, local='',
+                 header_bytes=0, header_lines=0):
+        """Parse mfile documentation
+
+        Args:
+            path (str): Mfile path
+            annotation (str, optional): Known annotation, read the mfile
+                in free documentation format (or as local function, if the
+                annotation contains 'local')
+            deep (bool, optional): Read the full documentation
+            local (str, optional): Name of local function
+            header_bytes (int, optional): Only read this many bytes from the
+                start of the mfile (0 for no limit)
+            header_lines (int, optional): Only read this many lines from the
+                start of the mfile (0 for no limit)
+        """
         # initialize data
+        self._html = None # rendered html, see html property
+        self._text = None # rendered text, see text property
+        self._help_rel_url = False # relative help url, see find_help()
         self.defs = [] # functions defintions
         self.snips = [] # snippets to insert, derived from defs
         self.annotation = annotation # one-line description
@@ -21,6 +57,10 @@ class mfun:
             self.fun = local
         self.matlabroot = abspath(self.path.split('toolbox')[0])
         self.valid = False
+        self.header_bytes = header_bytes # size of header window in bytes
+        self.header_lines = header_lines # size of header window in lines
+        self.header = None # header window, see __open()
+        self.too_large = False # mfile exceeds header window
 
         # check mfile validity
         if not isfile(self.path) or not self.ext == '.m' \
@@ -48,7 +88,7 @@ class mfun:
         """Check validity of mfile: does it contain a Matlab function?
         """
         # read mfile line by line
-        with open(self.path, encoding='cp1252') as fh:
+        with self.__open() as fh:
             # find first non-empty line
             line = ''
             while len(line.strip()) == 0:
@@ -92,7 +132,7 @@ class mfun:
         employed by The Mathworks for their built-in functions.
         """
         # read mfile line by line
-        with open(self.path, encoding='cp1252') as fh:
+        with self.__open() as fh:
             # find first non-empty line
             line = ''
             while len(line.strip()) == 0:
@@ -144,7 +184,7 @@ class mfun:
     def __read_local_documentation(self):
         """Read documentation for local function
         """
-        with open(self.path, encoding='cp1252') as fh:
+        with self.__open() as fh:
             # find first non-empty line
             line = ''
             while len(line.strip()) == 0:
@@ -203,7 +243,7 @@ class mfun:
         by The Mathworks for their built-in functions.
         """
         # read mfile line by line
-        with open(self.path, encoding='cp1252') as fh:
+        with self.__open() as fh:
             # find first non-empty line
             line = ''
             while len(line.strip()) == 0:
@@ -289,7 +329,7 @@ class mfun:
         documentation format.
         """
         # read mfile line by line
-        with open(self.path, encoding='cp1252') as fh:
+        with self.__open() as fh:
             # find first non-empty line
             line = ''
             while len(line.strip()) == 0:
@@ -363,63 +403,181 @@ class mfun:
                 except:
                     break
 
+    def __open(self):
+        """Open mfile for reading. With a header window, only the header is
+        read, in a single buffered read, and it is parsed from memory.
+        """
+        if not (self.header_bytes or self.header_lines):
+            return open(self.path, encoding='cp1252')
+        if self.header is None:
+            self.header = self.__read_header()
+        return io.StringIO(self.header)
+
+    def __read_header(self):
+        """Read header window of mfile, and flag the mfile if it is larger
+        """
+        with open(self.path, 'rb') as fh:
+            if self.header_bytes:
+                data = fh.read(self.header_bytes + 1)
+            else:
+                data = fh.read()
+        if self.header_bytes and len(data) > self.header_bytes:
+            # drop incomplete last line
+            self.too_large = True
+            data = data[:data.rfind(b'\n', 0, self.header_bytes) + 1]
+
+        # decode up to undecodable bytes, where reading line by line stops
+        try:
+            text = data.decode('cp1252')
+        except UnicodeDecodeError as e:
+            text = data[:e.start].decode('cp1252')
+        text = text.replace('\r\n', '\n').replace('\r', '\n')
+
+        if self.header_lines:
+            lines = text.split('\n', self.header_lines)
+            if len(lines) > self.header_lines:
+                if lines[-1]:
+                    self.too_large = True
+                text = '\n'.join(lines[:-1]) + '\n'
+        return text
+
     @property
     def html(self):
         """Format docstring in html"""
+        if self._html is None:
+            self._html = self.__render_html()
+        return self._html
 
+    def __render_html(self):
+        """Render docstring in html, in a single pass over the documentation
+        """
         if not self.valid:
             return ''
 
         # header
-        html = '<p><b>{} - {}</b></p><p>'.format(self.fun, 
+        header = '<p><b>{} - {}</b></p>'.format(self.fun,
                         mfun.make_html_compliant(self.annotation))
         if not self.doc:
-            return html
+            return header + '<p>'
 
         # get minimum whitespace in doc
-        crop = min([len(line) - len(line.lstrip()) 
+        crop = min([len(line) - len(line.lstrip())
                    for line in self.doc if line.strip()])
 
-        # body
+        # body: collect lines per documentation paragraph
+        paragraphs = [[]]
         for line in self.doc:
             if not line.strip():
                 # start new documentation paragraph
-                html += '</p><p>'
+                paragraphs.append([])
             else:
-                # newline
-                if not (html[-3:] == '<p>'
-                        or html[-4:] == '<br>'):
-                    html += '<br>'
                 # append to documentation paragraph
-                html += mfun.make_html_compliant(line[crop:])
+                paragraphs[-1].append(mfun.make_html_compliant(line[crop:]))
 
-        # close final paragraph
-        html += '</p>'
-        while html[-7:] == '<p></p>':
-            html = html[:-7]
+        # drop trailing empty paragraphs
+        while paragraphs and not paragraphs[-1]:
+            paragraphs.pop()
 
-        return html
+        return header + ''.join(['<p>' + '<br>'.join(lines) + '</p>'
+                                 for lines in paragraphs])
 
     @property
     def text(self):
-        """Format docstring in html"""
+        """Format docstring in text"""
+        if self._text is None:
+            self._text = self.__render_text()
+        return self._text
 
+    def __render_text(self):
+        """Render docstring in text
+        """
         if not self.valid or not self.doc:
             return ''
 
         # get minimum whitespace in doc
-        crop = min([len(line) - len(line.lstrip()) 
+        crop = min([len(line) - len(line.lstrip())
                    for line in self.doc if line.strip()])
 
         # body
-        text = ''
+        return ''.join([line[crop:] + '\n' if line.strip() else '\n'
+                        for line in self.doc])
+
+    @property
+    def name(self):
+        """Get name under which function is completed: package functions
+        are qualified by their package name(s)
+        """
+        return mfun.qualify(self.path, self.fun)[0]
+
+    @property
+    def key(self):
+        """Get lower case completion key"""
+        return self.name.lower()
+
+    @staticmethod
+    def split_namespace(path):
+        """Get package names and class name from the dirs of an mfile path
+        (+package and @class dirs).
+        """
+        packages = []
+        cls = ''
+        for d in reversed(re.split(r'[\\/]', path)[:-1]):
+            if d.startswith('+') and len(d) > 1:
+                packages.insert(0, d[1:])
+            elif d.startswith('@') and len(d) > 1 and not (packages or cls):
+                cls = d[1:]
+            else:
+                break
+        return packages, cls
+
+    @staticmethod
+    def qualify(path, fun):
+        """Qualify function name by the package and class dirs of its mfile.
+
+        Returns:
+            str: Name under which the function is completed. Package functions
+                and classes require their package name(s). Class methods are
+                qualified by their class, such that equally named methods of
+                different classes do not collide (they are completed as
+                members of the class, see mindex.build_namespace).
+            list: Namespace parts of the fully qualified function name,
+                e.g. [package, class, method]
+        """
+        packages, cls = mfun.split_namespace(path)
+        parts = list(packages)
+        if cls:
+            parts.append(cls)
+        if not cls or not cls.lower() == fun.lower():
+            parts.append(fun)
+        return '.'.join(parts), parts
+
+    @property
+    def see_also(self):
+        """Get functions referred to in the "see also" documentation section
+        """
+        refs = []
+        if not self.valid or not self.doc:
+            return refs
+
+        # locate 'see also', which may continue over multiple lines
+        see = None
         for line in self.doc:
-            if line.strip():
-                # append to documentation paragraph
-                text += line[crop:]
-            text += '\n'
+            if see is None:
+                mo = mfun.see_regex.search(line)
+                if mo:
+                    see = [mo.group(1)]
+            elif line.strip():
+                see.append(line)
+            else:
+                break
 
-        return text
+        # extract referred functions
+        if see:
+            for ref in ' '.join(see).replace(',', ' ').split():
+                ref = ref.rstrip('.')
+                if mfun.ref_regex.search(ref) and not ref in refs:
+                    refs.append(ref)
+        return refs
 
     @property
     def panel(self):
@@ -429,7 +587,7 @@ class mfun:
     def help_browser(self):
         """Get path to Matlab help file."""
 
-        rel_url = self.__get_help_rel_url()
+        rel_url = self.find_help()
         if rel_url:
             return join(self.matlabroot, rel_url)
         else:
@@ -439,23 +597,46 @@ class mfun:
     def help_web(self):
         """Get url to Matlab help webpage."""
 
-        rel_url = self.__get_help_rel_url()
+        rel_url = self.find_help()
         if rel_url:
             return 'https://www.mathworks.com/' + rel_url.replace('\\','/')
         else:
             return None
 
+    def find_help(self, help_index=None):
+        """Get relative url to Matlab help page.
 
-    def __get_help_rel_url(self):
-        """Get relative url to Matlab help page."""
+        The help page is looked up in the help index, if provided (see
+        mindex.build_help_index). Otherwise, the Matlab help dirs are probed.
+        The result is stored, such that it is only determined once.
+        """
+        if self._help_rel_url is False:
+            self._help_rel_url = None
+            for help_dir in self.__get_help_dirs():
+                if help_index is not None:
+                    # look up in help index
+                    help_file = help_index.get(help_dir, {}).get(
+                        self.fun.lower())
+                else:
+                    # probe help dir
+                    help_file = self.fun + '.html'
+                    if not isfile(join(self.matlabroot, 'help', help_dir,
+                                       help_file)):
+                        help_file = None
+                if help_file:
+                    self._help_rel_url = join('help', help_dir, help_file)
+                    break
+        return self._help_rel_url
 
+    def __get_help_dirs(self):
+        """Get help dirs (relative to <matlabroot>/help) that might contain
+        the Matlab help page, in order of precedence.
+        """
         if not 'toolbox' in self.path:
-            return None
+            return []
 
         # search in default matlab help
-        help = join('help', 'matlab', 'ref', self.fun + '.html')
-        if isfile(join(self.matlabroot, help)):
-            return help
+        help_dirs = [join('matlab', 'ref')]
 
         # search in toolbox help
         parts = self.path.split(sep)
@@ -466,32 +647,47 @@ class mfun:
                 toolbox = parts[idx + 2]
                 if toolbox.endswith('lib'):
                     toolbox = toolbox[:-3]
-            help = join('help', toolbox, self.fun + '.html')
-            if isfile(join(self.matlabroot, help)):
-                return help
-            help = join('help', toolbox, 'ref', self.fun + '.html')
-            if isfile(join(self.matlabroot, help)):
-                return help
-            help = join('help', toolbox, 'ug', self.fun + '.html')
-            if isfile(join(self.matlabroot, help)):
-                return help
-            help = join('help', toolbox, 'slref', self.fun + '.html')
-            if isfile(join(self.matlabroot, help)):
-                return help
-
-        # give up
-        return None
+            help_dirs += [join(toolbox, sub) if sub else toolbox
+                          for sub in mfun.help_subdirs]
+
+        return help_dirs
+
+    @classmethod
+    def cached(cls, path, annotation='', deep=False, local=''):
+        """Get mfun for mfile, reusing earlier parsed (and rendered) results.
+
+        Cached results are keyed by path, modification time and documentation
+        mode, such that a modified mfile is parsed again. The cache is bounded
+        by config.MAX_CACHED_DOCUMENTATION.
+        """
+        path = abspath(path)
+        try:
+            mtime = getmtime(path)
+        except OSError:
+            # let mfun deal with the invalid path
+            return cls(path, annotation, deep, local)
+        key = (path, mtime, annotation, deep, local)
+
+        # look up in cache
+        with _cache_lock:
+            mfun_data = _cache.get(key)
+            if mfun_data is not None:
+                _cache.move_to_end(key)
+                return mfun_data
+
+        # parse mfile and store in cache
+        mfun_data = cls(path, annotation, deep, local)
+        with _cache_lock:
+            _cache[key] = mfun_data
+            while len(_cache) > config.MAX_CACHED_DOCUMENTATION:
+                _cache.popitem(False)
+        return mfun_data
 
     @staticmethod
     def make_html_compliant(text):
         """Replace invalid html characters
         """
-        # replace invalid html characters
-        text = text.replace('&', '&amp;')
-        text = text.replace('<', '&lt;')
-        text = text.replace('>', '&gt;')
-        text = text.replace(' ', '&nbsp;')
-        return text
+        return text.translate(mfun.html_table)
 
     @staticmethod
     def definition_to_snippet(fun, params):
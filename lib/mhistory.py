@@ -0,0 +1,319 @@
+"""Functions for reading the Matlab command history.
+
+Matlab stores its command history in History.xml, as a sequence of sessions
+that each contain the commands of one Matlab session. New commands are
+appended to the last session, so the history is read incrementally: only the
+sessions from the last read session onwards are parsed when the file grows.
+When the file was rewritten, it is parsed completely.
+
+Matlab only keeps a limited number of commands in its history. To keep track
+of all commands that were ever run, the commands are collected in a
+persistent HistoryIndex, which ranks the commands by frecency (frequency and
+recency) and supports prefix and substring lookup.
+"""
+
+import bisect
+import heapq
+import math
+import pickle
+import threading
+import xml.etree.ElementTree as ET
+from os import makedirs
+from os.path import getsize, getmtime, isfile, isdir, split
+
+from AutoMatlab.lib.mindex import dump_pickle
+
+
+class HistoryReader:
+
+    """Incremental reader of a Matlab History.xml file
+    """
+
+    # number of bytes before the last session, to detect rewrites
+    fingerprint_size = 64
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.size = None # file size at last read
+        self.mtime = None # file mtime at last read
+        self.offset = 0 # byte offset of the last session
+        self.fingerprint = b'' # bytes before the last session
+        self.head = [] # commands before the last session
+        self.tail = [] # commands in the last session
+        self.commands = [] # all commands, in chronological order
+
+    def read(self):
+        """Read commands from history file, in chronological order
+
+        Returns:
+            list: Commands, or None if the history file could not be read
+        """
+        with self.lock:
+            try:
+                size = getsize(self.path)
+                mtime = getmtime(self.path)
+            except OSError:
+                return None
+
+            # check if file changed since last read
+            if size == self.size and mtime == self.mtime:
+                return self.commands
+
+            # try reading new sessions only
+            # (might yield error when simultaneously being writting by matlab?)
+            try:
+                if not self.__read_appended(size):
+                    self.__read_all()
+            except:
+                if self.size is None:
+                    return None
+                return self.commands
+
+            self.size = size
+            self.mtime = mtime
+            self.commands = self.head + self.tail
+            return self.commands
+
+    def __read_appended(self, size):
+        """Parse sessions from the last session on, if the file was only
+        appended to since the last read
+        """
+        if self.size is None or size < self.size or not self.offset:
+            return False
+
+        with open(self.path, 'rb') as fh:
+            # compare fingerprint
+            fh.seek(self.offset - len(self.fingerprint))
+            if fh.read(len(self.fingerprint)) != self.fingerprint:
+                return False
+            data = fh.read()
+
+        sessions = self.__parse_sessions(data)
+        if not sessions:
+            return False
+        self.__store(sessions, self.fingerprint + data)
+        return True
+
+    def __read_all(self):
+        """Parse all sessions
+        """
+        with open(self.path, 'rb') as fh:
+            data = fh.read()
+
+        first = data.find(b'<session')
+        if first < 0:
+            # validate empty history
+            ET.fromstring(data)
+            sessions = [[]]
+        else:
+            sessions = self.__parse_sessions(data[first:])
+
+        self.head = []
+        self.fingerprint = b''
+        self.offset = 0
+        self.__store(sessions, data)
+
+    def __store(self, sessions, data):
+        """Store parsed sessions, where data contains the file content from
+        the fingerprint of the last session on
+        """
+        for session in sessions[:-1]:
+            self.head.extend(session)
+        self.tail = sessions[-1]
+
+        # move to new last session
+        base = self.offset - len(self.fingerprint)
+        last = data.rfind(b'<session')
+        if last > 0:
+            start = max(0, last - self.fingerprint_size)
+            self.fingerprint = data[start:last]
+            self.offset = base + last
+
+    @staticmethod
+    def __parse_sessions(data):
+        """Parse commands per session from a sequence of session elements
+        """
+        end = data.rfind(b'</history>')
+        if end >= 0:
+            data = data[:end]
+        root = ET.fromstring(b'<history>' + data + b'</history>')
+
+        # select commands (not timestamps)
+        return [[command.text for command in session
+                 if command.get('execution_time')]
+                for session in root.findall('session')]
+
+
+class HistoryIndex:
+
+    """Index of all commands ever read from the Matlab history, ranked by
+    frecency.
+
+    Every run of a command adds 2^(t/half_life) to its frecency, where t is
+    the number of commands run before it. The rank of a command is the log2
+    of its frecency, such that ranks do not overflow and ranks of commands
+    that were not run lately do not have to be updated.
+    """
+
+    # number of commands after which a run counts half
+    half_life = 500
+    # number of last commands per history file, to recognize new commands
+    tail_size = 10
+
+    def __init__(self):
+        self.entries = {} # command -> [rank, count]
+        self.time = 0 # number of commands added
+        self.tails = {} # history path -> last added commands
+        self._ranked = None # commands by descending rank
+        self._sorted = None # sorted (lower case command, command)
+        self._trigrams = None # lower case trigram -> set of commands
+
+    def __getstate__(self):
+        """Only pickle the entries, the lookup tables are rebuilt on demand
+        """
+        return {'entries': self.entries, 'time': self.time,
+                'tails': self.tails}
+
+    def __setstate__(self, state):
+        self.__init__()
+        self.__dict__.update(state)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def add(self, command):
+        """Add a run of command
+        """
+        rank = self.time / self.half_life
+        self.time += 1
+        self._ranked = None
+        if command in self.entries:
+            # log2(2^a + 2^b)
+            entry = self.entries[command]
+            high = max(entry[0], rank)
+            entry[0] = high + math.log(
+                1 + 2 ** -abs(entry[0] - rank), 2)
+            entry[1] += 1
+            return
+
+        self.entries[command] = [rank, 1]
+        if self._sorted is not None:
+            bisect.insort(self._sorted, (command.lower(), command))
+        if self._trigrams is not None:
+            for trigram in self.__trigrams(command.lower()):
+                self._trigrams.setdefault(trigram, set()).add(command)
+
+    def update(self, path, commands):
+        """Add the commands from a history file that were not added before
+
+        Args:
+            path (str): Path of the history file
+            commands (list): All commands in the history file
+
+        Returns:
+            bool: Whether new commands were added
+        """
+        # find the last added commands in the (possibly rewritten) history
+        tail = self.tails.get(path, [])
+        start = 0
+        if tail:
+            start = None
+            for ii in range(len(commands) - len(tail), -1, -1):
+                if commands[ii:ii + len(tail)] == tail:
+                    start = ii + len(tail)
+                    break
+            if start is None:
+                # history was replaced
+                start = 0
+
+        if start == len(commands):
+            return False
+        for command in commands[start:]:
+            self.add(command)
+        self.tails[path] = commands[-self.tail_size:]
+        return True
+
+    def ranked(self, limit=None):
+        """Get commands by descending rank
+        """
+        if self._ranked is None:
+            self._ranked = sorted(self.entries,
+                                  key=lambda c: self.entries[c][0],
+                                  reverse=True)
+        return self._ranked[:limit]
+
+    def search(self, query, limit=100):
+        """Find commands starting with or containing query (case
+        insensitive). Commands starting with the query come first; both
+        groups are ordered by descending rank.
+        """
+        query = query.lower()
+        if not query:
+            return self.ranked(limit)
+
+        # commands starting with query
+        if self._sorted is None:
+            self._sorted = sorted((c.lower(), c) for c in self.entries)
+        lo = bisect.bisect_left(self._sorted, (query,))
+        hi = bisect.bisect_left(self._sorted, (query + '\uffff',))
+        prefixed = heapq.nlargest(
+            limit, (c for l, c in self._sorted[lo:hi]),
+            key=lambda c: self.entries[c][0])
+        if len(prefixed) == limit:
+            return prefixed
+
+        # commands containing query
+        if len(query) < 3:
+            # trigrams do not apply, walk ranked commands instead
+            matches = []
+            for command in self.ranked():
+                if query in command.lower() \
+                        and not command.lower().startswith(query):
+                    matches.append(command)
+                    if len(prefixed) + len(matches) == limit:
+                        break
+            return prefixed + matches
+
+        if self._trigrams is None:
+            self._trigrams = {}
+            for command in self.entries:
+                for trigram in self.__trigrams(command.lower()):
+                    self._trigrams.setdefault(trigram, set()).add(command)
+        postings = sorted((self._trigrams.get(trigram, set())
+                           for trigram in self.__trigrams(query)), key=len)
+        candidates = set.intersection(*postings)
+        matches = heapq.nlargest(
+            limit - len(prefixed),
+            (c for c in candidates if query in c.lower()
+             and not c.lower().startswith(query)),
+            key=lambda c: self.entries[c][0])
+        return prefixed + matches
+
+    def dump(self, path):
+        """Store index atomically, such that a concurrent load never reads
+        a partially written index
+        """
+        if not isdir(split(path)[0]):
+            makedirs(split(path)[0])
+        dump_pickle(path, self)
+
+    @staticmethod
+    def load(path):
+        """Load stored index, or create new index
+        """
+        if isfile(path):
+            try:
+                with open(path, 'rb') as fh:
+                    index = pickle.load(fh)
+                if isinstance(index, HistoryIndex):
+                    return index
+            except:
+                pass
+        return HistoryIndex()
+
+    @staticmethod
+    def __trigrams(text):
+        """Get set of trigrams in text
+        """
+        return set(text[ii:ii + 3] for ii in range(len(text) - 2))
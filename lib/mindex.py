@@ -0,0 +1,661 @@
+"""Functions for storing and loading AutoMatlab index data.
+
+The Matlab completions are stored as a pickled dictionary, mapping lower case
+function names onto [function name, annotation, relative path]. Additional
+index data that is derived while indexing, such as the "see also" references
+between functions, is stored in separate section files next to the
+completions. This way, the completions file keeps its format and every
+section can be loaded independently.
+
+Completions generated from a Matlab installation are stored per Matlab
+release (see release_path), such that multiple releases can be used side by
+side. Within a release, the completions are split into shards per toolbox
+(see dump_completions). The completions file then only contains a small
+directory of the shards, and shards are loaded when they are first queried
+(see ShardedCompletions).
+
+All index files are written atomically (see dump_pickle): they are written
+to a temporary file that is renamed into place, such that a concurrent
+reader always loads a complete file. The shards are streamed to their files
+in sorted order, without copying the completions (see StreamedDict).
+
+Sections:
+    references: "see also" references between functions
+    help: locations of the html help pages
+    search: inverted index for full-text search over the documentation
+    namespace: hierarchical index of package and class members
+"""
+
+import re
+import bisect
+import hashlib
+import heapq
+import math
+import pickle
+import collections
+import time
+import tempfile
+import threading
+from os import listdir, remove, replace, stat, walk
+from os.path import isfile, isdir, join, split, splitext, basename, normpath
+
+from AutoMatlab.lib.abspath import abspath
+from AutoMatlab.lib.mfun import mfun
+
+# pickle protocol of the stored index data, readable by the Python 3.3 of
+# the Sublime plugin host (also when the index is generated by a newer
+# Python, see mbuild)
+pickle_protocol = 3
+
+
+def file_signature(path, header_bytes=0, prev_signature=None):
+    """Get signature of an mfile to detect changes: (size, mtime, hash of the
+    header window of header_bytes, or of the entire file if 0). The hash is
+    reused from the previous signature if size and mtime did not change.
+
+    Returns:
+        tuple: (size, mtime, hash)
+    """
+    st = stat(path)
+    if prev_signature and prev_signature[:2] == (st.st_size, st.st_mtime):
+        return prev_signature
+
+    with open(path, 'rb') as fh:
+        data = fh.read(header_bytes) if header_bytes else fh.read()
+    return (st.st_size, st.st_mtime, hashlib.md5(data).digest())
+
+
+def walk_include_dirs(include_dirs, exclude_dirs=[], exclude_patterns=[]):
+    """Find mfiles in include dirs. An include dir ending with the wildcard
+    '*' includes all its subdirs, and with '+' all its package dirs. The
+    exclude dirs/patterns apply to these subdirs.
+
+    Yields:
+        str: mfile path
+    """
+    for include in include_dirs:
+        # check wildcard
+        if not include:
+            continue
+        wildcard = include[-1]
+        if wildcard in ['+', '*']:
+            include = include[:-1]
+        for root, dirs, files in walk(include):
+            for f in files:
+                # check if matlab file
+                if splitext(f)[1] == '.m':
+                    yield join(root, f)
+            # set which subdirs to include
+            if wildcard == '+':
+                # only include package dirs and apply exclude dirs/patterns
+                dirs[:] = \
+                    [d for d in dirs
+                     if d.startswith('+')
+                        and not(any([excl for excl in exclude_dirs
+                                     if abspath(d, root).startswith(excl)])
+                                or any([excl for excl in exclude_patterns
+                                        if excl in d and not excl == "+"]))]
+            elif wildcard == '*':
+                # apply exclude dirs/patterns
+                dirs[:] = \
+                    [d for d in dirs
+                     if not(any([excl for excl in exclude_dirs
+                                 if abspath(d, root).startswith(excl)])
+                            or any([excl for excl in exclude_patterns
+                                    if excl in d]))]
+            else:
+                # exclude all
+                dirs[:] = []
+
+
+def release_name(matlabroot):
+    """Get name of the Matlab release installed at matlabroot, e.g. R2021a
+    """
+    name = basename(normpath(matlabroot))
+    mo = re.search(r'R\d{4}[ab]', name, re.I)
+    if mo:
+        return mo.group()
+    return re.sub(r'\W+', '_', name) or 'default'
+
+
+def release_path(completions_path, matlabroot):
+    """Get path of the completions for the Matlab release installed at
+    matlabroot, stored in a release subdir next to the default completions
+    """
+    [root, name] = split(completions_path)
+    return join(root, release_name(matlabroot), name)
+
+
+def shard_name(path):
+    """Get name of the shard for an mfile path (relative to matlabroot):
+    the name of its toolbox, or 'other' for mfiles outside the toolboxes
+    """
+    parts = re.split(r'[\\/]', path)
+    if len(parts) > 2 and parts[0] == 'toolbox':
+        if parts[1] == 'shared' and len(parts) > 3:
+            return 'shared.' + parts[2]
+        return parts[1]
+    return 'other'
+
+
+def dump_completions(completions_path, completions, prefix_length=2):
+    """Store completions, split into shards per toolbox (see shard_name).
+
+    The completions file contains a directory of the shards: '_shards' maps
+    every shard onto its number of completions and 'prefixes' maps every
+    prefix (of prefix_length) of the completion keys onto the shards that
+    hold keys with that prefix. Every shard is stored as a section. The
+    namespace index is always stored with the shards, as building it from
+    sharded completions would load all shards.
+    """
+    # store namespace index of package and class members
+    dump_section(completions_path, 'namespace', build_namespace(completions))
+
+    # distribute (sorted) completion keys over shards
+    shards = {}
+    prefixes = {}
+    for key in sorted(completions.keys()):
+        shard = shard_name(completions[key][2])
+        shards.setdefault(shard, []).append(key)
+        prefixes.setdefault(key[:prefix_length], set()).add(shard)
+
+    # store shards, streaming their entries
+    for shard, keys in shards.items():
+        dump_section(completions_path, 'shard.' + shard, StreamedDict(
+            (key, completions[key]) for key in keys))
+
+    # store directory, after the shards it refers to
+    directory = {
+        '_shards': dict([(shard, len(keys))
+                         for shard, keys in shards.items()]),
+        'prefixes': dict([(prefix, sorted(prefix_shards))
+                          for prefix, prefix_shards in prefixes.items()]),
+        'prefix_length': prefix_length}
+    dump_pickle(completions_path, directory)
+
+    # remove shards from previous indexing
+    [root, name] = split(completions_path)
+    if isdir(root):
+        for f in listdir(root):
+            if f.startswith(name + '.shard.') \
+                    and not f[len(name) + 7:] in shards:
+                remove(join(root, f))
+
+
+def load_completions(completions_path):
+    """Load completions, either stored as a single dict or in shards
+
+    Returns:
+        dict/ShardedCompletions: Completions
+    """
+    with open(completions_path, 'br') as fh:
+        completions = pickle.load(fh)
+    if '_shards' in completions:
+        return ShardedCompletions(completions_path, completions)
+    return completions
+
+
+def match_prefix(completions, prefix):
+    """Get the completions whose keys start with prefix. An empty prefix
+    matches nothing, as listing all completions would load all shards.
+
+    Returns:
+        list: (key, entry) pairs
+    """
+    if not prefix:
+        return []
+    if isinstance(completions, ShardedCompletions):
+        return completions.match_prefix(prefix)
+    return [(key, entry) for key, entry in completions.items()
+            if key.startswith(prefix)]
+
+
+class ShardedCompletions:
+
+    """Completions stored in shards, which are loaded on first access.
+
+    Supports the dict operations used on completions (in, get, [], len,
+    items). Shards that have not been accessed for some time can be evicted
+    from memory again.
+    """
+
+    def __init__(self, completions_path, directory):
+        self.completions_path = completions_path
+        self.counts = directory['_shards']
+        self.prefixes = directory['prefixes']
+        self.prefix_length = directory['prefix_length']
+        self.shards = {} # loaded shards
+        self.shard_keys = {} # sorted keys per loaded shard
+        self.last_access = {} # last access time per loaded shard
+        self.lock = threading.Lock()
+
+    def get_shards(self, prefix):
+        """Get names of the shards holding keys that start with prefix
+        """
+        if len(prefix) >= self.prefix_length:
+            return self.prefixes.get(prefix[:self.prefix_length], [])
+        shards = set()
+        for key_prefix, key_shards in self.prefixes.items():
+            if key_prefix.startswith(prefix):
+                shards.update(key_shards)
+        return sorted(shards)
+
+    def load_shards(self, shards):
+        """Load shards that are not loaded yet
+
+        Returns:
+            list: The loaded shards
+        """
+        loaded = []
+        with self.lock:
+            for shard in shards:
+                if not shard in self.shards:
+                    self.shards[shard] = load_section(
+                        self.completions_path, 'shard.' + shard) or {}
+                    self.shard_keys[shard] = sorted(self.shards[shard].keys())
+                self.last_access[shard] = time.time()
+                loaded.append(self.shards[shard])
+        return loaded
+
+    def loaded_items(self):
+        """Get (key, entry) pairs of the loaded shards only
+        """
+        with self.lock:
+            return [(key, entry) for completions in self.shards.values()
+                    for key, entry in completions.items()]
+
+    def prune(self, keys):
+        """Remove keys from the loaded shards. The shards are replaced
+        instead of modified, as they might be read concurrently. Shards that
+        are loaded again still contain the keys.
+        """
+        keys = set(keys)
+        with self.lock:
+            for shard, completions in list(self.shards.items()):
+                removed = keys.intersection(completions)
+                if not removed:
+                    continue
+                self.shards[shard] = collections.OrderedDict(
+                    [(key, entry) for key, entry in completions.items()
+                     if not key in removed])
+                self.shard_keys[shard] = [key for key in self.shard_keys[shard]
+                                          if not key in removed]
+                self.counts[shard] -= len(removed)
+
+    def update(self, entries):
+        """Replace the entries of keys in the loaded shards. As in prune(),
+        the shards are replaced instead of modified.
+        """
+        with self.lock:
+            for shard, completions in list(self.shards.items()):
+                replaced = set(entries).intersection(completions)
+                if not replaced:
+                    continue
+                self.shards[shard] = collections.OrderedDict(
+                    [(key, entries[key] if key in replaced else entry)
+                     for key, entry in completions.items()])
+
+    def evict(self, max_idle):
+        """Remove shards from memory that have not been accessed for
+        max_idle seconds
+        """
+        with self.lock:
+            now = time.time()
+            for shard in list(self.shards.keys()):
+                if now - self.last_access[shard] > max_idle:
+                    del self.shards[shard]
+                    del self.shard_keys[shard]
+                    del self.last_access[shard]
+
+    def match_prefix(self, prefix):
+        """Get (key, entry) pairs for all keys that start with prefix. An
+        empty prefix matches nothing, use items() to load all shards.
+        """
+        if not prefix:
+            return []
+        return self.__match_prefix(prefix)
+
+    def __match_prefix(self, prefix):
+        """Helper for match_prefix() and items()
+        """
+        shards = self.get_shards(prefix)
+        matches = []
+        for shard, completions in zip(shards, self.load_shards(shards)):
+            keys = self.shard_keys.get(shard, [])
+            i = bisect.bisect_left(keys, prefix)
+            while i < len(keys) and keys[i].startswith(prefix):
+                matches.append((keys[i], completions[keys[i]]))
+                i += 1
+        return sorted(matches)
+
+    def get(self, key, default=None):
+        for completions in self.load_shards(self.get_shards(key)):
+            if key in completions:
+                return completions[key]
+        return default
+
+    def __getitem__(self, key):
+        entry = self.get(key)
+        if entry is None:
+            raise KeyError(key)
+        return entry
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def __len__(self):
+        return sum(self.counts.values())
+
+    def __bool__(self):
+        return len(self) > 0
+
+    def keys(self):
+        return [key for key, entry in self.items()]
+
+    def values(self):
+        return [entry for key, entry in self.items()]
+
+    def items(self):
+        """Get all (key, entry) pairs. This loads all shards.
+        """
+        return self.__match_prefix('')
+
+
+def section_path(completions_path, section):
+    """Get path of index section, stored next to the completions
+    """
+    return completions_path + '.' + section
+
+
+def dump_section(completions_path, section, data):
+    """Store index section next to the completions
+    """
+    dump_pickle(section_path(completions_path, section), data)
+
+
+def dump_pickle(path, data, attempts=5):
+    """Store pickled data atomically, by writing it to a temporary file next
+    to path and renaming that file into place
+    """
+    [root, name] = split(path)
+    [fd, temp_path] = tempfile.mkstemp(prefix='.' + name + '.', dir=root)
+    try:
+        with open(fd, 'bw') as fh:
+            pickle.dump(data, fh, pickle_protocol)
+        for attempt in range(attempts):
+            try:
+                replace(temp_path, path)
+                break
+            except PermissionError:
+                # on Windows, path cannot be replaced while it is being read
+                if attempt == attempts - 1:
+                    raise
+                time.sleep(0.1)
+    except:
+        remove(temp_path)
+        raise
+
+
+class StreamedDict:
+
+    """Dict that is pickled from an iterator of (key, value) pairs, without
+    holding the dict in memory. It is unpickled as an OrderedDict.
+    """
+
+    def __init__(self, items):
+        self.items = items
+
+    def __reduce__(self):
+        # pickle writes the dict items in batches while iterating
+        return (collections.OrderedDict, (), None, None, iter(self.items))
+
+
+def load_section(completions_path, section):
+    """Load index section stored next to the completions
+
+    Returns:
+        The section data, or None if the section is unavailable
+    """
+    path = section_path(completions_path, section)
+    if not isfile(path):
+        return None
+    try:
+        with open(path, 'br') as fh:
+            return pickle.load(fh)
+    except:
+        return None
+
+
+def resolve_references(see_also, completions):
+    """Resolve "see also" references into edges between index entries.
+
+    Args:
+        see_also (dict): Referred function names per lower case function name
+        completions (dict): Completions, with lower case function names as keys
+
+    Returns:
+        dict: 'references' maps every function onto the (lower case) functions
+            it refers to, 'referenced_by' maps every function onto the (lower
+            case) functions that refer to it. Only references to functions in
+            the completions are retained.
+    """
+    references = {}
+    referenced_by = {}
+    for fun in sorted(see_also.keys()):
+        edges = []
+        for ref in see_also[fun]:
+            ref = ref.lower()
+            if ref in completions and not ref == fun and ref not in edges:
+                edges.append(ref)
+        if edges:
+            references[fun] = edges
+        for ref in edges:
+            referenced_by.setdefault(ref, []).append(fun)
+    return {'references': references, 'referenced_by': referenced_by}
+
+
+def build_help_index(matlabroot, help_subdirs):
+    """Index the html help pages in the Matlab installation.
+
+    Args:
+        matlabroot (str): Matlab installation dir
+        help_subdirs (list): Subdirs of toolbox help dirs to index
+
+    Returns:
+        dict: Maps help dirs (relative to <matlabroot>/help) onto dicts that
+            map lower case function names onto help page file names
+    """
+    help_index = {}
+    help_root = join(matlabroot, 'help')
+    if not isdir(help_root):
+        return help_index
+
+    for toolbox in listdir(help_root):
+        for sub in help_subdirs:
+            help_dir = join(toolbox, sub) if sub else toolbox
+            if not isdir(join(help_root, help_dir)):
+                continue
+            pages = {}
+            for f in listdir(join(help_root, help_dir)):
+                if f.lower().endswith('.html'):
+                    pages[f[:-5].lower()] = f
+            if pages:
+                help_index[help_dir] = pages
+
+    return help_index
+
+
+# words that are too common to be searched for
+stop_words = set(['a', 'an', 'and', 'are', 'as', 'at', 'be', 'by', 'for',
+                  'from', 'in', 'is', 'it', 'of', 'on', 'or', 'that', 'the',
+                  'this', 'to', 'with'])
+term_regex = re.compile(r'[a-z][a-z0-9_]*')
+# "see also" section, which may continue up to the next empty line
+see_also_regex = re.compile(r'^[ \t]*see also\b[\s\S]*?(?:\n[ \t]*\n|\Z)',
+                            re.I | re.M)
+
+
+def tokenize(text):
+    """Split text into lower case search terms
+    """
+    return [term for term in term_regex.findall(text.lower())
+            if not term in stop_words]
+
+
+def index_terms(fun, annotation, text):
+    """Count the search terms in the documentation of a function. Terms in
+    the function name and annotation are weighted more heavily. The "see
+    also" section is left out, as it lists other functions.
+
+    Returns:
+        dict: Weighted count per search term
+    """
+    text = see_also_regex.sub('\n', text)
+    terms = {}
+    for field, weight in [(fun, 3), (annotation, 2), (text, 1)]:
+        for term in tokenize(field):
+            terms[term] = terms.get(term, 0) + weight
+    return terms
+
+
+def build_search_index(documents, completions={}):
+    """Build an inverted index for full-text search over documentation.
+
+    Args:
+        documents (dict): Weighted term counts (see index_terms) per lower
+            case function name
+        completions (dict, optional): Completions, to store the name and
+            annotation of every function with the index
+
+    Returns:
+        dict: 'keys' lists the function names, 'lengths' the document length
+            per function, 'postings' maps every term onto a list of
+            (function number, weighted count) and 'terms' lists all terms in
+            sorted order (for prefix search). 'labels' lists the [name,
+            annotation] per function, such that search results can be shown
+            without loading the completions.
+    """
+    keys = [key for key in sorted(documents.keys())
+            if not completions or key in completions]
+    labels = [completions[key][0:2] for key in keys] if completions else []
+    lengths = []
+    postings = {}
+    for i, key in enumerate(keys):
+        terms = documents[key]
+        lengths.append(sum(terms.values()))
+        for term, count in terms.items():
+            postings.setdefault(term, []).append((i, count))
+    return {'keys': keys, 'lengths': lengths, 'postings': postings,
+            'terms': sorted(postings.keys()), 'labels': labels}
+
+
+def search(search_index, query, limit=100, k1=1.2, b=0.75):
+    """Search the inverted index for functions matching the query terms.
+
+    Functions are ranked by the number of matched query terms first, by exact
+    matches of the function name second and by their BM25 score third. The
+    last query term is also matched as prefix, such that incomplete queries
+    yield results.
+
+    Returns:
+        list: Lower case function names, best match first
+    """
+    terms = tokenize(query)
+    keys = search_index.get('keys', [])
+    if not terms or not keys:
+        return []
+    lengths = search_index['lengths']
+    postings = search_index['postings']
+    avg_length = float(sum(lengths)) / len(lengths)
+
+    # expand last term with the terms that it prefixes
+    expansions = [[term] for term in terms[:-1]]
+    sorted_terms = search_index['terms']
+    prefix = terms[-1]
+    expansion = []
+    i = bisect.bisect_left(sorted_terms, prefix)
+    while i < len(sorted_terms) and sorted_terms[i].startswith(prefix) \
+            and len(expansion) < limit:
+        expansion.append(sorted_terms[i])
+        i += 1
+    expansions.append(expansion or [prefix])
+
+    # score documents per query term
+    scores = {}
+    matches = {}
+    for expansion in expansions:
+        matched = set()
+        for term in expansion:
+            posting = postings.get(term, [])
+            if not posting:
+                continue
+            idf = math.log(1 + (len(keys) - len(posting) + 0.5)
+                           / (len(posting) + 0.5))
+            for i, count in posting:
+                scores[i] = scores.get(i, 0) + idf * count * (k1 + 1) \
+                    / (count + k1 * (1 - b + b * lengths[i] / avg_length))
+                matched.add(i)
+        for i in matched:
+            matches[i] = matches.get(i, 0) + 1
+
+    # rank documents, preferring exact matches with the function name
+    ranked = heapq.nlargest(limit, scores.keys(),
+                            key=lambda i: (matches[i], keys[i] in terms,
+                                           scores[i]))
+    return [keys[i] for i in ranked]
+
+
+def build_namespace(completions):
+    """Build a hierarchical namespace index of the completions that are
+    members of packages (+package dirs) or classes (@class dirs).
+
+    Every node is a dict with the 'name' of the namespace part, the
+    completion 'entry' for that name (or None) and the 'children' nodes,
+    indexed by lower case name. As class methods can also be called without
+    qualification, the root node lists the entries of the class methods per
+    lower case method name in 'methods' (see find_methods).
+
+    Returns:
+        dict: Root node of the namespace index
+    """
+    root = {'name': '', 'entry': None, 'children': {}, 'methods': {}}
+    for entry in completions.values():
+        # get namespace parts from mfile path
+        packages, cls = mfun.split_namespace(entry[2])
+        if not (packages or cls):
+            continue
+        fun = entry[0].split('.')[-1]
+        parts = mfun.qualify(entry[2], fun)[1]
+        if cls and not cls.lower() == fun.lower():
+            root['methods'].setdefault(fun.lower(), []).append(entry)
+
+        # add entry to namespace
+        node = root
+        for part in parts:
+            node = node['children'].setdefault(part.lower(), {
+                'name': part, 'entry': None, 'children': {}})
+        node['entry'] = entry
+    return root
+
+
+def find_methods(namespace, name):
+    """Find the class methods with an unqualified (lower case) name
+
+    Returns:
+        list: Completion entries of the methods
+    """
+    return namespace.get('methods', {}).get(name, []) if namespace else []
+
+
+def find_namespace(namespace, qualifier):
+    """Find node in namespace index for a dotted qualifier (pkg.sub)
+
+    Returns:
+        dict: Namespace node, or None if not found
+    """
+    node = namespace
+    for part in qualifier.lower().split('.'):
+        if not node:
+            return None
+        node = node.get('children', {}).get(part)
+    return node
@@ -0,0 +1,198 @@
+"""Compiled Sublime snippet for generating Matlab function documentation.
+
+The snippet contains the following fields, which are replaced when
+documenting a function:
+    ${MDOC_NAME}: function name
+    ${MDOC_SIGNATURE}: function signature
+    ${MDOC_INARG}, ${MDOC_OUTARG}, ${MDOC_ARG}: input/output/all argument(s)
+And the following markers, which mark the lines of the documentation:
+    ${MDOC_NAME_MARKER}, ${MDOC_SIGNATURE_MARKER}, ...: documentation line
+    ${MDOC_INARG_BLOCK_MARKER}, ...: header line of an argument block
+    ${MDOC_INARG_MARKER}, ...: argument line, repeated for every argument
+
+The snippet is validated and parsed once into a DocumentationSnippet. For
+every combination of argument blocks with and without arguments, the lines
+are preprocessed once into a list of segments. Rendering then only walks
+these segments, and shifts the tab stops by a precomputed offset.
+"""
+
+import re
+
+# snippet fields and escapes, see plain_text()
+field_regex = re.compile(r'(?<!\\)\$\{\d+:((?:[^$}\\]|\\.)*)\}')
+variable_regex = re.compile(r'(?<!\\)\$(?:\{\w+\}|\w+)')
+escape_regex = re.compile(r'\\([$}\\])')
+
+
+def plain_text(snip):
+    """Convert rendered snippet into plain text, as if it was inserted
+    without editing its fields: fields are replaced by their placeholders,
+    and variables (such as the markers) by empty strings.
+    """
+    # replace (nested) fields from the inside out
+    count = 1
+    while count:
+        [snip, count] = field_regex.subn(r'\1', snip)
+    snip = variable_regex.sub('', snip)
+    return escape_regex.sub(r'\1', snip)
+
+
+class DocumentationSnippet:
+
+    """Documentation snippet, parsed into segments
+    """
+
+    # argument blocks: [block marker, argument marker, argument field]
+    blocks = [['MDOC_INARG_BLOCK_MARKER', 'MDOC_INARG_MARKER', 'MDOC_INARG'],
+              ['MDOC_OUTARG_BLOCK_MARKER', 'MDOC_OUTARG_MARKER',
+               'MDOC_OUTARG'],
+              ['MDOC_ARG_BLOCK_MARKER', 'MDOC_ARG_MARKER', 'MDOC_ARG']]
+
+    # placeholders for fields in preprocessed snippet: \0<kind><block>\0
+    placeholder = '\0{}{}\0'
+    segment_regex = re.compile(r'\0([NSLA])(\d*)\0|\$\{(\d+):')
+
+    # lines with just markers and sequential empty lines
+    marker_line_regex = re.compile(r'^[%\s]+\${\w+MARKER}', re.M)
+    empty_lines_regex = re.compile(r'^[%\s]+\n^[%\s]+$', re.M)
+
+    def __init__(self, snippet):
+        """Parse and validate the content of a snippet file
+
+        Raises:
+            ValueError: Invalid documentation snippet
+        """
+        # extract documentation snippet content
+        mo = re.search(r'<!\[CDATA\[([\s\S]*)\]]>',
+                       snippet.replace('\r\n', '\n'))
+        if not mo:
+            raise ValueError('Invalid documentation snippet')
+        self.snip = mo.group(1).strip()
+
+        # some validity checks on the documentation snippet
+        if not re.findall(r'^[^\n]*\${MDOC_NAME_MARKER}', self.snip):
+            raise ValueError('${MDOC_NAME_MARKER} is compulsory in first '
+                             'line of documentation snippet.')
+        if not re.findall(r'^\W*\${MDOC_NAME}', self.snip):
+            raise ValueError('${MDOC_NAME} is compulsory as first word of '
+                             'documentation snippet.')
+        mo = re.search(r'^[^\n]*(\${MDOC_\w*_MARKER}).+', self.snip, re.M)
+        if mo:
+            raise ValueError(mo.group(1) + ' should be at end of line in '
+                             'documentation snippet.')
+
+        # preprocessed snippet per combination of blocks with arguments
+        self.cases = {}
+
+    def render(self, signature, fun, inargs, outargs):
+        """Compose documentation snippet for function signature
+
+        Raises:
+            ValueError: Argument line of an argument block is missing
+        """
+        block_args = [inargs, outargs, inargs + outargs]
+        case = tuple(bool(args) for args in block_args)
+        if case not in self.cases:
+            self.cases[case] = self.__preprocess(case)
+        [segments, arg_lines, error] = self.cases[case]
+        if error:
+            raise ValueError(error)
+
+        # tab stops after an argument line shift by the number of extra lines
+        shifts = [[arg_lines[ii][0], len(block_args[ii]) - 1, ii]
+                  for ii in arg_lines if arg_lines[ii][0]]
+
+        def render_segments(segments, k=0, block=None, arg=''):
+            for kind, value in segments:
+                if kind == 'T':
+                    parts.append(value)
+                elif kind == 'I':
+                    # shift tab stop, except for the final tab stop 0
+                    if value:
+                        value += k + sum([shift for first, shift, ii in shifts
+                                          if first < value and ii != block])
+                    parts.append('${{{}:'.format(value))
+                elif kind == 'N':
+                    parts.append(fun)
+                elif kind == 'S':
+                    parts.append(signature)
+                elif kind == 'A':
+                    parts.append(arg)
+                elif kind == 'L':
+                    # repeat argument line for every argument,
+                    # with increasing tab stops
+                    for copy, block_arg in enumerate(block_args[value]):
+                        if copy:
+                            parts.append('\n')
+                        render_segments(arg_lines[value][1], copy, value,
+                                        block_arg)
+
+        parts = []
+        render_segments(segments)
+        return ''.join(parts)
+
+    def __preprocess(self, case):
+        """Preprocess snippet lines for the combination of argument blocks
+        with and without arguments
+
+        Returns:
+            list: [segments, {block: [first tab stop, line segments]}, error]
+        """
+        snip = self.snip.replace('${MDOC_NAME}', self.placeholder.format(
+            'N', '')).replace('${MDOC_SIGNATURE}', self.placeholder.format(
+            'S', ''))
+
+        arg_lines = {}
+        error = None
+        for ii, [block_marker, arg_marker, arg] in enumerate(self.blocks):
+            # check if argument block is specified in documentation snippet
+            if not re.search(r'^.*\${' + block_marker + '}', snip, re.M):
+                continue
+            arg_regex = re.compile(r'^.*\${' + arg_marker + '}.*$', re.M)
+            if case[ii]:
+                mo = arg_regex.search(snip)
+                if not (mo and '${' + arg + '}' in mo.group()):
+                    error = error or 'Argument (marker) field is missing ' \
+                        'for ${' + block_marker + '} of documentation snippet.'
+                    continue
+                # parse argument line and replace it by a placeholder
+                line = mo.group().replace(
+                    '${' + arg + '}', self.placeholder.format('A', ''))
+                segments = self.__parse(line)
+                first = [value for kind, value in segments if kind == 'I']
+                arg_lines[ii] = [first[0] if first else 0, segments]
+                snip = arg_regex.sub(
+                    self.placeholder.format('L', ii).replace('\\', r'\\'),
+                    snip)
+            else:
+                # clear argument related lines
+                snip = arg_regex.sub('', snip)
+                snip = re.sub(r'^.*\${' + block_marker + '}.*$', '', snip,
+                              flags=re.M)
+
+        # remove lines with just markers
+        snip = self.marker_line_regex.sub('%', snip)
+        # remove sequential empty lines
+        snip = self.empty_lines_regex.sub('%', snip)
+
+        return [self.__parse(snip), arg_lines, error]
+
+    def __parse(self, text):
+        """Split text into segments: text (T), tab stop (I), function name
+        (N), signature (S), argument line (L) and argument (A)
+        """
+        segments = []
+        pos = 0
+        for mo in self.segment_regex.finditer(text):
+            if mo.start() > pos:
+                segments.append(['T', text[pos:mo.start()]])
+            if mo.group(3):
+                segments.append(['I', int(mo.group(3))])
+            elif mo.group(1) == 'L':
+                segments.append(['L', int(mo.group(2))])
+            else:
+                segments.append([mo.group(1), None])
+            pos = mo.end()
+        if pos < len(text):
+            segments.append(['T', text[pos:]])
+        return segments
@@ -0,0 +1,444 @@
+"""Recording and offline replay of completion queries.
+
+When `record_completion_queries` is enabled, every completion query in a
+Matlab view is appended to a trace file as a line of json (see
+QueryRecorder), with:
+    time: time (s since epoch) of the query
+    prefix: typed prefix
+    qualifier: package or class qualifier typed in front of the prefix
+    exact: whether an exact match was queried (Ctrl + Space)
+    sizes: number of matlab, project and file completions
+    results: number of completion items returned
+    latency: time (ms) to compose the completion list
+
+The trace can be replayed offline against the completion engine, with a stub
+of the Sublime API (see replay). This compares the latencies of realistic
+typing patterns between versions of AutoMatlab, or between autocompletion
+data:
+
+    python -m AutoMatlab.lib.mtrace <trace> --matlabroot C:\\Matlab\\R2021a
+
+The replayed queries are composed from the prefix and qualifier only, so
+they do not depend on the text of the recorded views. Exact matches parse
+the mfile of the function, which has to exist on the replaying machine.
+"""
+
+import argparse
+import json
+import math
+import os
+import re
+import sys
+import tempfile
+import threading
+import time
+import types
+from os import makedirs, replace
+from os.path import dirname, exists, join, normpath
+
+# recorder settings
+max_trace_size = 10 * 2**20 # trace size (bytes) before it is rotated
+
+
+class QueryRecorder:
+
+    """Recorder of completion queries, appended to a trace file
+    """
+
+    def __init__(self, path, max_size=max_trace_size):
+        self.path = path
+        self.max_size = max_size
+        self.lock = threading.Lock()
+
+    def record(self, prefix, qualifier, exact, sizes, results, latency):
+        """Append completion query to the trace file. Once the trace file is
+        too large, it is rotated to <path>.1, replacing the previous one.
+        Failures are ignored, as recording should never break completions.
+        """
+        line = json.dumps({
+            'time': round(time.time(), 3),
+            'prefix': prefix,
+            'qualifier': qualifier,
+            'exact': exact,
+            'sizes': sizes,
+            'results': results,
+            'latency': round(latency * 1000, 3)}, sort_keys=True) + '\n'
+        with self.lock:
+            try:
+                if not exists(dirname(self.path)):
+                    makedirs(dirname(self.path))
+                with open(self.path, 'a', encoding='utf-8') as fh:
+                    fh.write(line)
+                    size = fh.tell()
+                if size > self.max_size:
+                    replace(self.path, self.path + '.1')
+            except OSError:
+                pass
+
+
+def load_trace(path):
+    """Load recorded completion queries, skipping corrupt lines (e.g. of a
+    session that was killed while writing)
+
+    Returns:
+        list: Recorded queries
+    """
+    queries = []
+    with open(path, encoding='utf-8') as fh:
+        for line in fh:
+            try:
+                query = json.loads(line)
+            except ValueError:
+                continue
+            if type(query) == dict and 'prefix' in query:
+                queries.append(query)
+    return queries
+
+
+def percentile(values, p):
+    """Get percentile p (0-100) of values, by the nearest rank
+    """
+    if not values:
+        return 0
+    values = sorted(values)
+    return values[max(0, int(math.ceil(p / 100 * len(values))) - 1)]
+
+
+def summarize(latencies):
+    """Summarize latencies (ms)
+
+    Returns:
+        dict: Number of queries, mean and percentiles of the latencies
+    """
+    return {
+        'queries': len(latencies),
+        'mean': sum(latencies) / len(latencies) if latencies else 0,
+        'p50': percentile(latencies, 50),
+        'p90': percentile(latencies, 90),
+        'p99': percentile(latencies, 99),
+        'max': max(latencies) if latencies else 0}
+
+
+def install_sublime_stub(package_dir, packages_dir):
+    """Install a stub of the Sublime API, with only the parts used for
+    composing completions. Must be called before AutoMatlab modules are
+    imported.
+
+    Args:
+        package_dir (str): Dir of the AutoMatlab package, to load the
+            package resources from
+        packages_dir (str): Dir laid out as the Sublime Packages dir, to
+            load the generated Matlab completions from
+
+    Returns:
+        dict: Settings, as returned by sublime.load_settings
+    """
+    sublime = types.ModuleType('sublime')
+    sublime_plugin = types.ModuleType('sublime_plugin')
+
+    class Settings(dict):
+        def get(self, key, default=None):
+            return dict.get(self, key, default)
+
+        def set(self, key, value):
+            self[key] = value
+
+        def add_on_change(self, key, on_change):
+            pass
+
+        def clear_on_change(self, key):
+            pass
+
+    class Region:
+        def __init__(self, a, b=None):
+            self.a = a
+            self.b = a if b is None else b
+
+        def begin(self):
+            return min(self.a, self.b)
+
+        def end(self):
+            return max(self.a, self.b)
+
+    class CompletionItem:
+        def __init__(self, trigger, annotation='', completion='',
+                     completion_format=1, kind=None, details=''):
+            self.trigger = trigger
+            self.annotation = annotation
+            self.completion = completion
+            self.kind = kind
+            self.details = details
+
+    class CompletionList:
+        def __init__(self, completions=None, flags=0):
+            self.completions = completions
+            self.flags = flags
+
+    class Phantom:
+        def __init__(self, region, content, layout, on_navigate=None):
+            self.region = region
+            self.content = content
+
+    class PhantomSet:
+        def __init__(self, view, key=''):
+            self.phantoms = []
+
+        def update(self, phantoms):
+            self.phantoms = phantoms
+
+    settings = Settings()
+    # resources of the AutoMatlab package, as Packages/AutoMatlab/<path>
+    resource_prefix = 'Packages/AutoMatlab/'
+
+    def find_resources(pattern):
+        resources = []
+        for root, dirs, files in os.walk(package_dir):
+            if pattern in files:
+                resources.append(resource_prefix + os.path.relpath(
+                    join(root, pattern), package_dir).replace('\\', '/'))
+        return resources
+
+    def load_binary_resource(name):
+        with open(join(package_dir, normpath(name[len(resource_prefix):])),
+                  'rb') as fh:
+            return fh.read()
+
+    sublime.Region = Region
+    sublime.CompletionItem = CompletionItem
+    sublime.CompletionList = CompletionList
+    sublime.Phantom = Phantom
+    sublime.PhantomSet = PhantomSet
+    sublime.load_settings = lambda name: settings
+    sublime.expand_variables = lambda value, variables: value
+    sublime.packages_path = lambda: packages_dir
+    sublime.cache_path = tempfile.gettempdir
+    sublime.find_resources = find_resources
+    sublime.load_binary_resource = load_binary_resource
+    # background work (such as verifying completions) is never run, as it
+    # would skew the replayed latencies
+    sublime.set_timeout = lambda callback, delay=0: None
+    sublime.set_timeout_async = lambda callback, delay=0: None
+    sublime.active_window = lambda: None
+    for name, value in [('COMPLETION_FORMAT_SNIPPET', 1),
+                        ('KIND_ID_FUNCTION', 3), ('KIND_ID_NAMESPACE', 4),
+                        ('KIND_ID_SNIPPET', 8),
+                        ('KIND_SNIPPET', (8, 's', 'Snippet')),
+                        ('INHIBIT_WORD_COMPLETIONS', 8),
+                        ('INHIBIT_EXPLICIT_COMPLETIONS', 16),
+                        ('INHIBIT_REORDER', 128),
+                        ('COOPERATE_WITH_AUTO_COMPLETE', 2),
+                        ('LAYOUT_INLINE', 0)]:
+        setattr(sublime, name, value)
+
+    for name in ['EventListener', 'TextCommand', 'WindowCommand',
+                 'ViewEventListener', 'TextChangeListener']:
+        setattr(sublime_plugin, name, type(name, (), {
+            '__init__': lambda self, *args: None}))
+
+    sys.modules['sublime'] = sublime
+    sys.modules['sublime_plugin'] = sublime_plugin
+    return settings
+
+
+class ReplayWindow:
+
+    """Stub of a Sublime window, with a single folder open
+    """
+
+    def __init__(self, folder=None):
+        self.folder = folder
+
+    def extract_variables(self):
+        if self.folder:
+            return {'folder': self.folder, 'file_path': self.folder}
+        return {}
+
+    def folders(self):
+        return [self.folder] if self.folder else []
+
+    def project_data(self):
+        return None
+
+    def status_message(self, msg):
+        pass
+
+
+class ReplayView:
+
+    """Stub of a Sublime view, containing the line typed for a query
+    """
+
+    def __init__(self, window, text):
+        self._window = window
+        self.text = text
+
+    def window(self):
+        return self._window
+
+    def match_selector(self, point, selector):
+        return True
+
+    def substr(self, region):
+        return self.text[region.begin():region.end()]
+
+    def line(self, point):
+        return sys.modules['sublime'].Region(0, len(self.text))
+
+    def is_popup_visible(self):
+        return False
+
+    def show_popup(self, *args, **kwargs):
+        pass
+
+    def hide_popup(self):
+        pass
+
+
+def check_sublime_stub(modules):
+    """Check that the Sublime stub provides all Sublime API functions and
+    constants that the modules use
+
+    Raises:
+        ValueError: Sublime API used that is missing in the stub
+    """
+    sublime = sys.modules['sublime']
+    missing = set()
+    for module in modules:
+        with open(module.__file__, encoding='utf-8') as fh:
+            names = re.findall(r'\bsublime\.([A-Za-z_]\w*)', fh.read())
+        missing.update([name for name in names if not hasattr(sublime, name)])
+    if missing:
+        raise ValueError('Sublime stub of replay lacks: {}'.format(
+            ', '.join(sorted(missing))))
+
+
+def replay(queries, folder=None):
+    """Replay recorded completion queries against the completion engine.
+    The Sublime stub has to be installed first (see install_sublime_stub).
+
+    Returns:
+        list: [latency (ms), number of results] per query
+    """
+    import AutoMatlab.am_completions_listen as am_completions_listen
+    am_completions_listen.plugin_loaded()
+    am_completions_listen.plugin_unloaded()
+    check_sublime_stub([am_completions_listen, am_completions_listen.config,
+                        sys.modules['AutoMatlab.lib.abspath']])
+
+    # replay without verifying the completions in the background
+    listener = am_completions_listen.AutoMatlabCompletionsListener(False)
+    window = ReplayWindow(folder)
+    # load completions up front, as they are loaded once per session
+    listener.load_matlab_completions(window)
+    if folder:
+        listener.load_project_completions(folder, {}, [folder])
+
+    results = []
+    for query in queries:
+        qualifier = query.get('qualifier') or ''
+        text = qualifier + '.' + query['prefix'] if qualifier \
+            else query['prefix']
+        view = ReplayView(window, text)
+        listener.check_exact_match = bool(query.get('exact'))
+        start = time.perf_counter()
+        cl = listener.on_query_completions(view, query['prefix'], [len(text)])
+        latency = time.perf_counter() - start
+        results.append([latency * 1000, len(getattr(cl, 'completions', cl))])
+    return results
+
+
+def main(argv=None):
+    """Replay a completion trace from the command line
+    """
+    parser = argparse.ArgumentParser(
+        prog='python -m AutoMatlab.lib.mtrace',
+        description='Replay recorded completion queries offline, and '
+        'report their latencies.')
+    parser.add_argument('trace', help='trace file recorded with '
+                        'record_completion_queries')
+    parser.add_argument('--matlabroot', help='Matlab installation dir, to '
+                        'use its Matlab completions (default: the default '
+                        'Matlab completions)')
+    parser.add_argument('--packages', help='dir the completions are stored '
+                        'in, laid out as the Sublime Packages dir (default: '
+                        'the dir containing AutoMatlab)')
+    parser.add_argument('--settings', help='AutoMatlab settings file with '
+                        'the autocompletion settings')
+    parser.add_argument('--folder', help='folder to use for the current '
+                        'folder completions')
+    parser.add_argument('--repeat', type=int, default=1, help='number of '
+                        'times to replay the trace, keeping the fastest '
+                        'latency per query')
+    parser.add_argument('--save', help='store the summary as json, to '
+                        'serve as baseline later')
+    parser.add_argument('--baseline', help='summary stored earlier: fail if '
+                        'the median or p90 latency regressed')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed '
+                        'relative latency increase wrt the baseline '
+                        '(default: 0.25)')
+    args = parser.parse_args(argv)
+
+    package_dir = dirname(dirname(os.path.abspath(__file__)))
+    packages_dir = os.path.abspath(args.packages) if args.packages \
+        else dirname(package_dir)
+    settings = install_sublime_stub(package_dir, packages_dir)
+    from AutoMatlab.lib.mbuild import load_settings
+    try:
+        queries = load_trace(args.trace)
+        if args.settings:
+            settings.update(load_settings(args.settings))
+        if args.matlabroot:
+            settings['matlabroot'] = os.path.abspath(args.matlabroot)
+        settings['record_completion_queries'] = False
+        folder = args.folder and os.path.abspath(args.folder)
+        runs = [replay(queries, folder) for ii in range(max(1, args.repeat))]
+        baseline = None
+        if args.baseline:
+            with open(args.baseline, encoding='utf-8') as fh:
+                baseline = json.load(fh)
+    except (OSError, ValueError) as e:
+        print('[ERROR] AutoMatlab - {}'.format(e), file=sys.stderr)
+        return 1
+    if not queries:
+        print('[WARNING] AutoMatlab - No completion queries found in trace.')
+        return 0
+
+    # report recorded and replayed latencies
+    latencies = [min(run[ii][0] for run in runs)
+                 for ii in range(len(queries))]
+    recorded = summarize([query.get('latency', 0) for query in queries])
+    replayed = summarize(latencies)
+    mismatches = sum(1 for query, [latency, count] in zip(queries, runs[0])
+                     if query.get('results') != count)
+    print('{} queries ({} exact, {} qualified)'.format(
+        len(queries), sum(1 for query in queries if query.get('exact')),
+        sum(1 for query in queries if query.get('qualifier'))))
+    print('{:<10}{:>12}{:>12}'.format('ms', 'recorded', 'replayed'))
+    for key in ['mean', 'p50', 'p90', 'p99', 'max']:
+        print('{:<10}{:>12.3f}{:>12.3f}'.format(key, recorded[key],
+                                                replayed[key]))
+    if mismatches:
+        print('{} queries returned a different number of completions than '
+              'recorded (different autocompletion data?)'.format(mismatches))
+
+    if args.save:
+        with open(args.save, 'w', encoding='utf-8') as fh:
+            json.dump(replayed, fh, indent=1, sort_keys=True)
+
+    # compare with baseline
+    if baseline:
+        regressed = [key for key in ['p50', 'p90']
+                     if replayed[key] > baseline.get(key, 0)
+                     * (1 + args.tolerance)]
+        for key in regressed:
+            print('[ERROR] AutoMatlab - {} latency regressed: {:.3f} ms '
+                  '(baseline {:.3f} ms)'.format(key, replayed[key],
+                                                baseline[key]),
+                  file=sys.stderr)
+        if regressed:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
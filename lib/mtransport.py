@@ -0,0 +1,242 @@
+"""Transports for running commands in Matlab.
+
+AutoHotkeyTransport: Types or pastes every command into the Matlab Command
+    Window, by running an AutoHotkey script.
+SessionTransport: Keeps a Matlab session (or any other interpreter that reads
+    commands from stdin) running as child process, and writes commands to its
+    stdin. Commands are queued and written by a worker thread, such that
+    sending a command does not block. The output of the session is streamed
+    back. After every command, a marker command is written that prints an
+    end-of-command marker, which signals that the command has finished.
+"""
+
+import re
+import codecs
+import queue
+import subprocess
+import threading
+
+
+class Transport:
+
+    """Base class of the transports for running commands in Matlab
+    """
+
+    def send(self, command, command_type='text'):
+        """Run command in Matlab
+
+        Args:
+            command (str): Matlab command
+            command_type (str): Type of command: text, paste, insert or key
+        """
+        raise NotImplementedError
+
+    def is_alive(self):
+        """Can the transport still be used?
+        """
+        return True
+
+    def close(self):
+        """Release resources of the transport
+        """
+        pass
+
+
+class AutoHotkeyTransport(Transport):
+
+    """Run commands in Matlab via AutoHotkey
+    """
+
+    def __init__(self, ahk_path, script_path, return_focus=True,
+                 sleep_multiplier=1, paste=True):
+        self.ahk_path = ahk_path
+        self.script_path = script_path
+        self.return_focus = return_focus
+        self.sleep_multiplier = sleep_multiplier
+        self.paste = paste
+
+    def send(self, command, command_type='text'):
+        """Run command in Matlab by starting the AutoHotkey script
+        """
+        if command_type == 'text':
+            command_type = 'paste' if self.paste else 'insert'
+        subprocess.Popen([self.ahk_path,
+                          self.script_path,
+                          command,
+                          command_type,
+                          '1' if self.return_focus else '0',
+                          str(self.sleep_multiplier)])
+
+
+class SessionTransport(Transport):
+
+    """Run commands in a persistent Matlab session
+    """
+
+    # size of the chunks read from stdout/stderr
+    chunk_size = 4096
+
+    # end-of-command marker, printed by the marker command
+    marker = '<<<auto_matlab:{}>>>'
+    marker_regex = re.compile(r'<<<auto_matlab:(\d+)>>>[ \t]*(\r?\n|$)')
+
+    def __init__(self, cmd, cwd=None, on_send=None, on_output=None,
+                 on_done=None, marker_command='', encoding='utf-8'):
+        """Start session
+
+        Args:
+            cmd (list): Command line to start the session
+            cwd (str, optional): Working directory of the session
+            on_send (function, optional): Called as on_send(id, command)
+                with every command, before it is queued to be written
+            on_output (function, optional): Called as on_output(stream, text)
+                with every chunk of text read from 'stdout' or 'stderr'
+            on_done (function, optional): Called as on_done(id) when the
+                command with id (as returned by send) has finished
+            marker_command (str, optional): Command that prints its {marker}
+                argument, e.g. disp('{marker}'), to detect finished commands
+            encoding (str, optional): Encoding of stdin/stdout/stderr
+        """
+        self.on_send = on_send
+        self.on_output = on_output
+        self.on_done = on_done
+        self.marker_command = marker_command
+        self.encoding = encoding
+        self.count = 0 # number of sent commands
+        self.commands = queue.Queue()
+        self.process = subprocess.Popen(
+            cmd, cwd=cwd, bufsize=0,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            startupinfo=self.__startupinfo())
+
+        # start worker threads
+        self.threads = [
+            threading.Thread(target=self.__write),
+            threading.Thread(target=self.__read,
+                             args=('stdout', self.process.stdout)),
+            threading.Thread(target=self.__read,
+                             args=('stderr', self.process.stderr))]
+        for thread in self.threads:
+            thread.daemon = True
+            thread.start()
+
+    def send(self, command, command_type='text'):
+        """Queue command to be written to the session
+
+        Returns:
+            int: Id of the command
+        """
+        if command_type == 'key':
+            raise ValueError('Keyboard commands cannot be sent to a Matlab '
+                             'session')
+        if not self.is_alive():
+            raise RuntimeError('Matlab session has ended')
+        self.count += 1
+        if self.on_send:
+            # register command before its output or marker can be read
+            self.on_send(self.count, command)
+        self.commands.put((self.count, command))
+        return self.count
+
+    def is_alive(self):
+        """Is the session still running?
+        """
+        return self.process.poll() is None
+
+    def close(self):
+        """Stop session
+        """
+        self.commands.put(None)
+        if self.is_alive():
+            try:
+                self.process.terminate()
+            except OSError:
+                pass
+
+    def __write(self):
+        """Write queued commands to the session
+        """
+        while True:
+            item = self.commands.get()
+            if item is None:
+                break
+            [id, command] = item
+            if self.marker_command:
+                command += '\n' + self.marker_command.format(
+                    marker=self.marker.format(id))
+            try:
+                self.process.stdin.write(
+                    (command + '\n').encode(self.encoding))
+                self.process.stdin.flush()
+            except (OSError, ValueError):
+                # session has ended
+                break
+
+    def __read(self, stream, fh):
+        """Read output of the session incrementally
+        """
+        decoder = codecs.getincrementaldecoder(self.encoding)('replace')
+        pending = ''
+        newline = False # whether to strip newline that ends a marker
+        while True:
+            try:
+                data = fh.read(self.chunk_size)
+            except (OSError, ValueError):
+                data = b''
+            if not data:
+                if pending and self.on_output:
+                    self.on_output(stream, pending)
+                break
+            text = pending + decoder.decode(data)
+            pending = ''
+
+            if not (stream == 'stdout' and self.marker_command):
+                if self.on_output:
+                    self.on_output(stream, text)
+                continue
+
+            # strip newline of marker at the end of the previous chunk
+            if newline and text:
+                text = re.sub(r'^\r?\n', '', text)
+                newline = False
+
+            # hold back incomplete marker at the end
+            split = self.__partial_marker(text)
+            [text, pending] = [text[:split], text[split:]]
+
+            # strip markers and signal finished commands in order
+            pos = 0
+            for mo in self.marker_regex.finditer(text):
+                if mo.start() > pos and self.on_output:
+                    self.on_output(stream, text[pos:mo.start()])
+                if self.on_done:
+                    self.on_done(int(mo.group(1)))
+                pos = mo.end()
+                newline = not mo.group(2)
+            if pos < len(text) and self.on_output:
+                self.on_output(stream, text[pos:])
+
+    def __partial_marker(self, text):
+        """Get start of a possibly incomplete marker at the end of text
+        """
+        head = self.marker.split('{}')[0]
+        start = text.find('<', max(0, len(text) - len(self.marker) - 20))
+        while start >= 0:
+            tail = text[start:]
+            if head.startswith(tail) or (tail.startswith(head)
+                    and re.match(r'\d*>{0,2}$', tail[len(head):])):
+                return start
+            start = text.find('<', start + 1)
+        return len(text)
+
+    @staticmethod
+    def __startupinfo():
+        """Hide the console window of the session on Windows
+        """
+        if hasattr(subprocess, 'STARTUPINFO'):
+            startupinfo = subprocess.STARTUPINFO()
+            startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
+            return startupinfo
+        return None